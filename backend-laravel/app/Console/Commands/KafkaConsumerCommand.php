@@ -6,6 +6,7 @@
 use App\Events\ImageProcessed;
 use App\Models\ImageUpload;
 use App\MoonShine\Resources\ImageUploadResource;
+use App\Services\ResultMessageDeserializer;
 use App\Traits\JsonArrayTrait;
 use Illuminate\Console\Command;
 use Junges\Kafka\Facades\Kafka;
@@ -38,20 +39,51 @@ public function handle()
     {
         $this->info("Listening for messages from Kafka...");
 
+        // One message per image (schema v2, see python-ml/result_schema.py): detections are
+        // rows of "detection_fields", "geolocation" is the best position for the whole image.
+        // Videos send one message per keyframe ("frame"); they are collected under "frames",
+        // one entry per frame index in index order, and the user is notified once the last one
+        // arrived. With POSTGIS_DSN on the worker the rows are already written and the message
+        // is a notification ("stored": "postgis").
         Kafka::consumer([config('kafka.output_topic')])
+            ->usingDeserializer(new ResultMessageDeserializer())
             ->withHandler(function ($message) {
                 $body = $message->getBody();
                 try {
                     $upload = ImageUpload::query()->find($body['image_id']);
 
                     if ($upload) {
-                        $upload->update([
-                            'status' => StatusEnum::SUCCESS->value,
-                            'result' => $this->toJsonWithTrait($body),
-                            'latitude' => $body['geolocation']['lat'],
-                            'longitude' => $body['geolocation']['lat'],
-                            'updated_at' => now(),
-                        ]);
+                        $geolocation = $body['geolocation'] ?? null;
+                        $frame = $body['frame'] ?? null;
+                        $result = $body;
+                        if ($frame !== null) {
+                            $result = $this->toArrayWithTrait($upload->result);
+                            if (!isset($result['frames'])) {
+                                $result = ['frames' => []];
+                            }
+                            // keyed by frame index: a redelivered frame message replaces its first copy
+                            $frames = array_values(array_filter(
+                                $result['frames'],
+                                fn ($f) => ($f['frame']['index'] ?? null) !== $frame['index']
+                            ));
+                            $frames[] = $body;
+                            usort($frames, fn ($a, $b) => ($a['frame']['index'] ?? 0) <=> ($b['frame']['index'] ?? 0));
+                            $result['frames'] = $frames;
+                        }
+                        $done = $frame === null || !empty($frame['last']);
+                        // rows written in bulk by the worker's PostGIS sink are only notified about
+                        if (empty($body['stored'])) {
+                            $upload->update([
+                                'status' => $done ? StatusEnum::SUCCESS->value : $upload->status,
+                                'result' => $this->toJsonWithTrait($result),
+                                'latitude' => $geolocation['lat'] ?? $upload->latitude,
+                                'longitude' => $geolocation['lon'] ?? $upload->longitude,
+                                'updated_at' => now(),
+                            ]);
+                        }
+                        if (!$done) {
+                            return;
+                        }
                         $resource = app(ImageUploadResource::class);
                         $url = $resource->getDetailPageUrl($upload->id);
                         MoonShineNotification::send(
@@ -76,7 +108,7 @@ public function handle()
                 } catch (\Throwable $e) {
                     logger()->error('Kafka handler error: ' . $e->getMessage(), ['trace' => $e->getTraceAsString()]);
                 }
-                $this->info("Received: " . json_encode($body));
+                $this->info('Received: ' . ($body['image_id'] ?? 'null') . ', ' . ($body['detection_count'] ?? count($body['detections'] ?? [])) . ' detections');
             })
             ->build()
             ->consume();
@@ -5,13 +5,27 @@
 
 class KafkaProducer
 {
+    /**
+     * Publish an image task for the ML worker.
+     *
+     * The worker deduplicates detections across the frames of a flight (metadata
+     * flight_id / session_id) with per-process state, so all frames of one flight must
+     * reach the same partition: they are keyed by the flight. Other tasks are unkeyed.
+     */
     public function send(string $imageId, string $image_url, array $metadata = []): void
     {
-        Kafka::asyncPublish()
+        $producer = Kafka::asyncPublish()
             ->onTopic(config('kafka.input_topic'))
             ->withBodyKey('image_id', $imageId)
             ->withBodyKey('image_url', $image_url)
-            ->withBodyKey('metadata', $metadata)
-            ->send();
+            ->withBodyKey('metadata', $metadata);
+
+        // same precedence as ml_geolocate.tracking_session()
+        $flight = ($metadata['flight_id'] ?? null) ?: ($metadata['session_id'] ?? null);
+        if ($flight) {
+            $producer = $producer->withKafkaKey((string)$flight);
+        }
+
+        $producer->send();
     }
 }
@@ -0,0 +1,43 @@
+<?php
+
+namespace App\Services;
+
+use Junges\Kafka\Contracts\ConsumerMessage;
+use Junges\Kafka\Contracts\MessageDeserializer;
+
+/**
+ * Decodes ML result messages by their headers:
+ * content-encoding: gzip (optional), content-type: application/json | application/msgpack.
+ * Messages without headers are treated as plain JSON.
+ */
+class ResultMessageDeserializer implements MessageDeserializer
+{
+    public function deserialize(ConsumerMessage $message): ConsumerMessage
+    {
+        $headers = $message->getHeaders() ?? [];
+        $body = $message->getBody();
+
+        if (($headers['content-encoding'] ?? null) === 'gzip') {
+            $body = gzdecode($body);
+        }
+
+        if (($headers['content-type'] ?? null) === 'application/msgpack') {
+            if (!function_exists('msgpack_unpack')) {
+                throw new \RuntimeException('msgpack extension is not installed');
+            }
+            $body = msgpack_unpack($body);
+        } else {
+            $body = json_decode($body, true, 512, JSON_THROW_ON_ERROR);
+        }
+
+        return app(ConsumerMessage::class, [
+            'topicName' => $message->getTopicName(),
+            'partition' => $message->getPartition(),
+            'headers' => $headers,
+            'body' => $body,
+            'key' => $message->getKey(),
+            'offset' => $message->getOffset(),
+            'timestamp' => $message->getTimestamp(),
+        ]);
+    }
+}
@@ -0,0 +1,57 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\DB;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration {
+    /**
+     * Run the migrations.
+     *
+     * Geometry columns written in bulk by the ML worker's PostGIS sink (python-ml/postgis_sink.py).
+     */
+    public function up(): void
+    {
+        DB::statement('CREATE EXTENSION IF NOT EXISTS postgis');
+
+        DB::statement('ALTER TABLE image_uploads ADD COLUMN location geometry(Point, 4326)');
+        DB::statement('CREATE INDEX image_uploads_location_gist ON image_uploads USING GIST (location)');
+
+        Schema::create('image_upload_detections', function (Blueprint $table) {
+            $table->id();
+            $table->foreignId('image_upload_id')
+                ->constrained('image_uploads')
+                ->cascadeOnDelete()
+                ->cascadeOnUpdate();
+            $table->string('detection_key');
+            $table->double('frame_t')->nullable();
+            $table->string('label')->nullable();
+            $table->integer('x')->nullable();
+            $table->integer('y')->nullable();
+            $table->integer('w')->nullable();
+            $table->integer('h')->nullable();
+            $table->double('confidence')->nullable();
+            $table->double('error_radius_m')->nullable();
+            $table->string('method')->nullable();
+            $table->text('ocr_text')->nullable();
+            $table->text('address')->nullable();
+            $table->string('object_id')->nullable();
+            $table->timestamps();
+
+            $table->unique(['image_upload_id', 'detection_key']);
+        });
+        DB::statement('ALTER TABLE image_upload_detections ADD COLUMN geom geometry(Point, 4326)');
+        DB::statement('CREATE INDEX image_upload_detections_geom_gist ON image_upload_detections USING GIST (geom)');
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        Schema::dropIfExists('image_upload_detections');
+        DB::statement('DROP INDEX IF EXISTS image_uploads_location_gist');
+        DB::statement('ALTER TABLE image_uploads DROP COLUMN IF EXISTS location');
+    }
+};
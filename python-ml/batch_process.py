@@ -0,0 +1,286 @@
+"""
+Offline batch processing of image archives without Kafka.
+
+Inputs (any mix, several allowed):
+- a directory (searched recursively for .jpg/.jpeg/.png/.tif/.tiff)
+- a glob pattern, e.g. '/data/flight_*/DJI_*.JPG'
+- a JSONL manifest, one entry per line:
+      {"path": "/data/f1/DJI_0001.JPG", "ins": {"lat": .., "lon": .., "alt_m": .., "yaw": .., ...}}
+  optional "id" (defaults to the path) and "metadata" (merged with "ins")
+- a single image file
+
+process_image_bytes runs in a process pool; each worker loads the model once. Results
+are appended to the output JSONL as they complete (completion order), one line per image:
+    {"id", "path", "status": "ok"|"error", "elapsed_ms", "result"|"error"}
+Cross-frame dedup of flights (TRACK_OBJECTS) is off: every detection is written.
+Images that can't be decoded or detected are written with status "error". Rerunning
+with the same --output skips ids already written (resume, after cutting a partial last
+line); --retry-failed reprocesses the ones that failed.
+
+    python batch_process.py /data/archive --output results.jsonl --workers 8
+    python batch_process.py manifest.jsonl --output results.jsonl
+    python batch_process.py photo.jpg --metadata '{"ins": {...}}'      # prints to stdout
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, Any, Iterator, List, Optional, Set
+
+logger = logging.getLogger("batch_process")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff")
+
+
+# -------------------------
+# Inputs
+# -------------------------
+def _entry(path: str, metadata: Dict[str, Any], entry_id: Optional[str] = None) -> Dict[str, Any]:
+    return {"id": entry_id or path, "path": path, "metadata": metadata}
+
+
+def _read_manifest(path: str, default_metadata: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                logger.warning("%s:%d: invalid JSON, skipped", path, lineno)
+                continue
+            image_path = item.get("path")
+            if not image_path:
+                logger.warning("%s:%d: no 'path', skipped", path, lineno)
+                continue
+            if not os.path.isabs(image_path):
+                image_path = os.path.join(base, image_path)
+            metadata = dict(default_metadata)
+            metadata.update(item.get("metadata") or {})
+            if item.get("ins"):
+                metadata["ins"] = item["ins"]
+            yield _entry(image_path, metadata, item.get("id"))
+
+
+def iter_entries(inputs: List[str], default_metadata: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    for spec in inputs:
+        if os.path.isdir(spec):
+            for dirpath, dirnames, files in os.walk(spec):
+                dirnames.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield _entry(os.path.join(dirpath, name), default_metadata)
+        elif spec.endswith(".jsonl") and os.path.isfile(spec):
+            yield from _read_manifest(spec, default_metadata)
+        elif os.path.isfile(spec):
+            yield _entry(spec, default_metadata)
+        else:
+            matches = sorted(glob.glob(spec, recursive=True))
+            if not matches:
+                logger.warning("No images match %s", spec)
+            for path in matches:
+                if os.path.isfile(path):
+                    yield _entry(path, default_metadata)
+
+
+def completed_ids(output: str, retry_failed: bool) -> Set[str]:
+    """Ids already in the output file (for resume)."""
+    done: Set[str] = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue  # torn last line of an interrupted run
+            if retry_failed and row.get("status") != "ok":
+                continue
+            done.add(row.get("id"))
+    return done
+
+
+def drop_torn_line(output: str):
+    """Cut an unterminated last line (interrupted run) so appended rows start on their own line."""
+    with open(output, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        if not end:
+            return
+        f.seek(end - 1)
+        if f.read(1) == b"\n":
+            return
+        pos = end
+        while pos > 0:
+            step = min(pos, 65536)
+            pos -= step
+            f.seek(pos)
+            nl = f.read(step).rfind(b"\n")
+            if nl >= 0:
+                pos += nl + 1
+                break
+        f.truncate(pos)
+        logger.warning("Dropped a partial last line (%d bytes) from %s", end - pos, output)
+
+
+# -------------------------
+# Worker process
+# -------------------------
+def _init_worker(threads: int):
+    import ml_geolocate
+    if threads > 0:
+        ml_geolocate.set_compute_threads(threads)
+    # cross-frame dedup state is per process and depends on which worker saw which frame
+    # first; offline output must be complete and reproducible, so every detection is kept
+    ml_geolocate.TRACK_OBJECTS = False
+    ml_geolocate.load_model()
+    ml_geolocate.init_backends()
+
+
+def process_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    import ml_geolocate
+    start = time.perf_counter()
+    row = {"id": entry["id"], "path": entry["path"]}
+    try:
+        with open(entry["path"], "rb") as f:
+            data = f.read()
+        row["result"] = ml_geolocate.process_image_bytes(data, metadata=entry["metadata"])
+        # undecodable / failed images come back as empty results flagged with "error"
+        row["status"] = "error" if row["result"].get("error") else "ok"
+        if row["status"] == "error":
+            row["error"] = row["result"]["error"]
+    except Exception as e:
+        row["status"] = "error"
+        row["error"] = f"{type(e).__name__}: {e}"
+    row["elapsed_ms"] = round((time.perf_counter() - start) * 1000.0, 1)
+    return row
+
+
+# -------------------------
+# Driver
+# -------------------------
+class Progress:
+    def __init__(self, total: int, interval_s: float):
+        self.total = total
+        self.interval_s = interval_s
+        self.done = 0
+        self.failed = 0
+        self.gated = {"skip": 0, "degrade": 0}
+        self.elapsed_ms = {"skip": 0.0, "full": 0.0}
+        self.full = 0
+        self.start = time.monotonic()
+        self._last = self.start
+
+    def saved_s(self) -> Optional[float]:
+        """Quality gate: time skipped images would have taken at the average cost of a full one."""
+        if not self.full:
+            return None
+        per_image = self.elapsed_ms["full"] / self.full
+        return round((per_image * self.gated["skip"] - self.elapsed_ms["skip"]) / 1000.0, 1)
+
+    def update(self, row: Dict[str, Any], force: bool = False):
+        if row is not None:
+            self.done += 1
+            self.failed += row["status"] != "ok"
+            gate = (row.get("result") or {}).get("gate")
+            if gate is not None:
+                self.gated[gate["action"]] += 1
+            if row["status"] == "ok" and (gate is None or gate["action"] == "skip"):
+                self.elapsed_ms["skip" if gate else "full"] += row["elapsed_ms"]
+                self.full += gate is None
+        now = time.monotonic()
+        if not force and now - self._last < self.interval_s:
+            return
+        self._last = now
+        elapsed = now - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else float("inf")
+        logger.info("%d/%d images (%.1f%%), %d failed, %.2f img/s, elapsed %.0fs, eta %.0fs",
+                    self.done, self.total, 100.0 * self.done / max(1, self.total), self.failed, rate, elapsed, eta)
+
+
+def run(inputs: List[str], output: str, workers: int, threads: int, metadata: Dict[str, Any],
+        resume: bool = True, retry_failed: bool = False, max_pending: int = 0,
+        progress_interval_s: float = 10.0) -> Dict[str, Any]:
+    to_stdout = output == "-"
+    skip = completed_ids(output, retry_failed) if resume and not to_stdout else set()
+    if resume and not to_stdout and os.path.exists(output):
+        drop_torn_line(output)
+    entries = [e for e in iter_entries(inputs, metadata) if e["id"] not in skip]
+    logger.info("%d images to process, %d already done", len(entries), len(skip))
+
+    out = sys.stdout if to_stdout else open(output, "a" if resume else "w", encoding="utf-8")
+    progress = Progress(len(entries), progress_interval_s)
+    max_pending = max_pending or workers * 4  # keeps the pool busy without materializing all futures
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(threads,)) as pool:
+            pending = set()
+            it = iter(entries)
+            exhausted = False
+            while pending or not exhausted:
+                while not exhausted and len(pending) < max_pending:
+                    entry = next(it, None)
+                    if entry is None:
+                        exhausted = True
+                        break
+                    pending.add(pool.submit(process_entry, entry))
+                if not pending:
+                    break
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    row = fut.result()
+                    out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    progress.update(row)
+                out.flush()
+    finally:
+        if not to_stdout:
+            out.close()
+    progress.update(None, force=True)
+    elapsed = time.monotonic() - progress.start
+    return {"processed": progress.done, "failed": progress.failed, "skipped": len(skip),
+            "elapsed_s": round(elapsed, 1), "images_per_s": round(progress.done / elapsed, 3) if elapsed else None,
+            "gate_skipped": progress.gated["skip"], "gate_degraded": progress.gated["degrade"],
+            "gate_saved_s": progress.saved_s()}
+
+
+def _load_metadata(value: Optional[str]) -> Dict[str, Any]:
+    if not value:
+        return {}
+    if os.path.isfile(value):
+        with open(value, encoding="utf-8") as f:
+            return json.load(f)
+    return json.loads(value)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Run process_image_bytes over directories, globs or JSONL manifests")
+    parser.add_argument("inputs", nargs="+", help="directories, glob patterns, .jsonl manifests or image files")
+    parser.add_argument("--output", "-o", default="-", help="results JSONL (default stdout, no resume)")
+    parser.add_argument("--workers", "-j", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=0,
+                        help="compute threads per worker (default cpu_count // workers)")
+    parser.add_argument("--metadata", help="default metadata for every image, JSON string or file (e.g. {\"ins\": ...})")
+    parser.add_argument("--no-resume", action="store_true", help="overwrite --output instead of skipping done ids")
+    parser.add_argument("--retry-failed", action="store_true", help="on resume, reprocess entries that failed")
+    parser.add_argument("--max-pending", type=int, default=0, help="submitted but unfinished images (default 4 x workers)")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="seconds between progress lines")
+    args = parser.parse_args(argv)
+
+    workers = max(1, args.workers)
+    threads = args.threads or max(1, (os.cpu_count() or 1) // workers)
+    summary = run(args.inputs, args.output, workers, threads, _load_metadata(args.metadata),
+                  resume=not args.no_resume, retry_failed=args.retry_failed, max_pending=args.max_pending,
+                  progress_interval_s=args.progress_interval)
+    logger.info("Done: %s", json.dumps(summary))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", stream=sys.stderr)
+    sys.exit(main())
@@ -0,0 +1,414 @@
+"""
+Throughput benchmark for ml_geolocate and the worker message path.
+
+Runs fully in-process: a synthetic JPEG corpus is generated in memory and the
+worker talks to fake S3 / Kafka stand-ins, so no docker-compose stack is needed.
+Reverse geocoding is replaced by a stub (optionally with simulated latency) so the
+numbers don't depend on Nominatim.
+
+Usage:
+    python benchmark.py                       # all benchmarks, JSON to stdout
+    python benchmark.py --only decode,e2e --iterations 50 --output bench.json
+    python benchmark.py --sizes 1024x768,6000x4000 --many-detections 300
+    python benchmark.py --only detectors --detector-images /data/val \
+        --detectors ultralytics=/app/models/yolov8n.pt,onnx=/app/models/yolov8n.onnx,onnx=/app/models/yolov8n.int8.onnx
+
+Output (machine readable, compare between PRs):
+    {"env": {...}, "results": {"decode[6000x4000]": {"images_per_s": .., "p50_ms": ..,
+     "p99_ms": .., "n": .., "peak_rss_mb": ..}, ...}}
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+from io import BytesIO
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from PIL.TiffImagePlugin import IFDRational
+
+import ml_geolocate
+from detectors import box_iou, create_detector
+
+ALL_BENCHMARKS = ("decode", "exif", "detect", "projection", "ocr", "e2e", "pipeline", "detectors")
+
+# the camera looks along +z of its frame, so pitch 180 is nadir; 170 is a slightly oblique
+# downward view whose rays all hit the ground
+SAMPLE_INS = {"lat": 55.752023, "lon": 37.617499, "alt_m": 60.0, "yaw": 10.0,
+              "pitch": 170.0, "roll": 0.0, "focal_mm": 35.0, "sensor_mm": 36.0}
+
+
+# -------------------------
+# Synthetic corpus
+# -------------------------
+def _dms(value: float):
+    d = int(value)
+    m = int((value - d) * 60)
+    s = (value - d - m / 60.0) * 3600
+    return IFDRational(d), IFDRational(m), IFDRational(round(s * 100), 100)
+
+
+def make_jpeg(width: int, height: int, gps: Optional[Tuple[float, float]] = None, seed: int = 0) -> bytes:
+    """Noisy blocky image (compresses like a real photo, unlike a flat color)."""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 255, size=(max(1, height // 16), max(1, width // 16), 3), dtype=np.uint8)
+    img = Image.fromarray(small).resize((width, height), Image.NEAREST)
+    exif = Image.Exif()
+    exif.get_ifd(0x8769)[0x920A] = IFDRational(35)  # FocalLength
+    if gps:
+        exif[0x8825] = {1: "N" if gps[0] >= 0 else "S", 2: _dms(abs(gps[0])),
+                        3: "E" if gps[1] >= 0 else "W", 4: _dms(abs(gps[1]))}
+    buf = BytesIO()
+    img.save(buf, "JPEG", quality=90, exif=exif)
+    return buf.getvalue()
+
+
+def build_corpus(sizes: List[Tuple[int, int]], many_detections: int) -> List[Dict[str, Any]]:
+    corpus = []
+    for i, (w, h) in enumerate(sizes):
+        corpus.append({"name": f"{w}x{h}-exif", "size": (w, h), "detections": None,
+                       "bytes": make_jpeg(w, h, gps=(55.75 + i * 1e-3, 37.61), seed=i), "metadata": {}})
+        corpus.append({"name": f"{w}x{h}-ins", "size": (w, h), "detections": None,
+                       "bytes": make_jpeg(w, h, seed=100 + i), "metadata": {"ins": dict(SAMPLE_INS)}})
+        if many_detections:
+            corpus.append({"name": f"{w}x{h}-ins-many", "size": (w, h), "detections": many_detections,
+                           "bytes": make_jpeg(w, h, seed=200 + i), "metadata": {"ins": dict(SAMPLE_INS)}})
+    return corpus
+
+
+def synthetic_detector(n: int, seed: int = 0) -> Callable[[Image.Image], List[Dict[str, Any]]]:
+    def _detect(image: Image.Image) -> List[Dict[str, Any]]:
+        rng = random.Random(seed)
+        w, h = image.size
+        out = []
+        for _ in range(n):
+            bw, bh = rng.randint(8, max(9, w // 10)), rng.randint(8, max(9, h // 10))
+            out.append({"label": "building", "bbox": [rng.randint(0, w - bw), rng.randint(0, h - bh), bw, bh],
+                        "confidence": 0.5, "mask": None})
+        return out
+    return _detect
+
+
+# -------------------------
+# Stand-ins
+# -------------------------
+class FakeS3:
+    def __init__(self, objects: Dict[str, bytes]):
+        self.objects = objects
+
+    def get_object(self, Bucket: str, Key: str, **kwargs):
+        return {"Body": BytesIO(self.objects[Key]), "ContentLength": len(self.objects[Key])}
+
+
+class FakeSendFuture:
+    """Already-acked kafka-python send future."""
+
+    def add_callback(self, fn, *args, **kwargs):
+        fn(*args, None, **kwargs)
+        return self
+
+    def add_errback(self, fn, *args, **kwargs):
+        return self
+
+
+class FakeProducer:
+    def __init__(self):
+        self.sent = 0
+        self.bytes = 0
+
+    def send(self, topic: str, value=None, **kwargs):
+        self.sent += 1
+        self.bytes += len(value) if isinstance(value, bytes) else len(json.dumps(value, default=str).encode("utf-8"))
+        return FakeSendFuture()
+
+    def flush(self, timeout=None):
+        pass
+
+    def close(self, timeout=None):
+        pass
+
+
+class FakeRecord:
+    def __init__(self, topic: str, partition: int, offset: int, value: Dict[str, Any]):
+        self.topic = topic
+        self.partition = partition
+        self.offset = offset
+        self.value = value
+
+
+class FakeConsumer:
+    """Yields the given task messages once, like KafkaConsumer.poll()."""
+
+    def __init__(self, messages: List[Dict[str, Any]], topic: str = "images.tasks"):
+        self.records = [FakeRecord(topic, 0, i, m) for i, m in enumerate(messages)]
+
+    def poll(self, timeout_ms: int = 0, max_records: int = 16):
+        batch, self.records = self.records[:max_records], self.records[max_records:]
+        return {(batch[0].topic, 0): batch} if batch else {}
+
+
+@contextmanager
+def patched(obj, name: str, value):
+    old = getattr(obj, name)
+    setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        setattr(obj, name, old)
+
+
+def stub_reverse_geocode(latency_ms: float):
+    def _rev(lat: float, lon: float):
+        if latency_ms:
+            time.sleep(latency_ms / 1000.0)
+        return {"address": f"stub {lat:.4f},{lon:.4f}", "raw": {}}
+    return _rev
+
+
+# -------------------------
+# Measurement
+# -------------------------
+def peak_rss_mb() -> float:
+    # ru_maxrss is KB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024.0) if sys.platform == "darwin" else rss / 1024.0
+
+
+def measure(fn: Callable[[], Any], iterations: int, warmup: int = 1, images_per_call: int = 1) -> Dict[str, Any]:
+    for _ in range(warmup):
+        fn()
+    lat = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        fn()
+        lat.append(time.perf_counter() - t)
+    total = time.perf_counter() - start
+    lat_ms = np.asarray(lat) * 1000.0
+    return {
+        "n": iterations * images_per_call,
+        "images_per_s": round(iterations * images_per_call / total, 3) if total > 0 else None,
+        "p50_ms": round(float(np.percentile(lat_ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(lat_ms, 99)), 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+# -------------------------
+# Benchmarks
+# -------------------------
+def bench_stages(corpus: List[Dict[str, Any]], only: List[str], iterations: int) -> Dict[str, Any]:
+    results = {}
+    for item in corpus:
+        name, data, (w, h) = item["name"], item["bytes"], item["size"]
+        if item["detections"] is None and "decode" in only:
+            results[f"decode[{name}]"] = measure(lambda: ml_geolocate.decode_image(data, ml_geolocate.DECODE_TARGET_SIZE),
+                                                 iterations)
+            results[f"decode_full[{name}]"] = measure(lambda: Image.open(BytesIO(data)).convert("RGB"), iterations)
+        if item["detections"] is None and "exif" in only:
+            results[f"exif[{name}]"] = measure(lambda: ml_geolocate.extract_exif_from_pil(Image.open(BytesIO(data))),
+                                               iterations)
+        decoded = ml_geolocate.decode_image(data, ml_geolocate.DECODE_TARGET_SIZE)
+        if item["detections"] is None and "detect" in only:
+            results[f"detect[{name}]"] = measure(lambda: ml_geolocate.detect_buildings(decoded.image), iterations)
+        if "projection" in only:
+            dets = synthetic_detector(item["detections"] or 1)(decoded.image)
+            bboxes = [decoded.to_original_bbox(d["bbox"]) for d in dets]
+            image_geo = ml_geolocate.image_geolocation_from_exif(decoded.exif)
+            if item["metadata"].get("ins"):
+                geos = ml_geolocate.geolocate_bboxes(bboxes, w, h, decoded.exif, item["metadata"], image_geo)
+                if not all(g and g["method"] in ("ins_projection", "ins_terrain") for g in geos):
+                    raise RuntimeError(f"{name}: INS pose didn't project every box to the ground")
+            results[f"projection[{name}]"] = measure(
+                lambda: ml_geolocate.geolocate_bboxes(bboxes, w, h, decoded.exif, item["metadata"],
+                                                      image_geo), iterations)
+        if "ocr" in only and item["detections"]:
+            engine = ml_geolocate.get_ocr_engine()
+            if not engine.available:
+                results["ocr"] = {"skipped": "no OCR backend (tesserocr/pytesseract) installed"}
+                continue
+            full = decoded.full()
+            ocr_bboxes = [d["bbox"] for d in synthetic_detector(min(item["detections"], 20))(full)]
+            # per-crop calls (old path) vs one batched pass over the engine pool
+            results[f"ocr_per_crop[{name}]"] = measure(
+                lambda: [ml_geolocate.run_ocr_if_available(full, b) for b in ocr_bboxes],
+                max(1, iterations // 10), warmup=0)
+            results[f"ocr_batch[{name}]"] = measure(
+                lambda: engine.run_batch(full, ocr_bboxes), max(1, iterations // 10), warmup=0)
+    return results
+
+
+def bench_worker(corpus: List[Dict[str, Any]], only: List[str], iterations: int) -> Dict[str, Any]:
+    try:
+        import main as worker
+    except Exception as e:
+        return {"e2e": {"skipped": f"worker import failed: {e}"}}
+
+    results = {}
+    objects = {item["name"]: item["bytes"] for item in corpus}
+    producer = FakeProducer()
+    with patched(worker, "s3_client", FakeS3(objects)), patched(worker, "producer", producer), \
+            patched(worker, "batcher", None):
+        for item in corpus:
+            msg = {"image_id": item["name"], "image_url": item["name"], "metadata": item["metadata"]}
+            detect = synthetic_detector(item["detections"]) if item["detections"] else ml_geolocate.detect_buildings
+            with patched(ml_geolocate, "detect_buildings", detect):
+                if "e2e" in only:
+                    results[f"e2e[{item['name']}]"] = measure(lambda: worker.process_message(msg), iterations)
+
+        if "pipeline" in only:
+            messages = [{"image_id": f"{item['name']}-{i}", "image_url": item["name"], "metadata": item["metadata"]}
+                        for i in range(iterations) for item in corpus if item["detections"] is None]
+            consumer = FakeConsumer(messages)
+            pipeline = worker.Pipeline([
+                ("fetch", worker.fetch_stage, worker.FETCH_WORKERS),
+                ("detect", worker.detect_stage, worker.DETECT_WORKERS),
+                ("enrich", worker.enrich_stage, worker.ENRICH_WORKERS),
+                ("emit", worker.emit_stage, 1),
+            ], queue_size=worker.PIPELINE_QUEUE_SIZE)
+            pipeline.start()
+            start = time.perf_counter()
+            while True:
+                records = consumer.poll(max_records=worker.PIPELINE_QUEUE_SIZE)
+                if not records:
+                    break
+                for tp, recs in records.items():
+                    for r in recs:
+                        pipeline.submit(tp, r.offset, worker.new_task(r.value))
+            pipeline.drain()
+            total = time.perf_counter() - start
+            pipeline.stop()
+            results["pipeline"] = {"n": len(messages), "images_per_s": round(len(messages) / total, 3),
+                                   "peak_rss_mb": round(peak_rss_mb(), 1)}
+    results["producer"] = {"messages": producer.sent, "bytes": producer.bytes}
+    return results
+
+
+def detection_agreement(reference: List[List[Dict[str, Any]]], candidate: List[List[Dict[str, Any]]],
+                        iou_threshold: float = 0.5) -> Dict[str, Any]:
+    """Precision/recall of candidate detections against a reference backend (same label, IoU >= threshold)."""
+    matched, ref_total, cand_total, ious = 0, 0, 0, []
+    for ref, cand in zip(reference, candidate):
+        ref_total += len(ref)
+        cand_total += len(cand)
+        if not ref or not cand:
+            continue
+        ref_boxes = np.asarray([[x, y, x + w, y + h] for x, y, w, h in (d["bbox"] for d in ref)], dtype=np.float32)
+        used = np.zeros(len(ref), dtype=bool)
+        for d in sorted(cand, key=lambda d: -d["confidence"]):
+            x, y, w, h = d["bbox"]
+            iou = box_iou(np.asarray([x, y, x + w, y + h], dtype=np.float32), ref_boxes)
+            iou[used | np.asarray([r["label"] != d["label"] for r in ref])] = 0.0
+            best = int(iou.argmax())
+            if iou[best] >= iou_threshold:
+                used[best] = True
+                matched += 1
+                ious.append(float(iou[best]))
+    return {"precision": round(matched / cand_total, 4) if cand_total else None,
+            "recall": round(matched / ref_total, 4) if ref_total else None,
+            "mean_iou": round(float(np.mean(ious)), 4) if ious else None,
+            "reference_detections": ref_total, "detections": cand_total}
+
+
+def bench_detectors(corpus: List[Dict[str, Any]], specs: str, images_dir: Optional[str], batch_size: int,
+                    iterations: int) -> Dict[str, Any]:
+    """Throughput of each backend and agreement with the first one (the reference)."""
+    if not specs:
+        return {"detectors": {"skipped": "no --detectors given"}}
+    if images_dir:
+        names = sorted(n for n in os.listdir(images_dir) if n.lower().endswith((".jpg", ".jpeg", ".png")))
+        images = [Image.open(os.path.join(images_dir, n)).convert("RGB") for n in names]
+    else:
+        images = [ml_geolocate.decode_image(item["bytes"], ml_geolocate.DECODE_TARGET_SIZE).image
+                  for item in corpus if item["detections"] is None]
+    batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+
+    results, reference = {}, None
+    for spec in specs.split(","):
+        backend, _, path = spec.partition("=")
+        key = f"detector[{backend}:{os.path.basename(path)}]"
+        try:
+            detector = create_detector(backend, path, conf=ml_geolocate.DETECT_CONF, iou=ml_geolocate.DETECT_IOU,
+                                       input_size=ml_geolocate.ONNX_INPUT_SIZE, threads=ml_geolocate.ONNX_THREADS)
+        except Exception as e:
+            results[key] = {"skipped": f"{type(e).__name__}: {e}"}
+            continue
+        detections = [d for batch in batches for d in detector.detect_batch(batch)]
+        stats = measure(lambda: [detector.detect_batch(batch) for batch in batches], max(1, iterations // 5),
+                        images_per_call=len(images))
+        if reference is None:
+            reference = detections
+            stats["reference"] = True
+        else:
+            stats.update(detection_agreement(reference, detections))
+        results[key] = stats
+    return results
+
+
+def parse_sizes(value: str) -> List[Tuple[int, int]]:
+    out = []
+    for part in value.split(","):
+        w, h = part.lower().split("x")
+        out.append((int(w), int(h)))
+    return out
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="ml_geolocate / worker throughput benchmark")
+    parser.add_argument("--only", default=",".join(ALL_BENCHMARKS),
+                        help=f"comma separated subset of {','.join(ALL_BENCHMARKS)}")
+    parser.add_argument("--sizes", default="1024x768,4000x3000,6000x4000")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--many-detections", type=int, default=200,
+                        help="detections of the many-detection corpus entries (0 disables them)")
+    parser.add_argument("--geocode-latency-ms", type=float, default=0.0,
+                        help="simulated reverse-geocode latency of the stub")
+    parser.add_argument("--detectors", default="",
+                        help="backend=model_path list for the detectors benchmark, first one is the accuracy reference")
+    parser.add_argument("--detector-images", help="directory of real images for the detectors benchmark")
+    parser.add_argument("--detector-batch", type=int, default=8)
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    only = [b.strip() for b in args.only.split(",") if b.strip()]
+    corpus = build_corpus(parse_sizes(args.sizes), args.many_detections)
+
+    results: Dict[str, Any] = {}
+    with patched(ml_geolocate, "reverse_geocode", stub_reverse_geocode(args.geocode_latency_ms)):
+        results.update(bench_stages(corpus, only, args.iterations))
+        if "e2e" in only or "pipeline" in only:
+            results.update(bench_worker(corpus, only, args.iterations))
+        if "detectors" in only:
+            results.update(bench_detectors(corpus, args.detectors, args.detector_images, args.detector_batch,
+                                           args.iterations))
+
+    report = {
+        "env": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "detector": ml_geolocate.load_model().fingerprint(),
+            "decode_target_size": ml_geolocate.DECODE_TARGET_SIZE,
+            "ocr_backend": ml_geolocate.get_ocr_engine().backend,
+            "iterations": args.iterations,
+        },
+        "results": results,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
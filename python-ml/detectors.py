@@ -0,0 +1,281 @@
+"""
+Detector backends behind ml_geolocate.detect_buildings().
+
+    detector = create_detector("onnx", "/app/models/yolov8n.onnx")
+    detector.detect_batch([img1, img2])   # -> [[{'label','bbox':[x,y,w,h],'confidence','mask'}, ...], ...]
+
+Backends:
+- ultralytics: YOLOv8 .pt through ultralytics/PyTorch (the original path)
+- onnx: YOLOv8 exported to ONNX, run with ONNX Runtime on CPU; letterbox
+  preprocessing and NMS are done here in NumPy, so neither torch nor ultralytics
+  is needed at runtime. An int8 dynamically quantized model is used the same way.
+- fallback: one large center box per image, for tests without weights
+
+Export / quantize (needs ultralytics resp. onnxruntime + onnx, offline only):
+    python detectors.py export /app/models/yolov8n.pt --imgsz 640 --int8
+    python detectors.py quantize /app/models/yolov8n.onnx [/app/models/yolov8n.int8.onnx]
+"""
+
+import os
+import ast
+import sys
+import logging
+import argparse
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger("detectors")
+
+LETTERBOX_FILL = (114, 114, 114)  # same padding value as ultralytics
+
+
+# -------------------------
+# Shared helpers
+# -------------------------
+def letterbox(image: Image.Image, size: int) -> Tuple[np.ndarray, float, Tuple[int, int]]:
+    """Resize keeping aspect ratio and pad to size x size. Returns (HWC uint8, scale, (pad_x, pad_y))."""
+    w, h = image.size
+    scale = min(size / w, size / h)
+    nw, nh = max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+    canvas = Image.new("RGB", (size, size), LETTERBOX_FILL)
+    pad_x, pad_y = (size - nw) // 2, (size - nh) // 2
+    canvas.paste(image.convert("RGB").resize((nw, nh), Image.BILINEAR), (pad_x, pad_y))
+    return np.asarray(canvas), scale, (pad_x, pad_y)
+
+
+def box_iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """IoU of one xyxy box against (N, 4) xyxy boxes."""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float,
+        classes: Optional[np.ndarray] = None, max_det: int = 300) -> np.ndarray:
+    """
+    Greedy NMS over (N, 4) xyxy boxes; returns kept indices by descending score.
+    With classes, boxes of different classes never suppress each other (coordinate
+    offset per class, as in ultralytics).
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if classes is not None:
+        offset = (np.max(boxes) + 1.0) * classes.astype(boxes.dtype)
+        boxes = boxes + offset[:, None]
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size and len(keep) < max_det:
+        i = order[0]
+        keep.append(i)
+        if order.size == 1:
+            break
+        rest = order[1:]
+        order = rest[box_iou(boxes[i], boxes[rest]) <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def to_detections(boxes: np.ndarray, scores: np.ndarray, classes: np.ndarray,
+                  names: Dict[int, str]) -> List[Dict[str, Any]]:
+    out = []
+    for (x1, y1, x2, y2), score, cls in zip(boxes.tolist(), scores.tolist(), classes.tolist()):
+        x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
+        out.append({"label": names.get(int(cls), str(int(cls))), "bbox": [x1, y1, x2 - x1, y2 - y1],
+                    "confidence": float(score), "mask": None})
+    return out
+
+
+def _file_id(path: str) -> str:
+    try:
+        st = os.stat(path)
+        return f"{path}:{st.st_size}:{int(st.st_mtime)}"
+    except OSError:
+        return path
+
+
+# -------------------------
+# Backends
+# -------------------------
+class Detector:
+    name = "base"
+    fork_safe = True  # False if the instance owns threads that a forked child wouldn't have
+
+    def detect_batch(self, images: Sequence[Image.Image]) -> List[List[Dict[str, Any]]]:
+        raise NotImplementedError
+
+    def fingerprint(self) -> str:
+        return self.name
+
+
+class FallbackDetector(Detector):
+    name = "fallback"
+
+    def detect_batch(self, images: Sequence[Image.Image]) -> List[List[Dict[str, Any]]]:
+        out = []
+        for image in images:
+            # fake/simple detector: center large bbox - for tests only
+            w, h = image.size
+            out.append([{"label": "building", "bbox": [int(w * 0.15), int(h * 0.15), int(w * 0.7), int(h * 0.7)],
+                         "confidence": 0.6, "mask": None}])
+        return out
+
+
+class UltralyticsDetector(Detector):
+    name = "ultralytics"
+
+    def __init__(self, model_path: str, conf: float = 0.25, iou: float = 0.7, max_det: int = 300):
+        from ultralytics import YOLO
+        self.model_path = model_path
+        self.model = YOLO(model_path)
+        self.conf, self.iou, self.max_det = conf, iou, max_det
+
+    def detect_batch(self, images: Sequence[Image.Image]) -> List[List[Dict[str, Any]]]:
+        # YOLOv8 accepts a list of numpy arrays and letterboxes them into one batch
+        results = self.model.predict([np.array(image) for image in images], conf=self.conf, iou=self.iou,
+                                     max_det=self.max_det, verbose=False)
+        out = []
+        for r in results:
+            boxes = r.boxes
+            out.append(to_detections(boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(),
+                                     boxes.cls.cpu().numpy().astype(np.int64), self.model.names))
+        return out
+
+    def fingerprint(self) -> str:
+        return f"{self.name}:{_file_id(self.model_path)}:{self.conf}:{self.iou}"
+
+
+class OnnxDetector(Detector):
+    name = "onnx"
+    fork_safe = False  # the session's intra-op thread pool doesn't exist in a forked child
+
+    def __init__(self, model_path: str, input_size: int = 640, conf: float = 0.25, iou: float = 0.7,
+                 max_det: int = 300, threads: int = 0, providers: Optional[List[str]] = None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.model_path = model_path
+        self.session = ort.InferenceSession(model_path, options, providers=providers or ["CPUExecutionProvider"])
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        batch, _, h, w = inp.shape
+        # exported with dynamic=False the graph only takes a fixed batch/size
+        self.fixed_batch = batch if isinstance(batch, int) else None
+        self.input_size = h if isinstance(h, int) and h == w else input_size
+        self.conf, self.iou, self.max_det = conf, iou, max_det
+        meta = self.session.get_modelmeta().custom_metadata_map
+        try:
+            self.names = {int(k): v for k, v in ast.literal_eval(meta.get("names", "{}")).items()}
+        except (ValueError, SyntaxError):
+            self.names = {}
+
+    def detect_batch(self, images: Sequence[Image.Image]) -> List[List[Dict[str, Any]]]:
+        if not images:
+            return []
+        boxed = [letterbox(image, self.input_size) for image in images]
+        blob = np.stack([b[0] for b in boxed]).astype(np.float32)
+        blob = np.ascontiguousarray(blob.transpose(0, 3, 1, 2)) / 255.0
+        step = self.fixed_batch or len(images)
+        short = -len(images) % step
+        if short:
+            # a fixed-batch graph rejects a partial last chunk: pad it, drop the padded outputs
+            blob = np.concatenate([blob, np.zeros((short,) + blob.shape[1:], dtype=blob.dtype)])
+        preds = [self.session.run(None, {self.input_name: blob[i:i + step]})[0] for i in range(0, len(blob), step)]
+        preds = np.concatenate(preds)[:len(images)]
+        return [self._postprocess(pred, scale, pad, image.size)
+                for pred, (_, scale, pad), image in zip(preds, boxed, images)]
+
+    def _postprocess(self, pred: np.ndarray, scale: float, pad: Tuple[int, int],
+                     size: Tuple[int, int]) -> List[Dict[str, Any]]:
+        # YOLOv8 head: (4 + num_classes, anchors), boxes as cx, cy, w, h in letterbox pixels
+        pred = pred.T
+        cls_scores = pred[:, 4:]
+        classes = cls_scores.argmax(axis=1)
+        scores = cls_scores[np.arange(len(pred)), classes]
+        mask = scores >= self.conf
+        if not mask.any():
+            return []
+        pred, scores, classes = pred[mask], scores[mask], classes[mask]
+        boxes = np.empty((len(pred), 4), dtype=np.float32)
+        boxes[:, 0] = pred[:, 0] - pred[:, 2] / 2
+        boxes[:, 1] = pred[:, 1] - pred[:, 3] / 2
+        boxes[:, 2] = pred[:, 0] + pred[:, 2] / 2
+        boxes[:, 3] = pred[:, 1] + pred[:, 3] / 2
+        keep = nms(boxes, scores, self.iou, classes, self.max_det)
+        boxes, scores, classes = boxes[keep], scores[keep], classes[keep]
+        # undo letterbox
+        boxes[:, [0, 2]] = np.clip((boxes[:, [0, 2]] - pad[0]) / scale, 0, size[0])
+        boxes[:, [1, 3]] = np.clip((boxes[:, [1, 3]] - pad[1]) / scale, 0, size[1])
+        return to_detections(boxes, scores, classes, self.names)
+
+    def fingerprint(self) -> str:
+        return f"{self.name}:{_file_id(self.model_path)}:{self.input_size}:{self.conf}:{self.iou}"
+
+
+def create_detector(backend: str, model_path: str, **options) -> Detector:
+    """backend: auto | ultralytics | onnx | fallback (auto picks by file extension)."""
+    if backend == "auto":
+        if not model_path:
+            backend = "fallback"
+        else:
+            backend = "onnx" if model_path.endswith(".onnx") else "ultralytics"
+    if backend == "fallback":
+        return FallbackDetector()
+    if backend == "ultralytics":
+        options.pop("input_size", None)
+        options.pop("threads", None)
+        return UltralyticsDetector(model_path, **options)
+    if backend == "onnx":
+        return OnnxDetector(model_path, **options)
+    raise ValueError(f"Unknown detector backend {backend!r}")
+
+
+# -------------------------
+# Export / quantization tool
+# -------------------------
+def export_onnx(weights: str, imgsz: int = 640, opset: int = 17) -> str:
+    from ultralytics import YOLO
+    # dynamic axes so the worker can send whole micro-batches in one run()
+    return YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True, opset=opset)
+
+
+def quantize_int8(model_path: str, output_path: Optional[str] = None, per_channel: bool = True) -> str:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    output_path = output_path or model_path[:-len(".onnx")] + ".int8.onnx"
+    quantize_dynamic(model_path, output_path, weight_type=QuantType.QInt8, per_channel=per_channel)
+    return output_path
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Export / quantize YOLOv8 weights for the onnx backend")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    e = sub.add_parser("export", help="export .pt weights to ONNX")
+    e.add_argument("weights")
+    e.add_argument("--imgsz", type=int, default=640)
+    e.add_argument("--opset", type=int, default=17)
+    e.add_argument("--int8", action="store_true", help="also write a dynamically quantized int8 model")
+    q = sub.add_parser("quantize", help="dynamic int8 quantization of an ONNX model")
+    q.add_argument("model")
+    q.add_argument("output", nargs="?")
+    q.add_argument("--per-tensor", action="store_true", help="per-tensor instead of per-channel weight scales")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "export":
+        path = export_onnx(args.weights, args.imgsz, args.opset)
+        print(path)
+        if args.int8:
+            print(quantize_int8(path))
+    else:
+        print(quantize_int8(args.model, args.output, per_channel=not args.per_tensor))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
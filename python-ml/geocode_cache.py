@@ -0,0 +1,272 @@
+"""
+Reverse-geocode cache keyed on quantized coordinates.
+
+Lookups are keyed by the geohash of (lat, lon) at a configurable precision, so
+detections that fall into the same cell share one address:
+    precision 7 -> ~153m x 153m, 8 -> ~38m x 19m, 9 -> ~5m x 5m
+
+Tiers:
+    1. in-memory LRU (dict lookup, microseconds)
+    2. on-disk SQLite with TTL (survives restarts, shared by worker processes; each
+       process opens its own connection - one inherited through fork is never used;
+       expired rows are purged on open and every purge_every puts)
+    3. fetch_fn(lat, lon) - the real geocoder (Nominatim etc.)
+
+Concurrent misses for the same cell are coalesced (single-flight): one thread
+calls fetch_fn, the others wait for its result.
+"""
+
+import os
+import json
+import time
+import weakref
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Any, Optional
+
+logger = logging.getLogger("geocode_cache")
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+FetchFn = Callable[[float, float], Optional[Dict[str, Any]]]
+
+
+def geohash_encode(lat: float, lon: float, precision: int = 8) -> str:
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2.0
+            if lon >= mid:
+                bits = (bits << 1) | 1
+                lon_lo = mid
+            else:
+                bits <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2.0
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_lo = mid
+            else:
+                bits <<= 1
+                lat_hi = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+class LRUCache:
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max(1, int(max_entries))
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteTTLStore:
+    def __init__(self, path: str, ttl_s: float, purge_every: int = 1000):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.purge_every = max(1, int(purge_every))
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._inherited = []  # connections of the parent process: kept referenced, never used or closed
+        self._puts = 0
+        _stores.add(self)
+        with self._lock:
+            self._connection()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Connection of this process (caller holds the lock); opened on first use after a fork."""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocode (key TEXT PRIMARY KEY, value TEXT, created_at REAL)"
+            )
+            self._conn.commit()
+            self._purge()
+        return self._conn
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        if self._conn is not None:
+            self._inherited.append(self._conn)
+            self._conn = None
+
+    def get(self, key: str):
+        """Returns (found, value)."""
+        with self._lock:
+            row = self._connection().execute("SELECT value, created_at FROM geocode WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False, None
+        value, created_at = row
+        if self.ttl_s and time.time() - created_at > self.ttl_s:
+            return False, None
+        return True, json.loads(value)
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO geocode (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time())
+            )
+            conn.commit()
+            self._puts += 1
+            if self._puts % self.purge_every == 0:
+                self._purge()
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            self._connection()
+            return self._purge()
+
+    def _purge(self) -> int:
+        if not self.ttl_s:
+            return 0
+        try:
+            cur = self._conn.execute("DELETE FROM geocode WHERE created_at < ?", (time.time() - self.ttl_s,))
+            self._conn.commit()
+        except sqlite3.Error:
+            logger.exception("Failed to purge expired geocode cache rows")
+            return 0
+        if cur.rowcount:
+            logger.info("Purged %d expired geocode cache rows", cur.rowcount)
+        return cur.rowcount
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class GeocodeCache:
+    def __init__(self, fetch_fn: FetchFn, precision: int = 8, max_entries: int = 10000,
+                 db_path: Optional[str] = None, ttl_s: float = 30 * 24 * 3600):
+        self.fetch_fn = fetch_fn
+        self.precision = int(precision)
+        self.memory = LRUCache(max_entries)
+        self.disk: Optional[SQLiteTTLStore] = None
+        if db_path:
+            try:
+                self.disk = SQLiteTTLStore(db_path, ttl_s)
+            except Exception:
+                logger.exception('Failed to open geocode cache db %s; using memory tier only', db_path)
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+    def key(self, lat: float, lon: float) -> str:
+        return geohash_encode(lat, lon, self.precision)
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, lat: float, lon: float) -> Optional[Dict[str, Any]]:
+        key = self.key(lat, lon)
+        # `None` results ("no address here") are cached too, hence the sentinel check
+        cached = self.memory.get(key, _MISSING)
+        if cached is not _MISSING:
+            self._count("memory_hits")
+            return cached
+
+        with self._lock:
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = Future()
+                self._inflight[key] = fut
+            else:
+                self.counters["coalesced"] += 1
+        if not leader:
+            return fut.result()
+
+        try:
+            value = self._load(key, lat, lon)
+            fut.set_result(value)
+            return value
+        except Exception as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _load(self, key: str, lat: float, lon: float) -> Optional[Dict[str, Any]]:
+        if self.disk is not None:
+            found, value = self.disk.get(key)
+            if found:
+                self._count("disk_hits")
+                self.memory.put(key, value)
+                return value
+
+        self._count("misses")
+        try:
+            value = self.fetch_fn(lat, lon)
+        except Exception:
+            # errors are not cached, next lookup retries
+            self._count("errors")
+            raise
+        self.memory.put(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, value)
+            except Exception:
+                logger.exception('Failed to persist geocode cache entry %s', key)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self.counters)
+        hits = out["memory_hits"] + out["disk_hits"] + out["coalesced"]
+        total = hits + out["misses"]
+        out["hit_ratio"] = hits / total if total else 0.0
+        out["memory_entries"] = len(self.memory)
+        return out
+
+
+_MISSING = object()
+
+_stores: "weakref.WeakSet[SQLiteTTLStore]" = weakref.WeakSet()
+
+
+def _reset_after_fork():
+    for store in list(_stores):
+        store._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,109 @@
+"""
+Image decode stage.
+
+Large drone photos (20-50 MP) are expensive to decode in full, while the detector
+only needs ~640 px. For JPEGs we use PIL draft mode, which lets libjpeg decode
+directly at 1/2, 1/4 or 1/8 scale (DCT scaling) - far cheaper than a full decode
+followed by a resize.
+
+    decoded = decode_image(image_bytes, target_size=640)
+    decoded.image          # reduced RGB image for the detector
+    decoded.original_size  # (w, h) of the full-resolution image
+    decoded.exif           # EXIF read from the header, no pixel decode
+    decoded.to_original_bbox(bbox)
+    decoded.full()         # full-resolution RGB, decoded lazily (e.g. for OCR crops)
+"""
+
+import logging
+import threading
+from io import BytesIO
+from typing import Dict, Any, List, Optional, Tuple
+
+from PIL import Image, ExifTags
+
+logger = logging.getLogger("image_decode")
+
+
+def parse_exif(img: Image.Image) -> Dict[str, Any]:
+    """EXIF with human-readable tags plus parsed 'GPS' sub-dict. Works on a not yet decoded image."""
+    exif: Dict[str, Any] = {}
+    try:
+        raw = img.getexif()
+        if not raw:
+            return {}
+        for tag, value in raw.items():
+            exif[ExifTags.TAGS.get(tag, tag)] = value
+        # camera settings (FocalLength etc.) live in the Exif sub-IFD
+        for tag, value in raw.get_ifd(ExifTags.IFD.Exif).items():
+            exif[ExifTags.TAGS.get(tag, tag)] = value
+        gps_raw = raw.get_ifd(ExifTags.IFD.GPSInfo)
+        if gps_raw:
+            exif['GPS'] = {ExifTags.GPSTAGS.get(t, t): val for t, val in gps_raw.items()}
+    except Exception:
+        return {}
+    return exif
+
+
+def read_image_header(image_bytes: bytes) -> Tuple[Tuple[int, int], Dict[str, Any]]:
+    """Image size and EXIF from the header only - pixels are never decoded."""
+    with Image.open(BytesIO(image_bytes)) as img:
+        return img.size, parse_exif(img)
+
+
+class DecodedImage:
+    def __init__(self, image_bytes: bytes, image: Image.Image, original_size: Tuple[int, int],
+                 exif: Dict[str, Any]):
+        self.image_bytes = image_bytes
+        self.image = image
+        self.original_size = original_size
+        self.exif = exif
+        self.scale_x = original_size[0] / float(image.size[0])
+        self.scale_y = original_size[1] / float(image.size[1])
+        self._full: Optional[Image.Image] = None
+        self._lock = threading.Lock()
+
+    @property
+    def reduced(self) -> bool:
+        return self.image.size != self.original_size
+
+    def full(self) -> Image.Image:
+        """Full-resolution RGB image, decoded on first use."""
+        if not self.reduced:
+            return self.image
+        with self._lock:
+            if self._full is None:
+                self._full = Image.open(BytesIO(self.image_bytes)).convert("RGB")
+            return self._full
+
+    def to_original_bbox(self, bbox: List[int]) -> List[int]:
+        """[x,y,w,h] in reduced image pixels -> full-resolution pixels."""
+        if not self.reduced:
+            return list(bbox)
+        x, y, w, h = bbox
+        return [int(round(x * self.scale_x)), int(round(y * self.scale_y)),
+                int(round(w * self.scale_x)), int(round(h * self.scale_y))]
+
+
+def decode_image(image_bytes: bytes, target_size: Optional[int] = 640) -> DecodedImage:
+    """
+    Decode for detection. JPEGs are decoded at the smallest DCT scale that keeps the
+    longer side >= target_size; other formats are decoded in full.
+    """
+    img = Image.open(BytesIO(image_bytes))
+    original_size = img.size
+    exif = parse_exif(img)
+    if target_size and img.format == "JPEG" and max(original_size) > target_size:
+        # draft() keeps aspect ratio and never goes below the requested size
+        img.draft("RGB", (target_size, target_size))
+    return DecodedImage(image_bytes, img.convert("RGB"), original_size, exif)
+
+
+def decode_frame(frame: Image.Image, target_size: Optional[int] = 640) -> DecodedImage:
+    """DecodedImage for an already decoded RGB frame (video); detection runs on a reduced copy."""
+    image = frame
+    if target_size and max(frame.size) > target_size:
+        image = frame.copy()
+        image.thumbnail((target_size, target_size), Image.BILINEAR)
+    decoded = DecodedImage(b"", image, frame.size, {})
+    decoded._full = frame
+    return decoded
@@ -0,0 +1,116 @@
+"""
+Cross-message micro-batching for detection.
+
+Images submitted from several worker threads (one per Kafka message) are collected
+into a single batch and sent to the detector in one call. A batch is flushed when it
+reaches max_batch_size or when the oldest queued image waited max_wait_ms.
+
+Usage:
+    batcher = InferenceBatcher(detect_buildings_batch, max_batch_size=8, max_wait_ms=20)
+    batcher.start()
+    process_image_bytes(image_bytes, metadata, detector=batcher.detect)
+"""
+
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from PIL import Image
+
+logger = logging.getLogger("inference_batcher")
+
+BatchDetectFn = Callable[[List[Image.Image]], List[List[Dict[str, Any]]]]
+
+
+class InferenceBatcher:
+    def __init__(self, detect_batch_fn: BatchDetectFn, max_batch_size: int = 8, max_wait_ms: float = 20.0):
+        self.detect_batch_fn = detect_batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_s = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue: "queue.Queue[Tuple[Image.Image, Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        # simple counters, useful to check that batching actually happens
+        self.batches = 0
+        self.images = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+        self._thread.start()
+        logger.info('Inference batcher started (max_batch_size=%d, max_wait_ms=%.1f)',
+                    self.max_batch_size, self.max_wait_s * 1000.0)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop accepting work; images already queued are still processed."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, image: Image.Image) -> Future:
+        fut: Future = Future()
+        if self._thread is None:
+            # batcher not running -> run inline so callers never hang
+            self._run_batch([(image, fut)])
+            return fut
+        self._queue.put((image, fut))
+        return fut
+
+    def detect(self, image: Image.Image) -> List[Dict[str, Any]]:
+        """Drop-in replacement for detect_buildings(image)."""
+        return self.submit(image).result()
+
+    def detect_many(self, images: List[Image.Image]) -> List[List[Dict[str, Any]]]:
+        """Drop-in replacement for detect_buildings_batch(images), e.g. for the tiles of one image."""
+        futures = [self.submit(image) for image in images]
+        return [f.result() for f in futures]
+
+    @property
+    def avg_batch_size(self) -> float:
+        return self.images / self.batches if self.batches else 0.0
+
+    def _collect(self) -> List[Tuple[Image.Image, Future]]:
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while self._running or not self._queue.empty():
+            batch = self._collect()
+            if batch:
+                self._run_batch(batch)
+
+    def _run_batch(self, batch: List[Tuple[Image.Image, Future]]):
+        images = [item[0] for item in batch]
+        try:
+            results = self.detect_batch_fn(images)
+            if len(results) != len(images):
+                raise RuntimeError(f'Detector returned {len(results)} results for {len(images)} images')
+        except Exception as e:
+            logger.exception('Batched detection failed')
+            for _, fut in batch:
+                fut.set_exception(e)
+            return
+        self.batches += 1
+        self.images += len(images)
+        # scatter detections back to the waiting callers
+        for (_, fut), dets in zip(batch, results):
+            fut.set_result(dets)
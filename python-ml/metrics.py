@@ -0,0 +1,125 @@
+"""
+Prometheus metrics of the ML worker (scraped by prometheus.yml at python-ml:9000).
+
+If prometheus-client isn't installed every metric is a no-op, so the library code in
+ml_geolocate can be instrumented unconditionally.
+
+In multi-process mode (ML_WORKER_PROCESSES != 1) children write samples to
+PROMETHEUS_MULTIPROC_DIR and the supervisor serves the aggregated view; the env var
+must be set before prometheus_client is imported, which is why it happens here.
+"""
+
+import os
+import time
+import shutil
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger("metrics")
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9000'))
+MULTIPROCESS = os.getenv('ML_WORKER_PROCESSES', '1') != '1'
+
+if MULTIPROCESS:
+    if not os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = '/tmp/prometheus-ml'
+    _multiproc_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    # the first process importing this module is the supervisor: stale files of a previous run
+    # would be summed in, so they go before any metric of this run exists; children inherit the marker
+    if not os.getenv('ML_METRICS_DIR_OWNER'):
+        os.environ['ML_METRICS_DIR_OWNER'] = str(os.getpid())
+        shutil.rmtree(_multiproc_dir, ignore_errors=True)
+    os.makedirs(_multiproc_dir, exist_ok=True)
+
+try:
+    from prometheus_client import Counter, Gauge, Histogram, start_http_server
+    _PROMETHEUS_AVAILABLE = True
+except Exception:
+    _PROMETHEUS_AVAILABLE = False
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, *args, **kwargs):
+        pass
+
+    def dec(self, *args, **kwargs):
+        pass
+
+    def set(self, *args, **kwargs):
+        pass
+
+    def observe(self, *args, **kwargs):
+        pass
+
+
+# latency buckets from sub-ms cache hits up to slow S3/geocoder calls
+_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+if _PROMETHEUS_AVAILABLE:
+    STAGE_LATENCY = Histogram('ml_stage_latency_seconds', 'Latency of worker stages', ['stage'], buckets=_BUCKETS)
+    MESSAGES = Counter('ml_messages_total', 'Processed task messages', ['status'])
+    DETECTIONS = Counter('ml_detections_total', 'Detections produced')
+    FAILURES = Counter('ml_failures_total', 'Failures by stage', ['stage'])
+    OCR_CROPS = Counter('ml_ocr_crops_total', 'OCR crops by outcome', ['result'])
+    RESULT_CACHE = Counter('ml_result_cache_total', 'Result cache lookups', ['result'])
+    TRACKING = Counter('ml_tracked_detections_total', 'Detections by cross-frame tracking outcome', ['status'])
+    DEM_TILE_CACHE = Counter('ml_dem_tile_cache_total', 'DEM tile cache lookups and evictions', ['result'])
+    GEOLOCATION_METHOD = Counter('ml_geolocation_method_total', 'Detections by geolocation method', ['method'])
+    DEGRADATION = Counter('ml_degradation_total', 'Tasks by applied degradation level', ['level'])
+    QUALITY_GATE = Counter('ml_quality_gate_total', 'Pre-detection gate decisions', ['action', 'reason'])
+    QUALITY_GATE_SAVED = Counter('ml_quality_gate_saved_seconds_total',
+                                 'Estimated detection/enrich time saved by skipped frames')
+    POSTGIS_ROWS = Counter('ml_postgis_results_total', 'Results written by the PostGIS sink', ['result'])
+    IN_FLIGHT = Gauge('ml_in_flight_messages', 'Messages inside the pipeline', multiprocess_mode='livesum')
+    CONSUMER_LAG = Gauge('ml_consumer_lag', 'Messages behind the partition high watermark', ['partition'],
+                         multiprocess_mode='livesum')
+    STARTUP_SECONDS = Gauge('ml_startup_phase_seconds', 'Time spent in each startup phase', ['phase'],
+                            multiprocess_mode='max')
+    READY = Gauge('ml_ready', 'Worker processes ready to consume', multiprocess_mode='livesum')
+else:
+    STAGE_LATENCY = MESSAGES = DETECTIONS = FAILURES = OCR_CROPS = RESULT_CACHE = GEOLOCATION_METHOD = _NoopMetric()
+    DEGRADATION = DEM_TILE_CACHE = TRACKING = POSTGIS_ROWS = QUALITY_GATE = QUALITY_GATE_SAVED = _NoopMetric()
+    IN_FLIGHT = CONSUMER_LAG = STARTUP_SECONDS = READY = _NoopMetric()
+
+
+@contextmanager
+def timed(stage: str):
+    """Observe wall time of the block in ml_stage_latency_seconds{stage=...}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start)
+
+
+def start_metrics_server(port: int = METRICS_PORT, aggregate: bool = False):
+    """
+    Serve /metrics. aggregate=True is used by the multi-process supervisor to expose
+    the samples of all children.
+    """
+    if not _PROMETHEUS_AVAILABLE:
+        logger.warning('prometheus-client not installed; metrics disabled')
+        return
+    try:
+        if aggregate:
+            from prometheus_client import CollectorRegistry, multiprocess
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            start_http_server(port, registry=registry)
+        else:
+            start_http_server(port)
+        logger.info('Metrics server listening on :%d', port)
+    except Exception:
+        logger.exception('Failed to start metrics server on :%d', port)
+
+
+def mark_process_dead(pid: int):
+    if _PROMETHEUS_AVAILABLE and MULTIPROCESS:
+        try:
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(pid)
+        except Exception:
+            pass
@@ -5,37 +5,31 @@ Main entrypoint:
     process_image_bytes(image_bytes: bytes, metadata: dict) -> dict
 """
 
+import os
+import sys
 import math
-import json
+import time
 import logging
-from io import BytesIO
-from typing import Dict, Any, List, Optional, Tuple
+import threading
+from typing import Callable, Dict, Any, List, Optional, Tuple
 
 import numpy as np
-from PIL import Image, ExifTags
-
-# optional libs
-try:
-    import requests
-except Exception:
-    requests = None
-
-try:
-    import pytesseract
-except Exception:
-    pytesseract = None
-
-try:
-    from pyproj import CRS
-except Exception:
-    CRS = None
-
-# optional: ultralytics YOLO
-try:
-    from ultralytics import YOLO
-    _YOLO_AVAILABLE = True
-except Exception:
-    _YOLO_AVAILABLE = False
+from PIL import Image
+
+from geocode_cache import GeocodeCache
+from offline_geocoder import OfflineGeocoder
+from metrics import timed, DETECTIONS, GEOLOCATION_METHOD, TRACKING
+from ocr_engine import get_ocr_engine
+from image_decode import DecodedImage, decode_frame, decode_image, parse_exif, read_image_header
+from visual_index import VisualLocalizer
+from detectors import Detector, FallbackDetector, create_detector
+from tiling import detect_tiled
+from terrain import TerrainModel
+from object_tracker import ObjectTracker
+from quality_gate import QualityGate
+
+# heavy optional libs (ultralytics/torch, onnxruntime, requests, OCR backends) are imported lazily,
+# only once the backend that needs them is used - see load_model() / init_backends()
 
 logger = logging.getLogger("ml_geolocate")
 logging.basicConfig(level=logging.INFO)
@@ -46,25 +40,8 @@ logging.basicConfig(level=logging.INFO)
 # -------------------------
 def extract_exif_from_pil(img: Image.Image) -> Dict[str, Any]:
     """Возвращает распарсенный exif (ключи по human-readable тегам)."""
-    exif = {}
-    try:
-        raw = img._getexif()
-        if not raw:
-            return {}
-        for tag, value in raw.items():
-            decoded = ExifTags.TAGS.get(tag, tag)
-            exif[decoded] = value
-        # GPS
-        if 'GPSInfo' in exif:
-            gps_raw = exif['GPSInfo']
-            gps = {}
-            for t, val in gps_raw.items():
-                sub = ExifTags.GPSTAGS.get(t, t)
-                gps[sub] = val
-            exif['GPS'] = gps
-    except Exception:
-        return {}
-    return exif
+    # reads the header only, so it's cheap on a freshly opened (not loaded) image
+    return parse_exif(img)
 
 
 def gps_to_decimal(gps: Dict) -> Optional[Tuple[float, float]]:
@@ -72,11 +49,16 @@ def gps_to_decimal(gps: Dict) -> Optional[Tuple[float, float]]:
     if not gps:
         return None
     try:
+        def _ratio(x):
+            # old Pillow: (num,den) tuples, new Pillow: IFDRational
+            if isinstance(x, tuple):
+                return x[0] / x[1]
+            return float(x)
+
         def _to_deg(t):
-            # t is tuple of tuples (num,den)
-            d = t[0][0] / t[0][1]
-            m = t[1][0] / t[1][1]
-            s = t[2][0] / t[2][1]
+            d = _ratio(t[0])
+            m = _ratio(t[1])
+            s = _ratio(t[2])
             return d + m/60.0 + s/3600.0
 
         lat = _to_deg(gps['GPSLatitude'])
@@ -93,14 +75,67 @@ def gps_to_decimal(gps: Dict) -> Optional[Tuple[float, float]]:
 # -------------------------
 # Detection (pluggable)
 # -------------------------
-# If YOLOv8 is installed and you set YOLO_MODEL_PATH, we'll use it.
-YOLO_MODEL_PATH = None  # set to 'yolov8n.pt' or custom path if available
-_yolo_model = None
-if _YOLO_AVAILABLE and YOLO_MODEL_PATH:
+MODEL_PATH = os.getenv("MODEL_PATH", "")  # YOLOv8 .pt or exported .onnx; empty -> fallback detector
+DETECTOR_BACKEND = os.getenv("DETECTOR_BACKEND", "auto")  # auto | ultralytics | onnx | fallback, see detectors.py
+DETECT_CONF = float(os.getenv("DETECT_CONF", "0.25"))
+DETECT_IOU = float(os.getenv("DETECT_IOU", "0.7"))
+ONNX_INPUT_SIZE = int(os.getenv("ONNX_INPUT_SIZE", "640"))
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # 0 -> onnxruntime default
+_detector: Optional[Detector] = None
+_model_lock = threading.Lock()
+
+
+def load_model() -> Detector:
+    """Create the detector once (its framework is imported here, not at module import)."""
+    global _detector
+    if _detector is None:
+        with _model_lock:
+            if _detector is None:
+                try:
+                    _detector = create_detector(DETECTOR_BACKEND, MODEL_PATH, conf=DETECT_CONF, iou=DETECT_IOU,
+                                                input_size=ONNX_INPUT_SIZE, threads=ONNX_THREADS)
+                    logger.info("Detector: %s", _detector.fingerprint())
+                except Exception:
+                    logger.exception("Failed to load %s detector %s; using fallback detector",
+                                     DETECTOR_BACKEND, MODEL_PATH)
+                    _detector = FallbackDetector()
+    return _detector
+
+
+def reload_model_after_fork(threads: int = 0):
+    """Recreate a detector that can't be used in a forked child (loaded before fork by the supervisor)."""
+    global _detector, ONNX_THREADS
+    if threads:
+        ONNX_THREADS = threads
+    if _detector is not None and not _detector.fork_safe:
+        _detector = None
+        load_model()
+
+
+def detect_buildings_batch(images: List[Image.Image]) -> List[List[Dict[str, Any]]]:
+    """
+    Run detection on several images with a single model call.
+    Returns one detection list per input image (same order).
+    """
     try:
-        _yolo_model = YOLO(YOLO_MODEL_PATH)
+        return _detect_batch(images)
     except Exception:
-        _yolo_model = None
+        logger.exception("Batched detection failed for %d images", len(images))
+        return [[] for _ in images]
+
+
+def _detect_batch(images: List[Image.Image]) -> List[List[Dict[str, Any]]]:
+    """detect_buildings_batch() that raises instead of returning empty lists on failure."""
+    return load_model().detect_batch(images) if images else []
+
+
+DETECT_TILING = os.getenv("DETECT_TILING", "0") == "1"
+DETECT_TILE_MIN_IMAGE = int(os.getenv("DETECT_TILE_MIN_IMAGE", "2048"))  # longer side (px) above which tiling kicks in
+DETECT_TILE_SIZE = int(os.getenv("DETECT_TILE_SIZE", "640"))
+DETECT_TILE_OVERLAP = int(os.getenv("DETECT_TILE_OVERLAP", "128"))
+DETECT_TILE_MAX_IN_FLIGHT = int(os.getenv("DETECT_TILE_MAX_IN_FLIGHT", "8"))
+DETECT_TILE_MERGE = os.getenv("DETECT_TILE_MERGE", "nms")  # nms | wbf
+DETECT_TILE_GLOBAL_PASS = os.getenv("DETECT_TILE_GLOBAL_PASS", "1") == "1"  # also detect on the whole reduced image
 
 
 def detect_buildings(image: Image.Image) -> List[Dict[str, Any]]:
@@ -108,32 +143,7 @@ def detect_buildings(image: Image.Image) -> List[Dict[str, Any]]:
     Run detection. If YOLO model available, use it; otherwise use lightweight heuristic.
     Return list of dicts: {'label','bbox':[x,y,w,h], 'confidence':float, 'mask':optional}
     """
-    if _yolo_model is not None:
-        # Use YOLOv8 model inference (expects numpy array)
-        np_img = np.array(image)
-        results = _yolo_model.predict(np_img, verbose=False)
-        detections = []
-        try:
-            boxes = results[0].boxes
-            for b in boxes:
-                xyxy = b.xyxy[0].tolist()  # [x1,y1,x2,y2]
-                x1, y1, x2, y2 = map(int, xyxy)
-                detections.append({
-                    "label": _yolo_model.names[int(b.cls[0])],
-                    "bbox": [x1, y1, x2 - x1, y2 - y1],
-                    "confidence": float(b.conf[0]),
-                    "mask": None
-                })
-        except Exception:
-            # fallback empty
-            return []
-        return detections
-
-    # Fallback fake/simple detector: center large bbox — for tests only
-    w, h = image.size
-    bx, by = int(w * 0.15), int(h * 0.15)
-    bw, bh = int(w * 0.7), int(h * 0.7)
-    return [{"label": "building", "bbox": [bx, by, bw, bh], "confidence": 0.6, "mask": None}]
+    return detect_buildings_batch([image])[0]
 
 
 # -------------------------
@@ -228,6 +238,116 @@ def enu_offset_to_latlon(lat0: float, lon0: float, east_m: float, north_m: float
     return lat0 + dlat, lon0 + dlon
 
 
+def enu_offsets_to_latlon(lat0: float, lon0: float, east_m: np.ndarray, north_m: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Vectorized enu_offset_to_latlon for arrays of offsets from one origin."""
+    R = 6378137.0
+    dlat = np.degrees(np.asarray(north_m, dtype=np.float64) / R)
+    dlon = np.degrees(np.asarray(east_m, dtype=np.float64) / (R * math.cos(math.radians(lat0))))
+    return lat0 + dlat, lon0 + dlon
+
+
+def bbox_centers(bboxes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(N,4) [x,y,w,h] -> center pixel coords (u, v)."""
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    return bboxes[:, 0] + bboxes[:, 2] / 2.0, bboxes[:, 1] + bboxes[:, 3] / 2.0
+
+
+# -------------------------
+# Terrain (DEM) for INS projection
+# -------------------------
+DEM_DIR = os.getenv("DEM_DIR", "/app/models/dem")  # SRTM .hgt or .npy grids, see terrain.py
+DEM_CACHE_MB = float(os.getenv("DEM_CACHE_MB", "512"))
+DEM_MAX_RANGE_M = float(os.getenv("DEM_MAX_RANGE_M", "5000"))
+DEM_RAY_STEP_M = float(os.getenv("DEM_RAY_STEP_M", "10"))
+DEM_VERTICAL_ERROR_M = float(os.getenv("DEM_VERTICAL_ERROR_M", "5"))
+
+_terrain: Optional[TerrainModel] = None
+_terrain_loaded = False
+_terrain_lock = threading.Lock()
+
+
+def get_terrain() -> Optional[TerrainModel]:
+    """Shared DEM, None if DEM_DIR has no tiles (INS projection then uses a flat ground plane)."""
+    global _terrain, _terrain_loaded
+    if not _terrain_loaded:
+        with _terrain_lock:
+            if not _terrain_loaded:
+                if DEM_DIR and os.path.isdir(DEM_DIR):
+                    try:
+                        _terrain = TerrainModel(DEM_DIR, cache_mb=DEM_CACHE_MB)
+                    except Exception:
+                        logger.exception("Failed to load DEM %s", DEM_DIR)
+                _terrain_loaded = True
+    return _terrain
+
+
+def project_bboxes_to_ground_using_ins(
+    bboxes: np.ndarray,
+    img_w: int,
+    img_h: int,
+    camera_lat: float,
+    camera_lon: float,
+    camera_alt_m: float,
+    yaw_deg: float,
+    pitch_deg: float,
+    roll_deg: float,
+    focal_px: Optional[float] = None,
+    terrain: Optional[TerrainModel] = None,
+    camera_alt_msl_m: Optional[float] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Batched project_bbox_center_to_ground_using_ins: one pose, (N,4) bboxes.
+    Rotation is computed once; rays, ground intersection and lat/lon are array ops.
+    camera_alt_m is the height above the ground below the camera. With a terrain model
+    rays are intersected with the DEM instead of a flat plane; the camera's absolute
+    altitude is camera_alt_msl_m if known, else ground elevation + camera_alt_m.
+    Returns arrays 'lat', 'lon', 'error_radius_m', boolean 'valid' (ray hits the ground)
+    and boolean 'terrain' (position from the DEM).
+    """
+    u, v = bbox_centers(bboxes)
+    if focal_px is None:
+        focal_px = max(img_w, img_h)  # very rough fallback -> yields close-range but low accuracy
+
+    # normalized camera rays, one row per bbox
+    d_cam = np.empty((len(u), 3), dtype=np.float64)
+    d_cam[:, 0] = (u - img_w / 2.0) / focal_px
+    d_cam[:, 1] = (v - img_h / 2.0) / focal_px
+    d_cam[:, 2] = 1.0
+    d_cam /= np.linalg.norm(d_cam, axis=1, keepdims=True)
+
+    R = rotation_matrix_from_yaw_pitch_roll(yaw_deg, pitch_deg, roll_deg)  # world <- camera
+    d_world = d_cam @ R.T
+
+    dz = d_world[:, 2]
+    valid = np.abs(dz) >= 1e-6
+    # ground plane at z = -camera_alt_m in the camera-centred ENU frame
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.where(valid, -camera_alt_m / np.where(valid, dz, 1.0), 0.0)
+    valid &= t > 0
+    east = d_world[:, 0] * t
+    north = d_world[:, 1] * t
+    lat, lon = enu_offsets_to_latlon(camera_lat, camera_lon, east, north)
+    error_m = np.maximum(5.0, camera_alt_m * 0.1 + (1.0 / np.maximum(1e-6, np.abs(dz))) * 2.0)
+    on_terrain = np.zeros(len(u), dtype=bool)
+
+    if terrain is not None and len(u):
+        alt_msl = camera_alt_msl_m
+        if alt_msl is None:
+            ground = float(terrain.elevation(np.asarray([camera_lat]), np.asarray([camera_lon]))[0])
+            alt_msl = None if math.isnan(ground) else ground + camera_alt_m
+        if alt_msl is not None:
+            hits = terrain.intersect_rays(camera_lat, camera_lon, alt_msl, d_world,
+                                          max_range_m=DEM_MAX_RANGE_M, step_m=DEM_RAY_STEP_M)
+            on_terrain = hits["hit"]
+            lat = np.where(on_terrain, hits["lat"], lat)
+            lon = np.where(on_terrain, hits["lon"], lon)
+            # DEM height error moves the hit along the ray by error / sin(elevation angle)
+            terrain_err = np.maximum(3.0, 0.01 * hits["range_m"] + DEM_VERTICAL_ERROR_M / np.maximum(0.05, np.abs(dz)))
+            error_m = np.where(on_terrain, terrain_err, error_m)
+            valid |= on_terrain
+    return {"lat": lat, "lon": lon, "error_radius_m": error_m, "valid": valid, "terrain": on_terrain}
+
+
 def project_bbox_center_to_ground_using_ins(
     bbox: List[int],
     img_w: int,
@@ -244,59 +364,148 @@ def project_bbox_center_to_ground_using_ins(
     Given bbox (x,y,w,h) in pixels and camera pose, compute intersection point on ground (z=0).
     Returns dict with lat/lon, error estimate, confidence, method = 'ins_projection'.
     """
-    # compute center pixel
-    x, y, w, h = bbox
-    cx_pix = x + w / 2.0
-    cy_pix = y + h / 2.0
+    proj = project_bboxes_to_ground_using_ins(np.asarray([bbox]), img_w, img_h, camera_lat, camera_lon,
+                                              camera_alt_m, yaw_deg, pitch_deg, roll_deg, focal_px,
+                                              terrain=get_terrain())
+    if not proj["valid"][0]:
+        return None
+    return {"lat": float(proj["lat"][0]), "lon": float(proj["lon"][0]), "confidence": 0.8,
+            "error_radius_m": float(proj["error_radius_m"][0]),
+            "method": "ins_terrain" if proj["terrain"][0] else "ins_projection"}
 
-    # principal point assume center
-    cx = img_w / 2.0
-    cy = img_h / 2.0
 
-    # estimate focal in pixels if not provided
-    if focal_px is None:
-        # assume fx = fy
-        focal_px = max(img_w, img_h)  # very rough fallback -> yields close-range but low accuracy
-    fx = fy = focal_px
-
-    # direction in camera coords
-    d_cam = pixel_to_direction_vector(cx_pix, cy_pix, cx, cy, fx, fy)  # normalized
+def exif_corrected_latlon_batch(
+    bboxes: np.ndarray,
+    img_w: int,
+    img_h: int,
+    lat0: float,
+    lon0: float,
+    focal_px: float,
+    approx_alt: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Shift image-level EXIF GPS by each bbox center's offset from the image center.
+    angular displacement ~ d/focal; lateral meters ~ distance * tan(angle).
+    """
+    u, v = bbox_centers(bboxes)
+    meters_x = approx_alt * np.tan((u - img_w / 2.0) / focal_px)
+    meters_y = approx_alt * np.tan((v - img_h / 2.0) / focal_px)
+    # east = meters_x, north = -meters_y (image y down)
+    return enu_offsets_to_latlon(lat0, lon0, meters_x, -meters_y)
 
-    # rotate to world (ENU) frame
-    R = rotation_matrix_from_yaw_pitch_roll(yaw_deg, pitch_deg, roll_deg)  # world <- camera
-    d_world = R @ d_cam  # direction in world frame (assumed ENU with z-up)
 
-    # if ray points upwards (d_world[2] > 0), cannot intersect ground below; require negative z
-    if abs(d_world[2]) < 1e-6:
-        return None
-    # for camera at altitude H (meters above ground), solve t where origin + t * d_world has z = -H (ENU frame origin at camera)
-    # ENU coordinate: z axis up; ground plane at z = -camera_alt_m (if camera_alt is height above ground)
-    # origin is (0,0,0), so we need t such that z = 0_ground - camera_alt? Simpler: treat ground at z = -camera_alt_m
-    t = -camera_alt_m / d_world[2]
-    # only positive t meaningful
-    if t <= 0:
-        return None
-    east = d_world[0] * t
-    north = d_world[1] * t
-    # convert to lat/lon using small-angle approximation
-    lat, lon = enu_offset_to_latlon(camera_lat, camera_lon, east, north)
-    # basic error & confidence heuristics
-    error_m = max(5.0, camera_alt_m * 0.1 + (1.0 / max(1e-6, abs(d_world[2]))) * 2.0)
-    confidence = 0.8
-    return {"lat": lat, "lon": lon, "confidence": confidence, "error_radius_m": error_m, "method": "ins_projection"}
+def geolocate_bboxes(
+    bboxes: np.ndarray,
+    img_w: int,
+    img_h: int,
+    exif: Dict[str, Any],
+    metadata: Dict[str, Any],
+    image_geo_guess: Optional[Dict[str, Any]]
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    Geolocation of all bboxes of one image from EXIF GPS (A) or INS pose (B).
+    Returns one dict per bbox, None where neither source applies.
+    """
+    n = len(bboxes)
+    out: List[Optional[Dict[str, Any]]] = [None] * n
+    if n == 0:
+        return out
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+
+    # A: EXIF GPS from image, corrected by bbox offset from image center
+    if image_geo_guess:
+        focal_px = estimate_focal_pixels(exif, img_w)
+        if focal_px is None:
+            focal_px = max(img_w, img_h)
+        # very rough meters per pixel at ground: assume average distance D ~ altitude or 50m if unknown
+        approx_alt = None
+        if metadata and metadata.get("ins"):
+            approx_alt = metadata["ins"].get("alt_m")
+        if approx_alt is None:
+            approx_alt = 50.0  # fallback estimate
+        lats, lons = exif_corrected_latlon_batch(bboxes, img_w, img_h, image_geo_guess["lat"],
+                                                 image_geo_guess["lon"], focal_px, approx_alt)
+        err = max(10, approx_alt * 0.2)
+        return [{"lat": float(la), "lon": float(lo), "confidence": 0.85, "error_radius_m": err,
+                 "method": "exif_corrected"} for la, lo in zip(lats, lons)]
+
+    # B: INS projection: if metadata contains camera pose/telemetry
+    ins = metadata.get("ins") if metadata else None
+    if ins:
+        try:
+            cam_lat = float(ins.get("lat"))
+            cam_lon = float(ins.get("lon"))
+            cam_alt = float(ins.get("alt_m", 0.0))
+            yaw = float(ins.get("yaw", 0.0))
+            pitch = float(ins.get("pitch", 0.0))
+            roll = float(ins.get("roll", 0.0))
+            focal_px = None
+            # estimate focal_px from metadata if given in mm and sensor_mm
+            focal_mm = ins.get("focal_mm")
+            sensor_mm = ins.get("sensor_mm", 36.0)
+            if focal_mm:
+                try:
+                    focal_px = float(focal_mm) * (img_w / float(sensor_mm))
+                except Exception:
+                    focal_px = None
+            alt_msl = ins.get("alt_msl_m")
+            proj = project_bboxes_to_ground_using_ins(bboxes, img_w, img_h, cam_lat, cam_lon, cam_alt,
+                                                      yaw, pitch, roll, focal_px, terrain=get_terrain(),
+                                                      camera_alt_msl_m=float(alt_msl) if alt_msl is not None else None)
+        except Exception:
+            return out
+        for i in np.flatnonzero(proj["valid"]):
+            out[i] = {"lat": float(proj["lat"][i]), "lon": float(proj["lon"][i]), "confidence": 0.8,
+                      "error_radius_m": float(proj["error_radius_m"][i]),
+                      "method": "ins_terrain" if proj["terrain"][i] else "ins_projection"}
+    return out
 
 
 # -------------------------
-# Visual retrieval / georeg fallback (placeholders)
+# Visual retrieval / georeg fallback
 # -------------------------
-def visual_localization_fallback(image: Image.Image) -> Dict[str, Any]:
-    import random
-    return {"lat": 55.75 + random.uniform(-0.02, 0.02), "lon": 37.61 + random.uniform(-0.02, 0.02), "confidence": 0.25, "error_radius_m": 2000, "method": "visual_retrieval"}
+VISUAL_INDEX_DIR = os.getenv("VISUAL_INDEX_DIR", "/app/models/visual_index")  # built by visual_index.py
+VISUAL_INDEX_K = int(os.getenv("VISUAL_INDEX_K", "10"))
+VISUAL_INDEX_NPROBE = int(os.getenv("VISUAL_INDEX_NPROBE", "16"))
+VISUAL_MIN_SIMILARITY = float(os.getenv("VISUAL_MIN_SIMILARITY", "0.6"))
+
+_visual_localizer: Optional[VisualLocalizer] = None
+_visual_localizer_loaded = False
+_visual_lock = threading.Lock()
+
+
+def get_visual_localizer() -> Optional[VisualLocalizer]:
+    """Shared memory-mapped index, None if it isn't built or faiss is missing."""
+    global _visual_localizer, _visual_localizer_loaded
+    if not _visual_localizer_loaded:
+        with _visual_lock:
+            if not _visual_localizer_loaded:
+                if VISUAL_INDEX_DIR and os.path.exists(os.path.join(VISUAL_INDEX_DIR, "meta.json")):
+                    try:
+                        _visual_localizer = VisualLocalizer(VISUAL_INDEX_DIR, k=VISUAL_INDEX_K,
+                                                            nprobe=VISUAL_INDEX_NPROBE,
+                                                            min_similarity=VISUAL_MIN_SIMILARITY)
+                    except Exception:
+                        logger.exception("Failed to load visual index %s", VISUAL_INDEX_DIR)
+                _visual_localizer_loaded = True
+    return _visual_localizer
+
 
+def visual_localization_batch(images: List[Image.Image]) -> List[Optional[Dict[str, Any]]]:
+    locator = get_visual_localizer()
+    if locator is None:
+        return [None for _ in images]
+    with timed("visual_localization"):
+        return locator.locate_batch(images)
 
-def georeg_model_fallback(image: Image.Image) -> Dict[str, Any]:
-    import random
-    return {"lat": 55.75 + random.uniform(-0.5, 0.5), "lon": 37.61 + random.uniform(-0.5, 0.5), "confidence": 0.1, "error_radius_m": 20000, "method": "georeg"}
+
+def visual_localization_fallback(image: Image.Image) -> Optional[Dict[str, Any]]:
+    return visual_localization_batch([image])[0]
+
+
+def georeg_model_fallback(image: Image.Image) -> Optional[Dict[str, Any]]:
+    # no georeg model is shipped; better no position than a made-up one
+    return None
 
 
 # -------------------------
@@ -304,19 +513,14 @@ def georeg_model_fallback(image: Image.Image) -> Dict[str, Any]:
 # -------------------------
 def run_ocr_if_available(image: Image.Image, bbox: Optional[List[int]] = None) -> Optional[str]:
     """
-    Run OCR inside bbox (if bbox provided) or whole image. Uses pytesseract if available.
+    Run OCR inside bbox (if bbox provided) or whole image. Uses the shared OCR engine
+    (tesserocr or pytesseract) if available.
     """
-    if pytesseract is None:
+    engine = get_ocr_engine()
+    if not engine.available:
         return None
     try:
-        if bbox:
-            x, y, w, h = map(int, bbox)
-            crop = image.crop((x, y, x + w, y + h))
-        else:
-            crop = image
-        txt = pytesseract.image_to_string(crop, lang='rus+eng')
-        txt = txt.strip()
-        return txt if txt else None
+        return engine.run_batch(image, [bbox])[0]["text"]
     except Exception:
         return None
 
@@ -324,167 +528,467 @@ def run_ocr_if_available(image: Image.Image, bbox: Optional[List[int]] = None) -
 # -------------------------
 # Reverse geocoding (Nominatim / OSM)
 # -------------------------
+DECODE_TARGET_SIZE = int(os.getenv("DECODE_TARGET_SIZE", "640"))  # 0 -> always decode full resolution
+GEOCODER_BACKEND = os.getenv("GEOCODER_BACKEND", "nominatim")  # nominatim | offline
+OFFLINE_GEOCODER_INDEX = os.getenv("OFFLINE_GEOCODER_INDEX", "/app/models/geocoder_index")
+OFFLINE_GEOCODER_MAX_DISTANCE_M = float(os.getenv("OFFLINE_GEOCODER_MAX_DISTANCE_M", "250"))
+NOMINATIM_URL = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org/reverse")
+NOMINATIM_USER_AGENT = os.getenv("NOMINATIM_USER_AGENT", "ml-geolocate/1.0 (+your-email@example.com)")
+GEOCODE_TIMEOUT_S = float(os.getenv("GEOCODE_TIMEOUT_S", "8"))
+GEOCODE_POOL_SIZE = int(os.getenv("GEOCODE_POOL_SIZE", "16"))
+GEOCODE_CACHE_PRECISION = int(os.getenv("GEOCODE_CACHE_PRECISION", "8"))  # geohash chars, 8 ~ 38m x 19m
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "50000"))
+GEOCODE_CACHE_DB = os.getenv("GEOCODE_CACHE_DB", "/tmp/geocode_cache.sqlite")  # empty -> memory only
+GEOCODE_CACHE_TTL_S = float(os.getenv("GEOCODE_CACHE_TTL_S", str(30 * 24 * 3600)))
+
+_http_session = None
+_geocode_cache: Optional[GeocodeCache] = None
+_offline_geocoder: Optional[OfflineGeocoder] = None
+_geocode_lock = threading.Lock()
+
+
+def _get_http_session():
+    """One pooled keep-alive session shared by all threads."""
+    global _http_session
+    if _http_session is None:
+        with _geocode_lock:
+            if _http_session is None:
+                import requests
+                import requests.adapters
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=GEOCODE_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers["User-Agent"] = NOMINATIM_USER_AGENT
+                _http_session = session
+    return _http_session
+
+
+def _nominatim_reverse(lat: float, lon: float) -> Optional[Dict[str, Any]]:
+    params = {"lat": lat, "lon": lon, "format": "jsonv2", "addressdetails": 1}
+    r = _get_http_session().get(NOMINATIM_URL, params=params, timeout=GEOCODE_TIMEOUT_S)
+    r.raise_for_status()
+    j = r.json()
+    address = j.get("display_name")
+    return {"address": address, "raw": j}
+
+
+def get_geocode_cache() -> GeocodeCache:
+    global _geocode_cache
+    if _geocode_cache is None:
+        with _geocode_lock:
+            if _geocode_cache is None:
+                _geocode_cache = GeocodeCache(
+                    _nominatim_reverse,
+                    precision=GEOCODE_CACHE_PRECISION,
+                    max_entries=GEOCODE_CACHE_SIZE,
+                    db_path=GEOCODE_CACHE_DB or None,
+                    ttl_s=GEOCODE_CACHE_TTL_S,
+                )
+    return _geocode_cache
+
+
+def geocode_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters of the reverse-geocode cache."""
+    return get_geocode_cache().stats()
+
+
+def get_offline_geocoder() -> OfflineGeocoder:
+    global _offline_geocoder
+    if _offline_geocoder is None:
+        with _geocode_lock:
+            if _offline_geocoder is None:
+                _offline_geocoder = OfflineGeocoder(OFFLINE_GEOCODER_INDEX, OFFLINE_GEOCODER_MAX_DISTANCE_M)
+    return _offline_geocoder
+
+
 def reverse_geocode(lat: float, lon: float) -> Optional[Dict[str, Any]]:
-    if requests is None:
-        return None
+    if GEOCODER_BACKEND == "offline":
+        try:
+            return get_offline_geocoder().reverse(lat, lon)
+        except Exception:
+            logger.exception("Offline reverse geocode failed")
+            return None
     try:
-        url = f"https://nominatim.openstreetmap.org/reverse"
-        headers = {"User-Agent": "ml-geolocate/1.0 (+your-email@example.com)"}
-        params = {"lat": lat, "lon": lon, "format": "jsonv2", "addressdetails": 1}
-        r = requests.get(url, params=params, headers=headers, timeout=8)
-        r.raise_for_status()
-        j = r.json()
-        address = j.get("display_name")
-        return {"address": address, "raw": j}
+        return get_geocode_cache().get(lat, lon)
     except Exception:
         return None
 
 
+# -------------------------
+# Pre-detection quality gate
+# -------------------------
+QUALITY_GATE = os.getenv("QUALITY_GATE", "0") == "1"
+GATE_THUMB_SIZE = int(os.getenv("GATE_THUMB_SIZE", "256"))
+GATE_MIN_BRIGHTNESS = float(os.getenv("GATE_MIN_BRIGHTNESS", "0.08"))  # mean gray, 0..1
+GATE_MAX_CLIPPED = float(os.getenv("GATE_MAX_CLIPPED", "0.6"))  # fraction of saturated pixels
+GATE_MIN_ENTROPY = float(os.getenv("GATE_MIN_ENTROPY", "1.5"))  # bits of a 64-bin histogram (max 6)
+GATE_MIN_DETAIL = float(os.getenv("GATE_MIN_DETAIL", "5"))  # Laplacian variance; below -> skip as featureless
+GATE_MIN_SHARPNESS = float(os.getenv("GATE_MIN_SHARPNESS", "25"))  # Laplacian variance; below -> degrade
+GATE_MODEL_PATH = os.getenv("GATE_MODEL_PATH", "")  # optional ONNX buildings/no-buildings classifier
+GATE_MIN_SCORE = float(os.getenv("GATE_MIN_SCORE", "0.1"))  # classifier probability below -> skip
+GATE_DEGRADE_SCORE = float(os.getenv("GATE_DEGRADE_SCORE", "0.3"))  # below -> degrade
+
+_gate = QualityGate(GATE_THUMB_SIZE, GATE_MIN_BRIGHTNESS, GATE_MAX_CLIPPED, GATE_MIN_ENTROPY, GATE_MIN_DETAIL,
+                    GATE_MIN_SHARPNESS, GATE_MODEL_PATH, GATE_MIN_SCORE, GATE_DEGRADE_SCORE) if QUALITY_GATE else None
+
+
+def quality_gate_stats() -> Dict[str, Any]:
+    return _gate.stats() if _gate is not None else {}
+
+
 # -------------------------
 # High-level pipeline
 # -------------------------
-def process_image_bytes(image_bytes: bytes, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+def image_geolocation_from_exif(exif: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    gps = exif.get("GPS")
+    if gps:
+        latlon = gps_to_decimal(gps)
+        if latlon:
+            return {"lat": latlon[0], "lon": latlon[1], "method": "exif", "confidence": 0.95, "error_radius_m": 10}
+    return None
+
+
+def geolocate_exif_only(image_bytes: bytes) -> Optional[Dict[str, Any]]:
+    """Image-level geolocation from EXIF GPS without decoding any pixels."""
+    try:
+        _, exif = read_image_header(image_bytes)
+    except Exception:
+        return None
+    return image_geolocation_from_exif(exif)
+
+
+def decode_and_detect(
+    image_bytes: bytes,
+    metadata: Optional[Dict[str, Any]] = None,
+    detector: Optional[Callable[[Image.Image], List[Dict[str, Any]]]] = None,
+    batch_detector: Optional[Callable[[List[Image.Image]], List[List[Dict[str, Any]]]]] = None,
+    target_size: Optional[int] = None,
+    tiling: bool = True
+) -> Optional[Dict[str, Any]]:
     """
-    Main entry. metadata may include:
-      - 'ins': {'lat':..., 'lon':..., 'alt_m':..., 'yaw':..., 'pitch':..., 'roll':..., 'focal_mm':..., 'sensor_mm':...}
-      - or arbitrary fields helpful for localization
+    First half of the pipeline: decode image (reduced resolution for JPEGs), read EXIF and run detection.
+    batch_detector is used for the tiles in tiled mode (default detect_buildings_batch).
+    target_size overrides DECODE_TARGET_SIZE and tiling=False skips tiled detection (cheaper, degraded mode).
+    Returns a context dict for enrich_detections() or None if the image can't be opened.
+    Frames rejected by the quality gate get a context without detections.
     """
     metadata = metadata or {}
-    out = {"detections": [], "image_geolocation": None}
     try:
-        img = Image.open(BytesIO(image_bytes)).convert("RGB")
+        with timed("decode"):
+            decoded = decode_image(image_bytes, target_size or DECODE_TARGET_SIZE)
     except Exception as e:
         logger.exception("Failed to open image: %s", e)
-        return out
+        return None
 
-    img_w, img_h = img.size
-    exif = extract_exif_from_pil(img)
+    gate = _gate.check(decoded.image) if _gate is not None else None
+    if gate is not None and gate["action"] == "skip":
+        return _detection_context(decoded, metadata, [], gate)
+    degraded = gate is not None and gate["action"] == "degrade"
+    tiled = tiling and not degraded and DETECT_TILING and max(decoded.original_size) > DETECT_TILE_MIN_IMAGE
+    start = time.perf_counter()
+    with timed("detection"):
+        detections = []
+        if not tiled or DETECT_TILE_GLOBAL_PASS:
+            detections = (detector or detect_buildings)(decoded.image)
+        detections = _finish_detection(decoded, detections, tiled, batch_detector)
+    if _gate is not None:
+        _gate.record_cost("detection", time.perf_counter() - start)
+    return _detection_context(decoded, metadata, detections, gate)
+
+
+def _finish_detection(decoded: DecodedImage, detections: List[Dict[str, Any]], tiled: bool,
+                      batch_detector: Optional[Callable[[List[Image.Image]], List[List[Dict[str, Any]]]]]
+                      ) -> List[Dict[str, Any]]:
+    """Map reduced-image bboxes to full-resolution pixels; add tiles for large images."""
+    if decoded.reduced:
+        for det in detections:
+            det["bbox"] = decoded.to_original_bbox(det["bbox"])
+    if tiled:
+        detections = detect_tiled(decoded.full(), batch_detector or detect_buildings_batch,
+                                  tile_size=DETECT_TILE_SIZE, overlap=DETECT_TILE_OVERLAP,
+                                  max_in_flight=DETECT_TILE_MAX_IN_FLIGHT, merge=DETECT_TILE_MERGE,
+                                  iou_threshold=DETECT_IOU, extra=detections)
+    DETECTIONS.inc(len(detections))
+    return detections
+
+
+def _detection_context(decoded: DecodedImage, metadata: Dict[str, Any], detections: List[Dict[str, Any]],
+                       gate: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    return {
+        "image": decoded.image,
+        "decoded": decoded,
+        "image_size": decoded.original_size,
+        "exif": decoded.exif,
+        "metadata": metadata,
+        # global image-level geolocation from EXIF if present
+        "image_geolocation": image_geolocation_from_exif(decoded.exif),
+        "detections": detections,
+        "gate": gate,
+    }
 
-    # 0) global image-level geolocation from EXIF if present
-    image_geo_guess = None
-    gps = exif.get("GPS")
-    if gps:
-        latlon = gps_to_decimal(gps)
-        if latlon:
-            image_geo_guess = {"lat": latlon[0], "lon": latlon[1], "method": "exif", "confidence": 0.95, "error_radius_m": 10}
-            out["image_geolocation"] = image_geo_guess
 
-    # 1) Detection
-    detections = detect_buildings(img)
+def detect_frames(
+    frames: List[Image.Image],
+    metadatas: List[Dict[str, Any]],
+    batch_detector: Optional[Callable[[List[Image.Image]], List[List[Dict[str, Any]]]]] = None,
+    target_size: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    decode_and_detect() for already decoded frames (video keyframes): one batched
+    detector call for all frames, per-frame metadata (e.g. interpolated INS pose).
+    Returns one context per frame for enrich_detections().
+    """
+    detect_batch = batch_detector or detect_buildings_batch
+    with timed("decode"):
+        decoded = [decode_frame(f, target_size or DECODE_TARGET_SIZE) for f in frames]
+    gates = [_gate.check(d.image) if _gate is not None else None for d in decoded]
+    run = [i for i, g in enumerate(gates) if g is None or g["action"] != "skip"]
+    results: List[List[Dict[str, Any]]] = [[] for _ in decoded]
+    start = time.perf_counter()
+    with timed("detection"):
+        if run:
+            for i, dets in zip(run, detect_batch([decoded[i].image for i in run])):
+                results[i] = dets
+        contexts = []
+        for i, (dec, md, gate) in enumerate(zip(decoded, metadatas, gates)):
+            if i not in run:
+                contexts.append(_detection_context(dec, md, [], gate))
+                continue
+            tiled = DETECT_TILING and max(dec.original_size) > DETECT_TILE_MIN_IMAGE \
+                and not (gate is not None and gate["action"] == "degrade")
+            dets = results[i] if not tiled or DETECT_TILE_GLOBAL_PASS else []
+            contexts.append(_detection_context(dec, md, _finish_detection(dec, dets, tiled, batch_detector), gate))
+    if _gate is not None and run:
+        _gate.record_cost("detection", (time.perf_counter() - start) / len(run))
+    return contexts
+
+
+# -------------------------
+# Cross-frame object tracking
+# -------------------------
+TRACK_OBJECTS = os.getenv("TRACK_OBJECTS", "1") == "1"  # only for images with metadata flight_id/session_id
+TRACK_CELL_M = float(os.getenv("TRACK_CELL_M", "25"))
+TRACK_TTL_S = float(os.getenv("TRACK_TTL_S", "900"))
+TRACK_MAX_RADIUS_M = float(os.getenv("TRACK_MAX_RADIUS_M", "100"))
+
+_tracker = ObjectTracker(cell_m=TRACK_CELL_M, ttl_s=TRACK_TTL_S, max_radius_m=TRACK_MAX_RADIUS_M)
+
+
+def tracking_session(metadata: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not TRACK_OBJECTS or not metadata:
+        return None
+    session = metadata.get("flight_id") or metadata.get("session_id")
+    return str(session) if session else None
 
-    # 2) For each detection: try geolocation sources in order
-    for det in detections:
-        bbox = det.get("bbox")
+
+def enrich_detections(ctx: Dict[str, Any], ocr: bool = True, geocode: bool = True,
+                      frame_key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Second half of the pipeline: geolocation, OCR and reverse geocoding for every
+    detection of a context produced by decode_and_detect(). ocr/geocode=False skip
+    those steps (degraded mode); their fields are then None.
+
+    Images of a flight (metadata flight_id/session_id) are deduplicated against earlier
+    frames after geolocation (see object_tracker.py): OCR and geocoding run only for new
+    objects, and only new or updated objects are returned ("suppressed" counts the rest).
+    frame_key (image id / video frame) makes a reprocessed frame get its first answer
+    instead of being suppressed against itself.
+
+    The quality gate verdict of skipped and degraded frames is returned as "gate"
+    (degraded frames skip OCR).
+    """
+    gate = ctx.get("gate")
+    if gate is not None and gate["action"] == "skip":
+        return {"detections": [], "image_geolocation": ctx["image_geolocation"], "gate": gate}
+    if gate is not None and gate["action"] == "degrade":
+        ocr = False
+    start = time.perf_counter()
+    img = ctx["image"]
+    decoded = ctx["decoded"]
+    exif = ctx["exif"]
+    metadata = ctx["metadata"]
+    image_geo_guess = ctx["image_geolocation"]
+    detections = ctx["detections"]
+    img_w, img_h = ctx["image_size"]
+    # 2) Geolocation sources A (EXIF) and B (INS) for all detections at once
+    bboxes = [det.get("bbox") for det in detections]
+    with timed("geolocation"):
+        geos = geolocate_bboxes(bboxes, img_w, img_h, exif, metadata, image_geo_guess)
+
+    # C/D: image-level fallbacks, computed at most once per image
+    if any(g is None for g in geos):
+        fallback = visual_localization_fallback(img) or georeg_model_fallback(img)
+        if fallback is not None:
+            geos = [g if g is not None else dict(fallback) for g in geos]
+    for geo_res in geos:
+        if geo_res:
+            GEOLOCATION_METHOD.labels(geo_res.get("method", "unknown")).inc()
+
+    # cross-frame dedup: which detections are objects already seen in earlier frames
+    session = tracking_session(metadata)
+    tracks: List[Optional[Tuple[Any, str]]] = [None] * len(detections)
+    if session is not None and detections:
+        observations = [(det.get("label", ""), g["lat"], g["lon"], float(g.get("error_radius_m") or 0.0),
+                         float(det.get("confidence", 0.0))) if g else None
+                        for det, g in zip(detections, geos)]
+        with timed("tracking"):
+            tracks = _tracker.observe(session, observations, methods=[g.get("method") if g else None for g in geos],
+                                      frame_key=frame_key)
+        for track in tracks:
+            TRACKING.labels(track[1] if track else "untracked").inc()
+    fresh = [track is None or track[1] == "new" for track in tracks]
+
+    # 3) OCR of all crops of new/untracked detections in one pass. bboxes are in
+    # full-resolution pixels; full decode only happens if OCR actually runs
+    ocr_engine = get_ocr_engine()
+    ocr_idx = [i for i, f in enumerate(fresh) if f]
+    ocr_results = [{"text": None, "ms": 0.0, "skipped": "tracked"} for _ in detections]
+    if ocr and ocr_engine.available and ocr_idx:
+        for i, res in zip(ocr_idx, ocr_engine.run_batch(decoded.full(), [bboxes[i] for i in ocr_idx])):
+            ocr_results[i] = res
+    else:
+        skipped = "unavailable" if ocr else "degraded"
+        for i in ocr_idx:
+            ocr_results[i] = {"text": None, "ms": 0.0, "skipped": skipped}
+    out = {"detections": [], "image_geolocation": image_geo_guess}
+    suppressed = 0
+
+    for det, geo_res, ocr_res, track, is_fresh in zip(detections, geos, ocr_results, tracks, fresh):
+        if track is not None and track[1] == "unchanged":
+            suppressed += 1
+            continue
         det_entry = det.copy()
-        # prepare geolocation result container
-        geo_res = None
-
-        # A: EXIF GPS from image: if we have image-level GPS, compute correction offset based on bbox center -> approximate by small pixel shift
-        if image_geo_guess:
-            # Try to correct small offset: compute pixel offset from center, and approximate meters per pixel
-            cx_pix = bbox[0] + bbox[2] / 2.0
-            cy_pix = bbox[1] + bbox[3] / 2.0
-            img_cx = img_w / 2.0
-            img_cy = img_h / 2.0
-            dx_pix = cx_pix - img_cx
-            dy_pix = cy_pix - img_cy
-            # estimate focal px
-            focal_px = None
-            focal_px = estimate_focal_pixels(exif, img_w)
-            if focal_px is None:
-                focal_px = max(img_w, img_h)
-            # very rough meters per pixel at ground: assume average distance D ~ altitude or 50m if unknown
-            approx_alt = None
-            if metadata and metadata.get("ins"):
-                approx_alt = metadata["ins"].get("alt_m")
-            if approx_alt is None:
-                approx_alt = 50.0  # fallback estimate
-            # angular displacement ~ dx/focal; lateral meters ≈ distance * tan(angle)
-            meters_x = approx_alt * math.tan((dx_pix) / focal_px)
-            meters_y = approx_alt * math.tan((dy_pix) / focal_px)
-            # east = meters_x, north = -meters_y (image y down)
-            lat_corr, lon_corr = enu_offset_to_latlon(image_geo_guess["lat"], image_geo_guess["lon"], meters_x, -meters_y)
-            geo_res = {"lat": lat_corr, "lon": lon_corr, "confidence": 0.85, "error_radius_m": max(10, approx_alt * 0.2), "method": "exif_corrected"}
-
-        # B: INS projection: if metadata contains camera pose/telemetry
-        if geo_res is None and metadata.get("ins"):
-            ins = metadata["ins"]
-            try:
-                cam_lat = float(ins.get("lat"))
-                cam_lon = float(ins.get("lon"))
-                cam_alt = float(ins.get("alt_m", 0.0))
-                yaw = float(ins.get("yaw", 0.0))
-                pitch = float(ins.get("pitch", 0.0))
-                roll = float(ins.get("roll", 0.0))
-                focal_px = None
-                # estimate focal_px from metadata if given in mm and sensor_mm
-                focal_mm = ins.get("focal_mm")
-                sensor_mm = ins.get("sensor_mm", 36.0)
-                if focal_mm:
-                    try:
-                        focal_mm_val = float(focal_mm)
-                        focal_px = focal_mm_val * (img_w / float(sensor_mm))
-                    except Exception:
-                        focal_px = None
-                proj = project_bbox_center_to_ground_using_ins(bbox, img_w, img_h, cam_lat, cam_lon, cam_alt, yaw, pitch, roll, focal_px)
-                if proj:
-                    geo_res = proj
-            except Exception:
-                geo_res = None
-
-        # C: Visual localization (retrieval + SuperPoint etc.)
-        if geo_res is None:
-            vis = visual_localization_fallback(img)
-            if vis:
-                geo_res = vis
-
-        # D: Georeg fallback
-        if geo_res is None:
-            geo_res = georeg_model_fallback(img)
-
-        # OCR
-        ocr_text = run_ocr_if_available(img, bbox)
-
-        # Reverse geocode best guess if possible
-        rev = None
-        if geo_res and requests is not None:
-            try:
-                rev = reverse_geocode(geo_res["lat"], geo_res["lon"])
-            except Exception:
-                rev = None
-
-        det_entry["geolocation"] = geo_res
-        det_entry["ocr_text"] = ocr_text
-        det_entry["address"] = rev.get("address") if rev else None
+        if track is not None and not is_fresh:
+            # updated object: improved fused position, OCR/address from its first sighting
+            obj = track[0]
+            det_entry["geolocation"] = obj.geolocation()
+            det_entry["ocr_text"] = obj.ocr_text
+            det_entry["ocr_ms"] = 0.0
+            det_entry["address"] = obj.address
+        else:
+            # Reverse geocode best guess if possible
+            rev = None
+            if geo_res and geocode:
+                try:
+                    with timed("reverse_geocode"):
+                        rev = reverse_geocode(geo_res["lat"], geo_res["lon"])
+                except Exception:
+                    rev = None
+            det_entry["geolocation"] = geo_res
+            det_entry["ocr_text"] = ocr_res["text"]
+            det_entry["ocr_ms"] = round(ocr_res["ms"], 3)
+            det_entry["address"] = rev.get("address") if rev else None
+            if track is not None:
+                track[0].ocr_text = det_entry["ocr_text"]
+                track[0].address = det_entry["address"]
+        if track is not None:
+            det_entry["object_id"] = track[0].object_id
+            det_entry["track"] = track[1]
         out["detections"].append(det_entry)
 
+    if session is not None:
+        out["suppressed"] = suppressed
+    if gate is not None and gate["action"] != "pass":
+        out["gate"] = gate
+    if _gate is not None:
+        _gate.record_cost("enrich", time.perf_counter() - start)
     return out
 
 
 # -------------------------
-# Quick test helper
+# Startup
+# -------------------------
+def set_compute_threads(n: int):
+    """Limit intra-op threads so N worker processes don't oversubscribe the CPU."""
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(n)
+    # libraries imported later read the env vars; only already loaded ones need a call
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(n)
+    cv2 = sys.modules.get("cv2")
+    if cv2 is not None:
+        cv2.setNumThreads(n)
+
+
+def init_backends():
+    """Open every enabled backend now instead of on the first request."""
+    get_ocr_engine()
+    get_visual_localizer()
+    get_terrain()
+    if _gate is not None:
+        _gate.classifier()
+    if GEOCODER_BACKEND == "offline":
+        try:
+            get_offline_geocoder()
+        except Exception:
+            logger.exception("Offline geocoder index %s not usable; addresses disabled", OFFLINE_GEOCODER_INDEX)
+    else:
+        try:
+            _get_http_session()
+        except ImportError:
+            logger.warning("requests not installed; reverse geocoding disabled")
+        get_geocode_cache()
+
+
+def warmup(runs: int = 1, size: int = DECODE_TARGET_SIZE or 640):
+    """
+    Dummy detections so one-time costs (weight transfer, kernel selection, allocator
+    growth) are paid before real traffic.
+    """
+    image = Image.new("RGB", (size, size * 3 // 4), (127, 127, 127))
+    for _ in range(runs):
+        detect_buildings_batch([image])
+
+
+RESULT_VERSION = "1"  # bump when the result shape or pipeline logic changes
+
+
+def model_fingerprint() -> str:
+    """Identifies model + config that produced a result (used by the result cache)."""
+    model_id = load_model().fingerprint()
+    locator = get_visual_localizer()
+    visual_id = f"visual:{locator.index.ntotal}" if locator is not None else "visual:none"
+    terrain = get_terrain()
+    dem_id = terrain.fingerprint() if terrain is not None else "dem:none"
+    tiling = (f"tiles:{DETECT_TILE_MIN_IMAGE}:{DETECT_TILE_SIZE}:{DETECT_TILE_OVERLAP}:{DETECT_TILE_MERGE}:"
+              f"{int(DETECT_TILE_GLOBAL_PASS)}" if DETECT_TILING else "tiles:off")
+    track = f"track:{TRACK_CELL_M}:{TRACK_MAX_RADIUS_M}" if TRACK_OBJECTS else "track:off"
+    gate = _gate.fingerprint() if _gate is not None else "gate:off"
+    return "|".join([RESULT_VERSION, model_id, str(DECODE_TARGET_SIZE), GEOCODER_BACKEND, visual_id, dem_id, tiling,
+                     track, gate])
+
+
+def process_image_bytes(
+    image_bytes: bytes,
+    metadata: Optional[Dict[str, Any]] = None,
+    detector: Optional[Callable[[Image.Image], List[Dict[str, Any]]]] = None
+) -> Dict[str, Any]:
+    """
+    Main entry. metadata may include:
+      - 'ins': {'lat':..., 'lon':..., 'alt_m' (above ground):..., 'alt_msl_m' (optional):..., 'yaw':..., 'pitch':..., 'roll':..., 'focal_mm':..., 'sensor_mm':...}
+      - or arbitrary fields helpful for localization
+    detector: optional callable used instead of detect_buildings, e.g. InferenceBatcher.detect
+    to share one model call between several concurrently processed images.
+    Images that can't be decoded or detected give an empty result with "error"
+    ("decode_failed" | "detection_failed") so callers can tell them from empty frames.
+    """
+    try:
+        # without a caller-supplied detector, detection errors surface here instead of as no detections
+        ctx = decode_and_detect(image_bytes, metadata, detector or (lambda image: _detect_batch([image])[0]),
+                                batch_detector=None if detector else _detect_batch)
+    except Exception as e:
+        logger.exception("Detection failed: %s", e)
+        return {"detections": [], "image_geolocation": None, "error": "detection_failed"}
+    if ctx is None:
+        return {"detections": [], "image_geolocation": None, "error": "decode_failed"}
+    return enrich_detections(ctx)
+
+
+# -------------------------
+# CLI: see batch_process.py (directories, globs, JSONL manifests, resume)
 # -------------------------
 if __name__ == "__main__":
-    # quick local test: load image from disk and run pipeline
-    import sys
-    if len(sys.argv) < 2:
-        print("Usage: python ml_geolocate.py <image_path>")
-        sys.exit(1)
-    path = sys.argv[1]
-    with open(path, "rb") as f:
-        b = f.read()
-    # sample metadata with INS example
-    sample_meta = {
-        "ins": {
-            "lat": 55.752023,
-            "lon": 37.617499,
-            "alt_m": 60.0,
-            "yaw": 10.0,
-            "pitch": -5.0,
-            "roll": 0.0,
-            "focal_mm": 35.0,
-            "sensor_mm": 36.0
-        }
-    }
-    res = process_image_bytes(b, metadata=sample_meta)
-    print(json.dumps(res, indent=2, ensure_ascii=False))
+    from batch_process import main
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""
+Cross-frame dedup of geolocated detections within a flight/session.
+
+Consecutive drone frames overlap, so the same building is detected many times.
+Each session (metadata 'flight_id' or 'session_id') keeps an incremental spatial
+index: a uniform grid of ~cell_m metre cells, anchored at the session's first
+position, mapping cells to tracked objects. A detection merges into the nearest
+object of the same label when they lie within each other's error_radius_m;
+positions are fused by inverse-variance weighting, so an object's position and
+radius improve as more frames see it. Objects not seen for ttl_s are evicted,
+and so are empty sessions.
+
+observe() returns per detection its object and a status:
+    new        first sighting - run OCR / reverse geocoding, emit
+    updated    position or radius improved noticeably - emit, reuse OCR/address
+    unchanged  nothing new - skip expensive work, don't emit
+
+Observations are idempotent per frame: observe() with a frame_key seen before in the
+session (a redelivered or rewound message) returns the statuses of the first call
+and doesn't fuse the detections again, so the reprocessed result isn't suppressed.
+
+State is per process. Frames of one flight must reach the same worker process for
+complete dedup (e.g. key task messages by flight id).
+"""
+
+import math
+import time
+import threading
+import itertools
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+EARTH_R = 6378137.0
+M_PER_DEG = EARTH_R * math.pi / 180.0
+
+Observation = Tuple[str, float, float, float, float]  # label, lat, lon, error_radius_m, confidence
+
+
+class TrackedObject:
+    __slots__ = ("object_id", "label", "lat", "lon", "weight", "min_radius", "confidence", "method",
+                 "observations", "first_seen", "last_seen", "ocr_text", "address", "cell")
+
+    def __init__(self, object_id: str, label: str, lat: float, lon: float, radius: float, confidence: float,
+                 method: Optional[str], now: float):
+        self.object_id = object_id
+        self.label = label
+        self.lat = lat
+        self.lon = lon
+        self.weight = 1.0 / (radius * radius)
+        self.min_radius = radius
+        self.confidence = confidence
+        self.method = method
+        self.observations = 1
+        self.first_seen = now
+        self.last_seen = now
+        self.ocr_text: Optional[str] = None
+        self.address: Optional[str] = None
+        self.cell: Tuple[int, int] = (0, 0)
+
+    @property
+    def error_radius_m(self) -> float:
+        # frames of one flight share pose bias, so don't let the fused radius collapse
+        return max(self.min_radius / 2.0, 1.0 / math.sqrt(self.weight))
+
+    def merge(self, lat: float, lon: float, radius: float, confidence: float, now: float):
+        w = 1.0 / (radius * radius)
+        total = self.weight + w
+        self.lat = (self.lat * self.weight + lat * w) / total
+        self.lon = (self.lon * self.weight + lon * w) / total
+        self.weight = total
+        self.min_radius = min(self.min_radius, radius)
+        self.confidence = max(self.confidence, confidence)
+        self.observations += 1
+        self.last_seen = now
+
+    def geolocation(self) -> Dict[str, Any]:
+        return {"lat": self.lat, "lon": self.lon, "confidence": round(self.confidence, 4),
+                "error_radius_m": round(self.error_radius_m, 1), "method": self.method,
+                "observations": self.observations}
+
+
+class _Session:
+    MAX_FRAMES = 4096  # frame keys remembered for redelivery
+
+    def __init__(self, lat0: float):
+        self.cell_lon_scale = max(0.01, math.cos(math.radians(lat0)))
+        self.objects: Dict[str, TrackedObject] = {}
+        self.grid: Dict[Tuple[int, int], Set[str]] = {}
+        self.max_radius = 0.0
+        self.last_seen = 0.0
+        self.lock = threading.Lock()
+        # frame_key -> per detection (object_id, status) | None, as first returned
+        self.frames: "OrderedDict[str, List[Optional[Tuple[str, str]]]]" = OrderedDict()
+
+
+class ObjectTracker:
+    def __init__(self, cell_m: float = 25.0, ttl_s: float = 900.0, max_radius_m: float = 100.0,
+                 update_gain: float = 0.2, update_move_m: float = 3.0):
+        self.cell_m = cell_m
+        self.ttl_s = ttl_s
+        self.max_radius_m = max_radius_m      # detections less precise than this aren't tracked
+        self.update_gain = update_gain        # relative radius shrink that counts as an update
+        self.update_move_m = update_move_m    # position shift that counts as an update
+        self._sessions: Dict[str, _Session] = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._next_sweep = 0.0
+
+    # --- grid ---
+    def _cell(self, session: _Session, lat: float, lon: float) -> Tuple[int, int]:
+        return (int(math.floor(lat * M_PER_DEG / self.cell_m)),
+                int(math.floor(lon * M_PER_DEG * session.cell_lon_scale / self.cell_m)))
+
+    def _nearby(self, session: _Session, lat: float, lon: float, reach_m: float) -> Set[str]:
+        ci, cj = self._cell(session, lat, lon)
+        r = int(math.ceil(reach_m / self.cell_m))
+        found: Set[str] = set()
+        for i in range(ci - r, ci + r + 1):
+            for j in range(cj - r, cj + r + 1):
+                found.update(session.grid.get((i, j), ()))
+        return found
+
+    def _place(self, session: _Session, obj: TrackedObject):
+        cell = self._cell(session, obj.lat, obj.lon)
+        if cell != obj.cell or obj.object_id not in session.grid.get(cell, ()):
+            ids = session.grid.get(obj.cell)
+            if ids is not None:
+                ids.discard(obj.object_id)
+                if not ids:
+                    del session.grid[obj.cell]
+            session.grid.setdefault(cell, set()).add(obj.object_id)
+            obj.cell = cell
+
+    def _distance_m(self, lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+        dy = (lat2 - lat1) * M_PER_DEG
+        dx = (lon2 - lon1) * M_PER_DEG * math.cos(math.radians((lat1 + lat2) / 2.0))
+        return math.hypot(dx, dy)
+
+    # --- public ---
+    def observe(self, session_id: str, observations: List[Optional[Observation]],
+                methods: Optional[List[Optional[str]]] = None, now: Optional[float] = None,
+                frame_key: Optional[str] = None) -> List[Optional[Tuple[TrackedObject, str]]]:
+        """
+        Match one frame's detections against the session's objects. Entries that are
+        None or less precise than max_radius_m are not tracked (result None). Within a
+        frame every object is matched at most once: distinct detections of one image
+        are distinct objects. A repeated frame_key gets its first answer again (objects
+        evicted since then come back untracked).
+        """
+        now = time.time() if now is None else now
+        self._maybe_sweep(now)
+        out: List[Optional[Tuple[TrackedObject, str]]] = [None] * len(observations)
+        tracked = [i for i, o in enumerate(observations) if o is not None and o[3] <= self.max_radius_m]
+        if not tracked:
+            return out
+        session = self._session(session_id, observations[tracked[0]][1], now)
+        with session.lock:
+            if frame_key is not None and frame_key in session.frames:
+                previous = session.frames[frame_key]
+                if len(previous) == len(observations):
+                    for i, entry in enumerate(previous):
+                        obj = session.objects.get(entry[0]) if entry else None
+                        out[i] = (obj, entry[1]) if obj is not None else None
+                    return out
+            # candidate pairs (distance, detection, object), greedily matched nearest first
+            pairs = []
+            for i in tracked:
+                label, lat, lon, radius, _ = observations[i]
+                for oid in self._nearby(session, lat, lon, radius + session.max_radius):
+                    obj = session.objects[oid]
+                    if obj.label != label:
+                        continue
+                    dist = self._distance_m(lat, lon, obj.lat, obj.lon)
+                    if dist <= max(radius, obj.error_radius_m):
+                        pairs.append((dist, i, oid))
+            pairs.sort()
+            used_det: Set[int] = set()
+            used_obj: Set[str] = set()
+            for dist, i, oid in pairs:
+                if i in used_det or oid in used_obj:
+                    continue
+                used_det.add(i)
+                used_obj.add(oid)
+                obj = session.objects[oid]
+                label, lat, lon, radius, confidence = observations[i]
+                before_lat, before_lon, before_radius = obj.lat, obj.lon, obj.error_radius_m
+                obj.merge(lat, lon, radius, confidence, now)
+                self._place(session, obj)
+                moved = self._distance_m(before_lat, before_lon, obj.lat, obj.lon)
+                improved = obj.error_radius_m <= before_radius * (1.0 - self.update_gain)
+                out[i] = (obj, "updated" if improved or moved >= self.update_move_m else "unchanged")
+            for i in tracked:
+                if i in used_det:
+                    continue
+                label, lat, lon, radius, confidence = observations[i]
+                obj = TrackedObject(f"{session_id}-{next(self._ids)}", label, lat, lon, max(radius, 0.5),
+                                    confidence, methods[i] if methods else None, now)
+                session.objects[obj.object_id] = obj
+                obj.cell = self._cell(session, lat, lon)
+                session.grid.setdefault(obj.cell, set()).add(obj.object_id)
+                session.max_radius = max(session.max_radius, radius)
+                out[i] = (obj, "new")
+            if frame_key is not None:
+                session.frames[frame_key] = [(o.object_id, status) if o is not None else None
+                                             for o, status in (entry or (None, None) for entry in out)]
+                while len(session.frames) > session.MAX_FRAMES:
+                    session.frames.popitem(last=False)
+        return out
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {"sessions": len(sessions), "objects": sum(len(s.objects) for s in sessions)}
+
+    # --- eviction ---
+    def _session(self, session_id: str, lat0: float, now: float) -> _Session:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session(lat0)
+            session.last_seen = now  # under the tracker lock, so a sweep can't drop it meanwhile
+            return session
+
+    def _maybe_sweep(self, now: float):
+        with self._lock:
+            if now < self._next_sweep:
+                return
+            self._next_sweep = now + max(1.0, self.ttl_s / 10.0)
+            sessions = list(self._sessions.items())
+        cutoff = now - self.ttl_s
+        for session_id, session in sessions:
+            with session.lock:
+                for oid in [oid for oid, o in session.objects.items() if o.last_seen < cutoff]:
+                    obj = session.objects.pop(oid)
+                    ids = session.grid.get(obj.cell)
+                    if ids is not None:
+                        ids.discard(oid)
+                        if not ids:
+                            del session.grid[obj.cell]
+                if session.objects:
+                    session.max_radius = max(o.error_radius_m for o in session.objects.values())
+                empty = not session.objects
+            if empty:
+                with self._lock:
+                    if self._sessions.get(session_id) is session and session.last_seen < cutoff:
+                        del self._sessions[session_id]
@@ -0,0 +1,170 @@
+"""
+Batched in-process OCR.
+
+pytesseract starts a new tesseract process for every call and reloads the
+traineddata each time. With tesserocr installed we instead keep one PyTessBaseAPI
+per worker thread (models loaded once, GIL released while recognizing) and OCR all
+crops of an image on a thread pool. Without tesserocr the same pool runs pytesseract,
+which still parallelizes the subprocesses.
+
+Crops that can't hold readable text (too small, too flat) are skipped before OCR.
+
+    engine = get_ocr_engine()
+    results = engine.run_batch(image, bboxes)   # [{'text', 'ms', 'skipped'}, ...]
+
+tesserocr is in requirements*.txt; it builds against libtesseract/libleptonica, which
+both Dockerfiles install together with tesseract-ocr and the rus/eng traineddata. Outside
+the images it stays optional. Backends are imported when the engine is created, not at
+module import.
+"""
+
+import os
+import time
+import logging
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from metrics import STAGE_LATENCY, OCR_CROPS
+
+logger = logging.getLogger("ocr_engine")
+
+OCR_BACKEND = os.getenv("OCR_BACKEND", "auto")  # auto | tesserocr | pytesseract | none
+OCR_LANG = os.getenv("OCR_LANG", "rus+eng")
+OCR_THREADS = int(os.getenv("OCR_THREADS", str(min(4, os.cpu_count() or 1))))
+OCR_MIN_SIZE = int(os.getenv("OCR_MIN_SIZE", "16"))  # px, both sides
+OCR_MIN_CONTRAST = float(os.getenv("OCR_MIN_CONTRAST", "12"))  # grayscale std dev, 0..127
+
+
+def crop_has_text_potential(crop: Image.Image, min_size: int = OCR_MIN_SIZE,
+                            min_contrast: float = OCR_MIN_CONTRAST) -> Tuple[bool, Optional[str]]:
+    """Cheap pre-check; returns (ok, skip_reason)."""
+    w, h = crop.size
+    if w < min_size or h < min_size:
+        return False, "too_small"
+    # contrast on a small grayscale copy, the crop itself may be large
+    gray = crop.convert("L")
+    if max(w, h) > 128:
+        gray.thumbnail((128, 128))
+    if float(np.asarray(gray, dtype=np.float32).std()) < min_contrast:
+        return False, "low_contrast"
+    return True, None
+
+
+def _import_backend(name: str):
+    """(backend, module) for the requested backend, (None, None) if unavailable."""
+    candidates = ("tesserocr", "pytesseract") if name == "auto" else (name,)
+    for candidate in candidates:
+        if candidate in ("tesserocr", "pytesseract"):
+            try:
+                return candidate, importlib.import_module(candidate)
+            except Exception:
+                pass
+    return None, None
+
+
+class OCREngine:
+    def __init__(self, lang: str = OCR_LANG, threads: int = OCR_THREADS, backend: str = OCR_BACKEND):
+        self.lang = lang
+        self.threads = max(1, threads)
+        self.backend, self._module = _import_backend(backend)
+        self._local = threading.local()
+        self._apis = []
+        self._apis_lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return self.backend is not None
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="ocr")
+        return self._pool
+
+    def _api(self):
+        """Persistent tesseract handle of the current thread."""
+        api = getattr(self._local, "api", None)
+        if api is None:
+            api = self._module.PyTessBaseAPI(lang=self.lang)
+            self._local.api = api
+            with self._apis_lock:
+                self._apis.append(api)
+        return api
+
+    def recognize(self, crop: Image.Image) -> Optional[str]:
+        if self.backend == "tesserocr":
+            api = self._api()
+            api.SetImage(crop)
+            txt = api.GetUTF8Text()
+        elif self.backend == "pytesseract":
+            txt = self._module.image_to_string(crop, lang=self.lang)
+        else:
+            return None
+        txt = txt.strip()
+        return txt if txt else None
+
+    def _run_one(self, image: Image.Image, bbox: Optional[Sequence[int]]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        if bbox:
+            x, y, w, h = map(int, bbox)
+            crop = image.crop((x, y, x + w, y + h))
+        else:
+            crop = image
+        ok, reason = crop_has_text_potential(crop)
+        if not ok:
+            OCR_CROPS.labels("skipped").inc()
+            return {"text": None, "ms": (time.perf_counter() - start) * 1000.0, "skipped": reason}
+        try:
+            text = self.recognize(crop)
+        except Exception:
+            logger.exception("OCR failed for bbox %s", bbox)
+            text = None
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.labels("ocr").observe(elapsed)
+        OCR_CROPS.labels("text" if text else "empty").inc()
+        return {"text": text, "ms": elapsed * 1000.0, "skipped": None}
+
+    def run_batch(self, image: Image.Image, bboxes: Sequence[Optional[Sequence[int]]]) -> List[Dict[str, Any]]:
+        """OCR all crops of one image in parallel; results in bbox order."""
+        return self.run_many([(image, bboxes)])[0]
+
+    def run_many(self, jobs: Sequence[Tuple[Image.Image, Sequence[Optional[Sequence[int]]]]]) -> List[List[Dict[str, Any]]]:
+        """OCR crops of several images in one pass over the pool."""
+        if not self.available:
+            return [[{"text": None, "ms": 0.0, "skipped": "unavailable"} for _ in bboxes] for _, bboxes in jobs]
+        futures = [[self._executor().submit(self._run_one, image, bbox) for bbox in bboxes] for image, bboxes in jobs]
+        return [[f.result() for f in row] for row in futures]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        with self._apis_lock:
+            for api in self._apis:
+                try:
+                    api.End()
+                except Exception:
+                    pass
+            self._apis = []
+
+
+_engine: Optional[OCREngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_ocr_engine() -> OCREngine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = OCREngine()
+                logger.info("OCR engine: %s (%d threads)", _engine.backend, _engine.threads)
+    return _engine
@@ -0,0 +1,217 @@
+"""
+Offline reverse geocoder over a local gazetteer.
+
+The index is a uniform lat/lon grid in CSR layout, stored as plain .npy files in a
+directory and opened with mmap, so loading is instant and pages are shared between
+worker processes:
+    meta.json         grid parameters
+    coords.npy        float64 (N, 2) lat/lon, sorted by grid cell
+    cell_start.npy    int64 (n_cells + 1) offsets of each cell into coords
+    addr_offsets.npy  int64 (N + 1) offsets into addr_data
+    addr_data.npy     uint8 utf-8 encoded addresses, concatenated
+
+Build from a CSV extract (columns lat, lon, address; or wkt + address where wkt is
+a POINT/POLYGON - polygons are indexed by their vertex centroid):
+    python offline_geocoder.py build addresses.csv /data/geocoder_index [--cell-deg 0.005]
+
+Query:
+    python offline_geocoder.py query /data/geocoder_index 55.7520 37.6175
+"""
+
+import os
+import re
+import csv
+import sys
+import json
+import math
+import logging
+import argparse
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("offline_geocoder")
+
+EARTH_R = 6378137.0
+_NUM_RE = re.compile(r"-?\d+(?:\.\d+)?(?:[eE]-?\d+)?")
+
+
+def _wkt_centroid(wkt: str) -> Optional[Tuple[float, float]]:
+    """Centroid of all vertices of a POINT/POLYGON/MULTIPOLYGON WKT (x=lon, y=lat)."""
+    nums = [float(n) for n in _NUM_RE.findall(wkt)]
+    if len(nums) < 2:
+        return None
+    xs = nums[0::2]
+    ys = nums[1::2]
+    n = min(len(xs), len(ys))
+    return sum(ys[:n]) / n, sum(xs[:n]) / n
+
+
+def read_gazetteer_csv(path: str) -> Iterator[Tuple[float, float, str]]:
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            address = (row.get("address") or row.get("display_name") or "").strip()
+            if not address:
+                continue
+            try:
+                if row.get("lat") and row.get("lon"):
+                    lat, lon = float(row["lat"]), float(row["lon"])
+                elif row.get("wkt"):
+                    latlon = _wkt_centroid(row["wkt"])
+                    if latlon is None:
+                        continue
+                    lat, lon = latlon
+                else:
+                    continue
+            except ValueError:
+                continue
+            yield lat, lon, address
+
+
+def build_index(points: Iterator[Tuple[float, float, str]], out_dir: str, cell_deg: float = 0.005) -> Dict[str, Any]:
+    lats: List[float] = []
+    lons: List[float] = []
+    addresses: List[bytes] = []
+    for lat, lon, address in points:
+        lats.append(lat)
+        lons.append(lon)
+        addresses.append(address.encode("utf-8"))
+    if not lats:
+        raise ValueError("Gazetteer is empty")
+
+    coords = np.column_stack([np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)])
+    lat0 = float(np.floor(coords[:, 0].min() / cell_deg) * cell_deg)
+    lon0 = float(np.floor(coords[:, 1].min() / cell_deg) * cell_deg)
+    n_lat = int((coords[:, 0].max() - lat0) // cell_deg) + 1
+    n_lon = int((coords[:, 1].max() - lon0) // cell_deg) + 1
+
+    cell_ids = _cell_ids(coords[:, 0], coords[:, 1], lat0, lon0, cell_deg, n_lat, n_lon)
+    order = np.argsort(cell_ids, kind="stable")
+    cell_ids = cell_ids[order]
+    coords = coords[order]
+    cell_start = np.searchsorted(cell_ids, np.arange(n_lat * n_lon + 1)).astype(np.int64)
+
+    sorted_addr = [addresses[i] for i in order]
+    lengths = np.fromiter((len(a) for a in sorted_addr), dtype=np.int64, count=len(sorted_addr))
+    addr_offsets = np.zeros(len(sorted_addr) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=addr_offsets[1:])
+    addr_data = np.frombuffer(b"".join(sorted_addr), dtype=np.uint8)
+
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, "coords.npy"), coords)
+    np.save(os.path.join(out_dir, "cell_start.npy"), cell_start)
+    np.save(os.path.join(out_dir, "addr_offsets.npy"), addr_offsets)
+    np.save(os.path.join(out_dir, "addr_data.npy"), addr_data)
+    meta = {"version": 1, "lat0": lat0, "lon0": lon0, "cell_deg": cell_deg,
+            "n_lat": n_lat, "n_lon": n_lon, "count": int(len(coords))}
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return meta
+
+
+def _cell_ids(lat, lon, lat0, lon0, cell_deg, n_lat, n_lon):
+    i = np.clip(((lat - lat0) // cell_deg).astype(np.int64), 0, n_lat - 1)
+    j = np.clip(((lon - lon0) // cell_deg).astype(np.int64), 0, n_lon - 1)
+    return i * n_lon + j
+
+
+class OfflineGeocoder:
+    def __init__(self, index_dir: str, max_distance_m: float = 250.0):
+        with open(os.path.join(index_dir, "meta.json")) as f:
+            meta = json.load(f)
+        self.lat0 = meta["lat0"]
+        self.lon0 = meta["lon0"]
+        self.cell_deg = meta["cell_deg"]
+        self.n_lat = meta["n_lat"]
+        self.n_lon = meta["n_lon"]
+        self.max_distance_m = max_distance_m
+        self.coords = np.load(os.path.join(index_dir, "coords.npy"), mmap_mode="r")
+        self.cell_start = np.load(os.path.join(index_dir, "cell_start.npy"), mmap_mode="r")
+        self.addr_offsets = np.load(os.path.join(index_dir, "addr_offsets.npy"), mmap_mode="r")
+        self.addr_data = np.load(os.path.join(index_dir, "addr_data.npy"), mmap_mode="r")
+        logger.info('Offline geocoder loaded %s (%d addresses)', index_dir, meta["count"])
+
+    def _address(self, idx: int) -> str:
+        a, b = int(self.addr_offsets[idx]), int(self.addr_offsets[idx + 1])
+        return bytes(self.addr_data[a:b]).decode("utf-8")
+
+    def _ring_cells(self, ci: int, cj: int, r: int) -> Iterator[int]:
+        for i in range(ci - r, ci + r + 1):
+            if i < 0 or i >= self.n_lat:
+                continue
+            if abs(i - ci) == r:
+                js = range(cj - r, cj + r + 1)
+            else:
+                js = (cj - r, cj + r)
+            for j in js:
+                if 0 <= j < self.n_lon:
+                    yield i * self.n_lon + j
+
+    def nearest(self, lat: float, lon: float) -> Optional[Tuple[int, float]]:
+        """Index and distance (m) of the nearest address within max_distance_m."""
+        ci = int((lat - self.lat0) // self.cell_deg)
+        cj = int((lon - self.lon0) // self.cell_deg)
+        m_per_deg_lat = EARTH_R * math.pi / 180.0
+        m_per_deg_lon = m_per_deg_lat * max(1e-6, math.cos(math.radians(lat)))
+        cell_m = self.cell_deg * min(m_per_deg_lat, m_per_deg_lon)
+        max_ring = int(self.max_distance_m // cell_m) + 1
+
+        best_idx, best_d = -1, float("inf")
+        for r in range(max_ring + 1):
+            # every point in ring r is at least (r - 1) cells away
+            if best_idx >= 0 and (r - 1) * cell_m > best_d:
+                break
+            for cell in self._ring_cells(ci, cj, r):
+                a, b = int(self.cell_start[cell]), int(self.cell_start[cell + 1])
+                if a == b:
+                    continue
+                pts = self.coords[a:b]
+                dy = (pts[:, 0] - lat) * m_per_deg_lat
+                dx = (pts[:, 1] - lon) * m_per_deg_lon
+                d2 = dx * dx + dy * dy
+                k = int(np.argmin(d2))
+                d = math.sqrt(float(d2[k]))
+                if d < best_d:
+                    best_idx, best_d = a + k, d
+        if best_idx < 0 or best_d > self.max_distance_m:
+            return None
+        return best_idx, best_d
+
+    def reverse(self, lat: float, lon: float) -> Optional[Dict[str, Any]]:
+        """Same shape as the online reverse_geocode() result."""
+        hit = self.nearest(lat, lon)
+        if hit is None:
+            return None
+        idx, dist = hit
+        address = self._address(idx)
+        plat, plon = self.coords[idx]
+        return {"address": address,
+                "raw": {"display_name": address, "lat": float(plat), "lon": float(plon),
+                        "distance_m": dist, "source": "offline"}}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Offline reverse geocoder index tool")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="build index from a CSV gazetteer extract")
+    b.add_argument("csv_path")
+    b.add_argument("out_dir")
+    b.add_argument("--cell-deg", type=float, default=0.005)
+    q = sub.add_parser("query", help="look up nearest address")
+    q.add_argument("index_dir")
+    q.add_argument("lat", type=float)
+    q.add_argument("lon", type=float)
+    q.add_argument("--max-distance-m", type=float, default=250.0)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "build":
+        meta = build_index(read_gazetteer_csv(args.csv_path), args.out_dir, args.cell_deg)
+        print(json.dumps(meta, indent=2))
+    else:
+        geocoder = OfflineGeocoder(args.index_dir, args.max_distance_m)
+        print(json.dumps(geocoder.reverse(args.lat, args.lon), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
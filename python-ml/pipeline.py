@@ -0,0 +1,237 @@
+"""
+Staged worker pipeline with bounded queues and offset tracking.
+
+Each Kafka record travels through a list of stages (fetch -> detect -> enrich -> emit).
+Every stage has its own thread pool and a bounded input queue, so S3 downloads,
+inference and geocoding overlap instead of waiting on each other.
+
+A stage function takes the task payload and returns it (possibly updated) for the
+next stage, or None when the task is finished early (e.g. download failed, already
+logged). When a task leaves the pipeline for any reason its offset is marked done in
+the OffsetTracker; the consumer thread commits only contiguous completed offsets.
+
+The last stage may return a concurrent.futures.Future (e.g. pending Kafka deliveries):
+the offset is then marked done when it resolves, or failed when it raises. A failed
+offset holds back commits of its partition until the consumer rewinds to it: the
+consumer pauses partitions with failures (failed_partitions()), and once their
+in-flight work is settled rewind_points() tells it where to seek.
+"""
+
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, Any, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("pipeline")
+
+StageFn = Callable[[Any], Optional[Any]]
+
+_STOP = object()
+
+
+class OffsetTracker:
+    """
+    Tracks in-flight offsets per partition. Offsets must be added in increasing order
+    per partition (as returned by poll); they may be completed in any order.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending: Dict[Any, deque] = {}
+        self._done: Dict[Any, set] = {}
+        self._failed: Dict[Any, set] = {}
+        self._commit: Dict[Any, int] = {}
+        self._committed: Dict[Any, int] = {}
+        self._in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def add(self, tp, offset: int):
+        with self._cond:
+            self._pending.setdefault(tp, deque()).append(offset)
+            self._done.setdefault(tp, set())
+            self._failed.setdefault(tp, set())
+            self._in_flight += 1
+
+    def mark_done(self, tp, offset: int):
+        with self._cond:
+            pending = self._pending.get(tp)
+            if pending is None:
+                return
+            done = self._done[tp]
+            done.add(offset)
+            while pending and pending[0] in done:
+                off = pending.popleft()
+                done.discard(off)
+                self._commit[tp] = off + 1
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def mark_failed(self, tp, offset: int):
+        """Result was not delivered: never commit past this offset."""
+        with self._cond:
+            if tp not in self._pending:
+                return
+            self._failed[tp].add(offset)
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def failed_partitions(self) -> set:
+        with self._cond:
+            return {tp for tp, failed in self._failed.items() if failed}
+
+    def rewind_points(self) -> Dict[Any, int]:
+        """
+        Partitions with failed offsets and nothing else in flight -> lowest failed offset.
+        State of returned partitions is reset; the caller is expected to seek there.
+        """
+        with self._cond:
+            out = {}
+            for tp, failed in self._failed.items():
+                if not failed:
+                    continue
+                if len(self._pending[tp]) - len(self._done[tp]) - len(failed) > 0:
+                    continue
+                out[tp] = min(failed)
+            for tp in out:
+                self._pending[tp].clear()
+                self._done[tp].clear()
+                self._failed[tp].clear()
+            return out
+
+    def committable(self) -> Dict[Any, int]:
+        """Next offsets to commit (only partitions that advanced since last call)."""
+        with self._cond:
+            out = {tp: off for tp, off in self._commit.items() if self._committed.get(tp) != off}
+            self._committed.update(out)
+            return out
+
+    def forget(self, tps: Iterable):
+        with self._cond:
+            for tp in tps:
+                pending = self._pending.pop(tp, None)
+                done = self._done.pop(tp, set())
+                failed = self._failed.pop(tp, set())
+                self._commit.pop(tp, None)
+                self._committed.pop(tp, None)
+                if pending:
+                    self._in_flight -= len(pending) - len(done) - len(failed)
+            self._cond.notify_all()
+
+    def wait_idle(self, tps: Optional[Iterable] = None, timeout: Optional[float] = None) -> bool:
+        """Block until nothing is in flight (optionally only for given partitions)."""
+        tps = list(tps) if tps is not None else None
+
+        def _idle():
+            if tps is None:
+                return self._in_flight == 0
+            return all(len(self._pending.get(tp, ())) == len(self._done.get(tp, ())) + len(self._failed.get(tp, ()))
+                       for tp in tps)
+
+        with self._cond:
+            return self._cond.wait_for(_idle, timeout)
+
+
+class Stage:
+    def __init__(self, name: str, fn: StageFn, workers: int, queue_size: int):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.queue: "queue.Queue" = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.threads: List[threading.Thread] = []
+
+
+class Pipeline:
+    def __init__(self, stages: List[Tuple[str, StageFn, int]], queue_size: int = 16,
+                 tracker: Optional[OffsetTracker] = None):
+        self.stages = [Stage(name, fn, workers, queue_size) for name, fn, workers in stages]
+        self.tracker = tracker or OffsetTracker()
+
+    @property
+    def in_flight(self) -> int:
+        return self.tracker.in_flight
+
+    def start(self):
+        for idx, stage in enumerate(self.stages):
+            for i in range(stage.workers):
+                t = threading.Thread(target=self._worker, args=(idx,),
+                                     name=f'{stage.name}-{i}', daemon=True)
+                t.start()
+                stage.threads.append(t)
+        logger.info('Pipeline started: %s',
+                    ', '.join(f'{s.name}x{s.workers}' for s in self.stages))
+
+    def submit(self, tp, offset: int, payload: Any):
+        """Register the record offset and enqueue it to the first stage (blocks when full)."""
+        self.tracker.add(tp, offset)
+        self.enqueue(tp, offset, payload)
+
+    def enqueue(self, tp, offset: int, payload: Any):
+        """Enqueue an offset already registered with tracker.add() (e.g. held back by a scheduler)."""
+        self.stages[0].queue.put((tp, offset, payload))
+
+    def has_capacity(self) -> bool:
+        return not self.stages[0].queue.full()
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        return self.tracker.wait_idle(timeout=timeout)
+
+    def stop(self, timeout: Optional[float] = None) -> bool:
+        """Stop the stage threads, waiting at most `timeout` seconds in total.
+
+        Returns False when some thread is still busy at the deadline; those are daemon
+        threads and are left behind (their offsets were never committed).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining() -> Optional[float]:
+            return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+        stopped = True
+        for stage in self.stages:
+            try:
+                for _ in stage.threads:
+                    stage.queue.put(_STOP, timeout=remaining())
+            except queue.Full:
+                stopped = False
+            for t in stage.threads:
+                t.join(remaining())
+                if t.is_alive():
+                    stopped = False
+            stage.threads = [t for t in stage.threads if t.is_alive()]
+        if not stopped:
+            logger.warning('Pipeline stop timed out; abandoning %s',
+                           ', '.join(t.name for s in self.stages for t in s.threads) or 'blocked stages')
+        return stopped
+
+    def _worker(self, idx: int):
+        stage = self.stages[idx]
+        next_stage = self.stages[idx + 1] if idx + 1 < len(self.stages) else None
+        while True:
+            item = stage.queue.get()
+            if item is _STOP:
+                break
+            tp, offset, payload = item
+            try:
+                result = stage.fn(payload)
+            except Exception:
+                logger.exception('Stage %s failed for %s@%s', stage.name, tp, offset)
+                result = None
+            if next_stage is None and isinstance(result, Future):
+                result.add_done_callback(lambda f, tp=tp, offset=offset: self._settle(tp, offset, f))
+            elif result is None or next_stage is None:
+                self.tracker.mark_done(tp, offset)
+            else:
+                next_stage.queue.put((tp, offset, result))
+
+    def _settle(self, tp, offset: int, fut: Future):
+        if fut.exception() is not None:
+            logger.error('Delivery failed for %s@%s: %s', tp, offset, fut.exception())
+            self.tracker.mark_failed(tp, offset)
+        else:
+            self.tracker.mark_done(tp, offset)
@@ -0,0 +1,105 @@
+"""
+Content-addressed cache of process_image_bytes results.
+
+The same photo is often sent again (re-uploads, retries from the Laravel side), so
+results are cached by a fast hash of the image bytes plus a fingerprint of the task
+metadata and the model/config version:
+
+    key = blake2b(image_bytes) + ':' + blake2b(metadata + model fingerprint)
+
+Tiers: local LRU (per process) and an optional shared Redis tier with TTL.
+Values are stored as JSON, so hits hand out fresh objects.
+"""
+
+import json
+import hashlib
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+from geocode_cache import LRUCache
+from metrics import RESULT_CACHE
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+logger = logging.getLogger("result_cache")
+
+KEY_PREFIX = "ml:result:"
+
+
+def content_hash(image_bytes: bytes) -> str:
+    # blake2b is faster than sha256 on 64-bit CPUs and in the stdlib
+    return hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, fingerprint: str, max_entries: int = 2048, redis_url: Optional[str] = None,
+                 ttl_s: int = 7 * 24 * 3600):
+        self.fingerprint = fingerprint
+        self.ttl_s = ttl_s
+        self.local = LRUCache(max_entries) if max_entries > 0 else None
+        self.redis = None
+        if redis_url:
+            if redis is None:
+                logger.warning('RESULT_CACHE_REDIS_URL set but redis package not installed')
+            else:
+                try:
+                    self.redis = redis.Redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+                except Exception:
+                    logger.exception('Failed to connect result cache to %s', redis_url)
+        self._lock = threading.Lock()
+        self.counters = {"local_hits": 0, "redis_hits": 0, "misses": 0}
+
+    def key(self, image_bytes: bytes, metadata: Optional[Dict[str, Any]] = None) -> str:
+        meta = json.dumps(metadata or {}, sort_keys=True, default=str)
+        fp = hashlib.blake2b(f'{self.fingerprint}|{meta}'.encode('utf-8'), digest_size=8).hexdigest()
+        return f'{content_hash(image_bytes)}:{fp}'
+
+    def _count(self, name: str, label: str):
+        with self._lock:
+            self.counters[name] += 1
+        RESULT_CACHE.labels(label).inc()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.local is not None:
+            raw = self.local.get(key)
+            if raw is not None:
+                self._count("local_hits", "hit_local")
+                return json.loads(raw)
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(KEY_PREFIX + key)
+            except Exception:
+                logger.warning('Result cache redis get failed', exc_info=True)
+                raw = None
+            if raw is not None:
+                if self.local is not None:
+                    self.local.put(key, raw)
+                self._count("redis_hits", "hit_redis")
+                return json.loads(raw)
+        self._count("misses", "miss")
+        return None
+
+    def put(self, key: str, result: Dict[str, Any]):
+        try:
+            raw = json.dumps(result, ensure_ascii=False)
+        except (TypeError, ValueError):
+            logger.warning('Result for %s is not JSON serializable; not cached', key)
+            return
+        if self.local is not None:
+            self.local.put(key, raw)
+        if self.redis is not None:
+            try:
+                self.redis.set(KEY_PREFIX + key, raw.encode('utf-8'), ex=self.ttl_s)
+            except Exception:
+                logger.warning('Result cache redis set failed', exc_info=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self.counters)
+        total = out["local_hits"] + out["redis_hits"] + out["misses"]
+        out["hit_ratio"] = (out["local_hits"] + out["redis_hits"]) / total if total else 0.0
+        return out
@@ -0,0 +1,184 @@
+"""
+Per-image result message sent to KAFKA_OUTPUT_TOPIC.
+
+One message per processed image (schema v2). Detections are rows of a fixed column
+list instead of one message per detection with the task metadata copied into each:
+
+    {
+      "v": 2,
+      "image_id": "42",
+      "worker": "host-1234",
+      "processed_at": "2025-01-01T12:00:00Z",
+      "degradation": "full",
+      "metadata": {...},                                # once per image
+      "geolocation": {"lat", "lon", "confidence", "error_radius_m", "method"} | null,
+      "detection_fields": ["label", "x", "y", "w", "h", "confidence", "lat", "lon",
+                           "geo_confidence", "error_radius_m", "method", "ocr_text", "address",
+                           "object_id", "track"],
+      "detections": [["building", 10, 20, 100, 80, 0.91, 55.75, 37.61, 0.8, 12.5, "ins_projection", null, "...",
+                      "flight-7-12", "new"], ...],
+      "suppressed": 14,                                 # only for tracked flights
+      "gate": {"action": "skip", "reasons": ["low_entropy"], "scores": {..}},  # only for gated frames
+      "frame": {"index": 120, "t": 4.0, "last": false}  # only for video keyframes
+    }
+
+For images of a tracked flight (metadata flight_id/session_id, see object_tracker.py)
+only new and updated objects are listed: "object_id" identifies the object across
+frames, "track" is new|updated, and "suppressed" counts detections of known objects
+that didn't change. Both columns are null for untracked images.
+
+Frames the pre-detection quality gate (quality_gate.py) skipped or degraded carry its
+verdict as "gate"; skipped frames have no detections.
+
+Video tasks send one message per keyframe with detections (at least one message
+per task); "frame" is the frame number, its time in seconds from the video start
+and whether it is the task's last message.
+
+"geolocation" is the best position for the whole image: the image-level estimate
+(EXIF/INS) if there is one, otherwise the most confident detection geolocation.
+
+With the PostGIS sink (POSTGIS_DSN, see postgis_sink.py) results are written to the
+database in bulk and the topic only carries one notification per task, sent after
+the write committed:
+
+    {"v": 2, "image_id": "42", "worker": .., "processed_at": .., "degradation": "full",
+     "geolocation": {..} | null, "detection_count": 3, "stored": "postgis"}
+
+Encoding (RESULT_ENCODING): json (default) or msgpack, announced by the
+'content-type' header (application/json, application/msgpack). RESULT_COMPRESSION=gzip
+additionally compresses bodies of at least RESULT_COMPRESSION_MIN_BYTES and sets
+'content-encoding: gzip'. Batches are compressed by the producer anyway
+(KAFKA_PRODUCER_COMPRESSION); payload compression is for consumers that store the
+raw body. 'schema-version' carries "v" as a header too.
+"""
+
+import os
+import gzip
+import json
+import time
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+try:
+    import msgpack
+except Exception:
+    msgpack = None
+
+logger = logging.getLogger("result_schema")
+
+SCHEMA_VERSION = 2
+DETECTION_FIELDS = ("label", "x", "y", "w", "h", "confidence", "lat", "lon",
+                    "geo_confidence", "error_radius_m", "method", "ocr_text", "address", "object_id", "track")
+GEOLOCATION_KEYS = ("lat", "lon", "confidence", "error_radius_m", "method")
+
+RESULT_ENCODING = os.getenv("RESULT_ENCODING", "json").lower()
+RESULT_COMPRESSION = os.getenv("RESULT_COMPRESSION", "").lower() or None
+RESULT_COMPRESSION_MIN_BYTES = int(os.getenv("RESULT_COMPRESSION_MIN_BYTES", "4096"))
+
+CONTENT_TYPES = {"json": b"application/json", "msgpack": b"application/msgpack"}
+
+
+def _round(value: Optional[float], digits: int) -> Optional[float]:
+    return None if value is None else round(float(value), digits)
+
+
+def _geolocation(geo: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not geo or geo.get("lat") is None or geo.get("lon") is None:
+        return None
+    return {k: geo.get(k) for k in GEOLOCATION_KEYS}
+
+
+def detection_row(det: Dict[str, Any]) -> List[Any]:
+    x, y, w, h = (int(round(v)) for v in det["bbox"])
+    geo = det.get("geolocation") or {}
+    return [
+        det.get("label"), x, y, w, h, _round(det.get("confidence"), 4),
+        _round(geo.get("lat"), 7), _round(geo.get("lon"), 7), _round(geo.get("confidence"), 4),
+        _round(geo.get("error_radius_m"), 1), geo.get("method"),
+        det.get("ocr_text"), det.get("address"), det.get("object_id"), det.get("track"),
+    ]
+
+
+def best_geolocation(ml_results: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    image_geo = _geolocation(ml_results.get("image_geolocation"))
+    if image_geo is not None:
+        return image_geo
+    geos = [_geolocation(d.get("geolocation")) for d in ml_results.get("detections", [])]
+    geos = [g for g in geos if g is not None]
+    return max(geos, key=lambda g: g.get("confidence") or 0.0) if geos else None
+
+
+def build_result(image_id: str, ml_results: Dict[str, Any], metadata: Dict[str, Any], worker: str,
+                 degradation: str = "full", frame: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    result = {
+        "v": SCHEMA_VERSION,
+        "image_id": image_id,
+        "worker": worker,
+        "processed_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "degradation": degradation,
+        "metadata": metadata,
+        "geolocation": best_geolocation(ml_results),
+        "detection_fields": list(DETECTION_FIELDS),
+        "detections": [detection_row(d) for d in ml_results.get("detections", [])],
+    }
+    if "suppressed" in ml_results:
+        result["suppressed"] = ml_results["suppressed"]
+    if "gate" in ml_results:
+        result["gate"] = ml_results["gate"]
+    if frame is not None:
+        result["frame"] = frame
+    return result
+
+
+def build_notification(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Slim message for a task whose results (one per image or keyframe) are stored by the sink."""
+    last = results[-1]
+    geos = [r["geolocation"] for r in results if r.get("geolocation")]
+    return {
+        "v": SCHEMA_VERSION,
+        "image_id": last["image_id"],
+        "worker": last["worker"],
+        "processed_at": last["processed_at"],
+        "degradation": last["degradation"],
+        "geolocation": geos[-1] if geos else None,
+        "detection_count": sum(len(r["detections"]) for r in results),
+        "stored": "postgis",
+    }
+
+
+def encode(result: Dict[str, Any], encoding: Optional[str] = None,
+           compression: Optional[str] = None) -> Tuple[bytes, List[Tuple[str, bytes]]]:
+    """Serialize a result; returns (body, kafka headers)."""
+    encoding = encoding or RESULT_ENCODING
+    compression = RESULT_COMPRESSION if compression is None else compression
+    if encoding == "msgpack" and msgpack is None:
+        logger.warning("RESULT_ENCODING=msgpack but msgpack is not installed; sending JSON")
+        encoding = "json"
+    if encoding == "msgpack":
+        body = msgpack.packb(result, use_bin_type=True, default=str)
+    else:
+        encoding = "json"
+        body = json.dumps(result, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    headers = [("content-type", CONTENT_TYPES[encoding]),
+               ("schema-version", str(result.get("v", SCHEMA_VERSION)).encode())]
+    if compression == "gzip" and len(body) >= RESULT_COMPRESSION_MIN_BYTES:
+        body = gzip.compress(body, compresslevel=5)
+        headers.append(("content-encoding", b"gzip"))
+    return body, headers
+
+
+def decode(body: bytes, headers: Optional[List[Tuple[str, bytes]]] = None) -> Dict[str, Any]:
+    """Inverse of encode() (tests, tooling, Python consumers)."""
+    meta = {k: v for k, v in (headers or [])}
+    if meta.get("content-encoding") == b"gzip":
+        body = gzip.decompress(body)
+    if meta.get("content-type") == CONTENT_TYPES["msgpack"]:
+        if msgpack is None:
+            raise RuntimeError("msgpack is not installed")
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body)
+
+
+def detections_as_dicts(result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    fields = result.get("detection_fields") or DETECTION_FIELDS
+    return [dict(zip(fields, row)) for row in result.get("detections", [])]
@@ -0,0 +1,357 @@
+"""
+Pooled, prefetching S3/MinIO fetcher with a local content cache.
+
+- one boto3 client with a sized connection pool shared by all threads
+- prefetch(urls): start downloading the next messages' objects in the background,
+  fetch(url) then picks up the running download instead of starting a new one;
+  downloads nobody picked up within max_age_s (or discard()ed: dropped tasks,
+  header-only reads, streams) are cancelled so they don't block further prefetching
+- bodies are read straight into a preallocated buffer of ContentLength bytes
+- bounded LRU cache (memory tier + optional disk tier) keyed by bucket/key/ETag;
+  a cached object is revalidated with a conditional GET (If-None-Match), so a hit
+  costs one round trip without a body transfer
+- fetch_range()/fetch_header() use Range GETs, e.g. to read only the EXIF header
+- open_stream(url) returns a seekable file object over Range GETs of fixed-size
+  blocks (bounded block LRU, next block read ahead), e.g. to demux a video without
+  downloading it whole or writing it to disk
+
+Urls are 's3://bucket/key' or a plain key in the default bucket. Without a client,
+local file paths are read instead (same as download_image()).
+"""
+
+import io
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger("s3_fetcher")
+
+_READ_CHUNK = 1024 * 1024
+
+
+def parse_s3_url(url: str, default_bucket: str) -> Tuple[str, str]:
+    if url.startswith('s3://'):
+        _, _, path = url.partition('s3://')
+        parts = path.split('/', 1)
+        return parts[0], parts[1] if len(parts) > 1 else ''
+    return default_bucket, url
+
+
+def make_s3_client(endpoint_url: str, access_key: str, secret_key: str, max_pool_connections: int = 32):
+    import boto3
+    from botocore.config import Config
+    config = Config(max_pool_connections=max_pool_connections, tcp_keepalive=True,
+                    retries={'max_attempts': 5, 'mode': 'adaptive'})
+    session = boto3.session.Session()
+    return session.client('s3', endpoint_url=endpoint_url, aws_access_key_id=access_key,
+                          aws_secret_access_key=secret_key, config=config)
+
+
+def read_body_into_buffer(body, length: Optional[int]) -> bytearray:
+    """Read a StreamingBody into one preallocated buffer (no chunk list + join)."""
+    if not length:
+        return bytearray(body.read())
+    buf = bytearray(length)
+    view = memoryview(buf)
+    raw = getattr(body, '_raw_stream', None)
+    pos = 0
+    while pos < length:
+        if raw is not None and hasattr(raw, 'readinto'):
+            n = raw.readinto(view[pos:pos + _READ_CHUNK])
+        else:
+            chunk = body.read(min(_READ_CHUNK, length - pos))
+            n = len(chunk)
+            view[pos:pos + n] = chunk
+        if not n:
+            raise IOError(f'Short read: {pos} of {length} bytes')
+        pos += n
+    return buf
+
+
+class ContentCache:
+    """Byte-bounded LRU in memory, optionally backed by a byte-bounded LRU directory."""
+
+    def __init__(self, memory_bytes: int = 256 * 1024 * 1024, disk_dir: Optional[str] = None,
+                 disk_bytes: int = 2 * 1024 * 1024 * 1024):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self._mem: "OrderedDict[str, bytes]" = OrderedDict()
+        self._mem_size = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            # rebuild the LRU index from what a previous run left, oldest first
+            entries = []
+            for name in os.listdir(disk_dir):
+                path = os.path.join(disk_dir, name)
+                if name.endswith('.tmp'):
+                    os.unlink(path)
+                    continue
+                st = os.stat(path)
+                entries.append((st.st_mtime, name, st.st_size))
+            for _, name, size in sorted(entries):
+                self._disk[name] = size
+                self._disk_size += size
+
+    @staticmethod
+    def key(bucket: str, key: str, etag: str) -> str:
+        return hashlib.sha1(f'{bucket}/{key}/{etag}'.encode('utf-8')).hexdigest()
+
+    def get(self, ckey: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._mem.get(ckey)
+            if data is not None:
+                self._mem.move_to_end(ckey)
+                return data
+            on_disk = ckey in self._disk
+            if on_disk:
+                self._disk.move_to_end(ckey)
+        if not on_disk:
+            return None
+        try:
+            path = os.path.join(self.disk_dir, ckey)
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        self._put_memory(ckey, data)
+        return data
+
+    def put(self, ckey: str, data: bytes):
+        self._put_memory(ckey, data)
+        if self.disk_dir and len(data) <= self.disk_bytes:
+            path = os.path.join(self.disk_dir, ckey)
+            tmp = f'{path}.{threading.get_ident()}.tmp'
+            try:
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            except OSError:
+                logger.exception('Failed to write cache file %s', path)
+                return
+            evict = []
+            with self._lock:
+                self._disk_size += len(data) - self._disk.pop(ckey, 0)
+                self._disk[ckey] = len(data)
+                while self._disk_size > self.disk_bytes and self._disk:
+                    old, size = self._disk.popitem(last=False)
+                    self._disk_size -= size
+                    evict.append(old)
+            for old in evict:
+                try:
+                    os.unlink(os.path.join(self.disk_dir, old))
+                except OSError:
+                    pass
+
+    def _put_memory(self, ckey: str, data: bytes):
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            old = self._mem.pop(ckey, None)
+            if old is not None:
+                self._mem_size -= len(old)
+            self._mem[ckey] = data
+            self._mem_size += len(data)
+            while self._mem_size > self.memory_bytes:
+                _, evicted = self._mem.popitem(last=False)
+                self._mem_size -= len(evicted)
+
+
+class S3Fetcher:
+    def __init__(self, client, default_bucket: str, cache: Optional[ContentCache] = None,
+                 prefetch_depth: int = 8, workers: int = 8, max_age_s: float = 60.0):
+        self.client = client
+        self.default_bucket = default_bucket
+        self.cache = cache
+        self.prefetch_depth = prefetch_depth
+        self.max_age_s = max_age_s
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='s3-fetch')
+        self._pending: Dict[str, Tuple[Future, float]] = {}
+        self._etags: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'cache_hits': 0, 'downloads': 0, 'prefetch_hits': 0, 'prefetch_dropped': 0, 'bytes': 0}
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    def prefetch(self, urls: Iterable[str]):
+        """Start background downloads, at most prefetch_depth outstanding."""
+        now = time.monotonic()
+        with self._lock:
+            for url in [u for u, (_, started) in self._pending.items() if now - started > self.max_age_s]:
+                self._drop(url)
+            for url in urls:
+                if not url or url in self._pending:
+                    continue
+                if len(self._pending) >= self.prefetch_depth:
+                    break
+                self._pending[url] = (self._pool.submit(self._download, url), now)
+
+    def discard(self, url: Optional[str]):
+        """Forget (and cancel if not started) a prefetch that fetch() won't pick up."""
+        with self._lock:
+            self._drop(url)
+
+    def _drop(self, url: Optional[str]):
+        entry = self._pending.pop(url, None)
+        if entry is not None:
+            entry[0].cancel()
+            self.counters['prefetch_dropped'] += 1
+
+    def fetch(self, url: str) -> bytes:
+        with self._lock:
+            entry = self._pending.pop(url, None)
+        if entry is not None and not entry[0].cancelled():
+            self._count('prefetch_hits')
+            return entry[0].result()
+        return self._download(url)
+
+    def _download(self, url: str) -> bytes:
+        if self.client is None:
+            if os.path.exists(url):
+                with open(url, 'rb') as f:
+                    return f.read()
+            raise RuntimeError(f'No S3 client and file not found: {url}')
+
+        bucket, key = parse_s3_url(url, self.default_bucket)
+        cached_etag = None
+        if self.cache is not None:
+            with self._lock:
+                cached_etag = self._etags.get((bucket, key))
+        kwargs = {}
+        if cached_etag:
+            kwargs['IfNoneMatch'] = cached_etag
+        try:
+            obj = self.client.get_object(Bucket=bucket, Key=key, **kwargs)
+        except Exception as e:
+            if cached_etag and _is_not_modified(e):
+                data = self.cache.get(ContentCache.key(bucket, key, cached_etag))
+                if data is not None:
+                    self._count('cache_hits')
+                    return data
+                # evicted meanwhile -> unconditional GET
+                obj = self.client.get_object(Bucket=bucket, Key=key)
+            else:
+                raise
+
+        logger.info('Downloading s3://%s/%s', bucket, key)
+        data = read_body_into_buffer(obj['Body'], obj.get('ContentLength'))
+        self._count('downloads')
+        self._count('bytes', len(data))
+        etag = obj.get('ETag')
+        if self.cache is not None and etag:
+            self.cache.put(ContentCache.key(bucket, key, etag), data)
+            with self._lock:
+                self._etags[(bucket, key)] = etag
+                self._etags.move_to_end((bucket, key))
+                while len(self._etags) > 100000:
+                    self._etags.popitem(last=False)
+        return data
+
+    def fetch_range(self, url: str, start: int, end: int) -> bytes:
+        """Bytes [start, end] inclusive via a Range GET."""
+        if self.client is None:
+            with open(url, 'rb') as f:
+                f.seek(start)
+                return f.read(end - start + 1)
+        bucket, key = parse_s3_url(url, self.default_bucket)
+        obj = self.client.get_object(Bucket=bucket, Key=key, Range=f'bytes={start}-{end}')
+        return read_body_into_buffer(obj['Body'], obj.get('ContentLength'))
+
+    def fetch_header(self, url: str, nbytes: int = 128 * 1024) -> bytes:
+        """First nbytes of the object - enough for JPEG EXIF/APP1 in practice."""
+        self.discard(url)
+        return self.fetch_range(url, 0, nbytes - 1)
+
+    def open_stream(self, url: str, block_size: int = 8 * 1024 * 1024, max_blocks: int = 4):
+        """Seekable binary file object over the object (a plain file without a client)."""
+        self.discard(url)
+        if self.client is None:
+            return open(url, 'rb')
+        bucket, key = parse_s3_url(url, self.default_bucket)
+        size = self.client.head_object(Bucket=bucket, Key=key)['ContentLength']
+        return io.BufferedReader(RangeReader(self, url, size, block_size, max_blocks), buffer_size=64 * 1024)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self.counters)
+            out['pending'] = len(self._pending)
+        return out
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class RangeReader(io.RawIOBase):
+    """Random access to an S3 object in blocks of block_size; keeps max_blocks in memory."""
+
+    def __init__(self, fetcher: S3Fetcher, url: str, size: int, block_size: int, max_blocks: int):
+        super().__init__()
+        self.fetcher = fetcher
+        self.url = url
+        self.size = size
+        self.block_size = block_size
+        self.max_blocks = max(2, max_blocks)
+        self._pos = 0
+        self._blocks: "OrderedDict[int, Future]" = OrderedDict()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def _block(self, index: int) -> Future:
+        fut = self._blocks.get(index)
+        if fut is None:
+            start = index * self.block_size
+            end = min(self.size, start + self.block_size) - 1
+            fut = self.fetcher._pool.submit(self.fetcher.fetch_range, self.url, start, end)
+            self.fetcher._count('bytes', end - start + 1)
+            self._blocks[index] = fut
+            while len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+        else:
+            self._blocks.move_to_end(index)
+        return fut
+
+    def readinto(self, buf) -> int:
+        if self._pos >= self.size:
+            return 0
+        index, offset = divmod(self._pos, self.block_size)
+        data = self._block(index).result()
+        if (index + 1) * self.block_size < self.size:
+            self._block(index + 1)  # read ahead: demuxers mostly read sequentially
+            self._blocks.move_to_end(index)
+        n = min(len(buf), len(data) - offset)
+        buf[:n] = data[offset:offset + n]
+        self._pos += n
+        return n
+
+
+def _is_not_modified(exc: Exception) -> bool:
+    response = getattr(exc, 'response', None) or {}
+    code = str(response.get('Error', {}).get('Code', ''))
+    status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return code in ('304', 'NotModified') or status == 304
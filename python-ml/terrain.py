@@ -0,0 +1,296 @@
+"""
+Terrain model for INS projection: elevation tiles + ray/terrain intersection.
+
+Tiles in DEM_DIR (searched recursively) are opened as memory-mapped arrays:
+    N55E037.hgt          SRTM1/SRTM3 (big-endian int16, 3601x3601 or 1201x1201, 1x1 degree)
+    name.npy + name.json  any grid in lat/lon, rows north -> south, samples on the bounds:
+                          {"west": .., "south": .., "east": .., "north": .., "nodata": -32768}
+A tile is decoded (float32 metres, nodata -> NaN) on first use and kept in an LRU
+cache bounded by DEM_CACHE_MB, so a flight over one area is served from resident
+tiles after the first image.
+
+Camera rays are intersected with the terrain for all detections of an image at once:
+fixed-step ray marching (vectorized over rays and steps) finds the first sample
+below the surface, then a few bisection steps refine the hit.
+
+GeoTIFFs (e.g. Copernicus DEM) are converted once (needs rasterio, EPSG:4326 input):
+    python terrain.py convert dem.tif /app/models/dem
+    python terrain.py elevation /app/models/dem 55.7520 37.6175
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import DEM_TILE_CACHE
+
+logger = logging.getLogger("terrain")
+
+EARTH_R = 6378137.0
+MIN_ELEVATION_M = -450.0  # no terrain below (Dead Sea shore): rays under it can stop marching
+_HGT_RE = re.compile(r"^([NS])(\d{2})([EW])(\d{3})\.hgt$", re.IGNORECASE)
+
+
+class Tile:
+    """One raster tile; samples lie on the bounds (pixel-is-point), rows go north -> south."""
+
+    def __init__(self, path: str, west: float, south: float, east: float, north: float,
+                 nodata: Optional[float] = None):
+        self.path = path
+        self.west, self.south, self.east, self.north = west, south, east, north
+        self.nodata = nodata
+
+    def open(self) -> np.ndarray:
+        if self.path.endswith(".npy"):
+            return np.load(self.path, mmap_mode="r")
+        side = int(round(math.sqrt(os.path.getsize(self.path) // 2)))
+        return np.memmap(self.path, dtype=">i2", mode="r", shape=(side, side))
+
+    def decode(self) -> np.ndarray:
+        raw = self.open()
+        grid = np.array(raw, dtype=np.float32)  # a copy even for float32 tiles: the map is read-only
+        if self.nodata is not None:
+            grid[raw == self.nodata] = np.nan
+        del raw
+        return grid
+
+
+def _scan(dem_dir: str) -> List[Tile]:
+    tiles = []
+    for dirpath, _, files in os.walk(dem_dir):
+        for name in sorted(files):
+            path = os.path.join(dirpath, name)
+            m = _HGT_RE.match(name)
+            if m:
+                lat = int(m.group(2)) * (1 if m.group(1).upper() == "N" else -1)
+                lon = int(m.group(4)) * (1 if m.group(3).upper() == "E" else -1)
+                tiles.append(Tile(path, lon, lat, lon + 1, lat + 1, nodata=-32768))
+            elif name.endswith(".npy") and os.path.exists(path[:-4] + ".json"):
+                with open(path[:-4] + ".json") as f:
+                    meta = json.load(f)
+                tiles.append(Tile(path, float(meta["west"]), float(meta["south"]), float(meta["east"]),
+                                  float(meta["north"]), meta.get("nodata")))
+    return tiles
+
+
+def enu_to_latlon(lat0: float, lon0: float, east_m: np.ndarray, north_m: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    lat = lat0 + np.degrees(north_m / EARTH_R)
+    lon = lon0 + np.degrees(east_m / (EARTH_R * math.cos(math.radians(lat0))))
+    return lat, lon
+
+
+class TerrainModel:
+    def __init__(self, dem_dir: str, cache_mb: float = 512.0):
+        self.dem_dir = dem_dir
+        self.tiles = _scan(dem_dir)
+        if not self.tiles:
+            raise RuntimeError(f"No DEM tiles (.hgt or .npy+.json) in {dem_dir}")
+        # 1x1 degree cell -> tiles overlapping it, so lookups only test nearby tiles
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+        for i, t in enumerate(self.tiles):
+            for la in range(math.floor(t.south), math.ceil(t.north)):
+                for lo in range(math.floor(t.west), math.ceil(t.east)):
+                    self._cells.setdefault((la, lo), []).append(i)
+        self.cache_bytes = int(cache_mb * 1024 * 1024)
+        self._cache: "OrderedDict[int, Tuple[np.ndarray, float]]" = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        logger.info("DEM %s: %d tiles, cache %.0f MB", dem_dir, len(self.tiles), cache_mb)
+
+    def fingerprint(self) -> str:
+        return f"dem:{len(self.tiles)}"
+
+    # --- tile cache ---
+    def _grid(self, i: int) -> Tuple[np.ndarray, float]:
+        """Decoded tile i and its max elevation, through the LRU cache."""
+        with self._lock:
+            entry = self._cache.get(i)
+            if entry is not None:
+                self._cache.move_to_end(i)
+                DEM_TILE_CACHE.labels("hit").inc()
+                return entry
+        DEM_TILE_CACHE.labels("miss").inc()
+        grid = self.tiles[i].decode()
+        entry = (grid, float(np.nanmax(grid)) if np.isfinite(grid).any() else MIN_ELEVATION_M)
+        with self._lock:
+            if i not in self._cache:
+                self._cache[i] = entry
+                self._cached_bytes += grid.nbytes
+                # the newest tile always stays, even if it alone exceeds the budget
+                while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+                    _, (old, _) = self._cache.popitem(last=False)
+                    self._cached_bytes -= old.nbytes
+                    DEM_TILE_CACHE.labels("evict").inc()
+            return self._cache[i]
+
+    def cache_info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"tiles": len(self._cache), "mb": round(self._cached_bytes / 1048576.0, 1)}
+
+    def _candidates(self, lat: np.ndarray, lon: np.ndarray) -> List[int]:
+        cells = set(zip(np.floor(lat).astype(np.int64).tolist(), np.floor(lon).astype(np.int64).tolist()))
+        found = set()
+        for cell in cells:
+            found.update(self._cells.get(cell, ()))
+        return sorted(found)
+
+    # --- lookups ---
+    def elevation(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        """Bilinear elevation (m) at arrays of lat/lon; NaN outside coverage or on voids."""
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        out = np.full(lat.shape, np.nan, dtype=np.float64)
+        flat_lat, flat_lon, flat_out = lat.ravel(), lon.ravel(), out.reshape(-1)
+        todo = np.isfinite(flat_lat) & np.isfinite(flat_lon)
+        for i in self._candidates(flat_lat[todo], flat_lon[todo]):
+            t = self.tiles[i]
+            inside = todo & (flat_lat >= t.south) & (flat_lat <= t.north) & (flat_lon >= t.west) & (flat_lon <= t.east)
+            if not inside.any():
+                continue
+            grid, _ = self._grid(i)
+            rows, cols = grid.shape
+            r = (t.north - flat_lat[inside]) / (t.north - t.south) * (rows - 1)
+            c = (flat_lon[inside] - t.west) / (t.east - t.west) * (cols - 1)
+            r0 = np.clip(np.floor(r).astype(np.int64), 0, rows - 2)
+            c0 = np.clip(np.floor(c).astype(np.int64), 0, cols - 2)
+            fr, fc = r - r0, c - c0
+            top = grid[r0, c0] * (1 - fc) + grid[r0, c0 + 1] * fc
+            bottom = grid[r0 + 1, c0] * (1 - fc) + grid[r0 + 1, c0 + 1] * fc
+            flat_out[inside] = top * (1 - fr) + bottom * fr
+            todo &= ~inside | np.isnan(flat_out)  # a void may be covered by an overlapping tile
+        return out
+
+    def max_elevation(self, lat: np.ndarray, lon: np.ndarray) -> float:
+        """Highest terrain in the tiles of the cells spanned by the given points."""
+        la0, la1 = math.floor(np.min(lat)), math.floor(np.max(lat))
+        lo0, lo1 = math.floor(np.min(lon)), math.floor(np.max(lon))
+        tiles = set()
+        for la in range(la0, la1 + 1):
+            for lo in range(lo0, lo1 + 1):
+                tiles.update(self._cells.get((la, lo), ()))
+        return max((self._grid(i)[1] for i in tiles), default=MIN_ELEVATION_M)
+
+    # --- rays ---
+    def intersect_rays(
+        self,
+        lat0: float,
+        lon0: float,
+        alt0_m: float,
+        directions: np.ndarray,
+        max_range_m: float = 5000.0,
+        step_m: float = 10.0,
+        refine: int = 8,
+        chunk: int = 64,
+    ) -> Dict[str, np.ndarray]:
+        """
+        First intersection of rays from (lat0, lon0, alt0_m above sea level) along ENU
+        unit directions (N, 3) with the terrain. Returns 'lat', 'lon', 'range_m' and
+        boolean 'hit'; rays that leave DEM coverage or max_range_m don't hit.
+        """
+        d = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        n = len(d)
+        lo = np.zeros(n)
+        hi = np.full(n, np.nan)
+
+        # no ray can reach the terrain while above its highest point: start marching there
+        ends_lat, ends_lon = enu_to_latlon(lat0, lon0, d[:, 0] * max_range_m, d[:, 1] * max_range_m)
+        zmax = self.max_elevation(np.append(ends_lat, lat0), np.append(ends_lon, lon0))
+        with np.errstate(divide="ignore"):
+            t_start = np.where(d[:, 2] < 0, (alt0_m - zmax) / -d[:, 2], 0.0)
+        t_start = np.clip(t_start, 0.0, max_range_m)
+
+        n_steps = int(math.ceil(max_range_m / step_m))
+        active = np.ones(n, dtype=bool)
+        prev_t = t_start.copy()
+        for first in range(1, n_steps + 1, chunk):
+            idx = np.flatnonzero(active)
+            if len(idx) == 0:
+                break
+            ts = t_start[idx, None] + np.arange(first, min(first + chunk, n_steps + 1))[None, :] * step_m
+            dd = d[idx]
+            lat, lon = enu_to_latlon(lat0, lon0, dd[:, 0, None] * ts, dd[:, 1, None] * ts)
+            z = alt0_m + dd[:, 2, None] * ts
+            below = (z - self.elevation(lat, lon)) <= 0  # NaN (no DEM) compares False
+            below &= ts <= max_range_m  # marching starts at t_start, don't step past the range
+            crossed = below.any(axis=1)
+            j = np.argmax(below, axis=1)
+            rows = np.flatnonzero(crossed)
+            hit_idx = idx[rows]
+            hi[hit_idx] = ts[rows, j[rows]]
+            lo[hit_idx] = np.where(j[rows] > 0, ts[rows, np.maximum(j[rows] - 1, 0)], prev_t[hit_idx])
+            done = crossed | (z[:, -1] < MIN_ELEVATION_M) | (ts[:, -1] >= max_range_m)
+            prev_t[idx] = ts[:, -1]
+            active[idx[done]] = False
+
+        hit = np.isfinite(hi)
+        if hit.any():
+            h_idx = np.flatnonzero(hit)
+            a, b = lo[h_idx], hi[h_idx]
+            dd = d[h_idx]
+            for _ in range(refine):
+                mid = (a + b) / 2.0
+                lat, lon = enu_to_latlon(lat0, lon0, dd[:, 0] * mid, dd[:, 1] * mid)
+                below = (alt0_m + dd[:, 2] * mid - self.elevation(lat, lon)) <= 0
+                b = np.where(below, mid, b)
+                a = np.where(below, a, mid)
+            hi[h_idx] = b
+        t = np.where(hit, hi, 0.0)
+        lat, lon = enu_to_latlon(lat0, lon0, d[:, 0] * t, d[:, 1] * t)
+        return {"lat": lat, "lon": lon, "range_m": t, "hit": hit}
+
+
+# -------------------------
+# CLI
+# -------------------------
+def convert_geotiff(src: str, out_dir: str) -> str:
+    """GeoTIFF in EPSG:4326 -> .npy + .json tile (pixel-is-area bounds shifted to pixel centres)."""
+    import rasterio
+    os.makedirs(out_dir, exist_ok=True)
+    with rasterio.open(src) as ds:
+        if ds.crs is not None and ds.crs.to_epsg() != 4326:
+            raise RuntimeError(f"{src}: expected EPSG:4326, got {ds.crs}; reproject with gdalwarp first")
+        grid = ds.read(1).astype(np.float32)
+        b = ds.bounds
+        px_w, px_h = (b.right - b.left) / ds.width, (b.top - b.bottom) / ds.height
+        meta = {"west": b.left + px_w / 2, "east": b.right - px_w / 2,
+                "south": b.bottom + px_h / 2, "north": b.top - px_h / 2,
+                "nodata": float(ds.nodata) if ds.nodata is not None else None}
+    stem = os.path.join(out_dir, os.path.splitext(os.path.basename(src))[0])
+    np.save(stem + ".npy", grid)
+    with open(stem + ".json", "w") as f:
+        json.dump(meta, f)
+    return stem + ".npy"
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="DEM tiles for terrain-aware INS projection")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("convert", help="convert a GeoTIFF into a memory-mappable .npy tile")
+    c.add_argument("geotiff")
+    c.add_argument("out_dir")
+    e = sub.add_parser("elevation", help="elevation at a point")
+    e.add_argument("dem_dir")
+    e.add_argument("lat", type=float)
+    e.add_argument("lon", type=float)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "convert":
+        print(convert_geotiff(args.geotiff, args.out_dir))
+    else:
+        model = TerrainModel(args.dem_dir)
+        value = float(model.elevation(np.asarray([args.lat]), np.asarray([args.lon]))[0])
+        print(json.dumps({"lat": args.lat, "lon": args.lon, "elevation_m": None if math.isnan(value) else value}))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,50 @@
+import json
+
+from PIL import Image
+
+import ml_geolocate
+from batch_process import completed_ids, drop_torn_line, process_entry
+
+
+def _entry(path):
+    return {"id": str(path), "path": str(path), "metadata": {}}
+
+
+def test_undecodable_image_is_an_error(tmp_path):
+    path = tmp_path / "broken.jpg"
+    path.write_bytes(b"not a jpeg")
+    row = process_entry(_entry(path))
+    assert row["status"] == "error"
+    assert row["error"] == "decode_failed"
+
+
+def test_detection_failure_is_an_error(tmp_path, monkeypatch):
+    path = tmp_path / "frame.jpg"
+    Image.new("RGB", (64, 48), (120, 120, 120)).save(path)
+
+    def broken_model():
+        raise RuntimeError("model file missing")
+
+    monkeypatch.setattr(ml_geolocate, "load_model", broken_model)
+    row = process_entry(_entry(path))
+    assert row["status"] == "error"
+    assert row["error"] == "detection_failed"
+
+
+def test_retry_failed_and_torn_line(tmp_path):
+    output = tmp_path / "results.jsonl"
+    output.write_text(json.dumps({"id": "a", "status": "ok"}) + "\n"
+                      + json.dumps({"id": "b", "status": "error"}) + "\n" + '{"id": "c", "sta')
+    assert completed_ids(str(output), retry_failed=False) == {"a", "b"}
+    assert completed_ids(str(output), retry_failed=True) == {"a"}
+    drop_torn_line(str(output))
+    assert output.read_text().endswith('"error"}\n')
+    drop_torn_line(str(output))  # complete file: unchanged
+    assert len(output.read_text().splitlines()) == 2
+
+
+def test_torn_only_line(tmp_path):
+    output = tmp_path / "results.jsonl"
+    output.write_text('{"id": "a"')
+    drop_torn_line(str(output))
+    assert output.read_text() == ""
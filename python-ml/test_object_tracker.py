@@ -0,0 +1,82 @@
+from object_tracker import ObjectTracker, M_PER_DEG
+
+LAT, LON = 55.75, 37.61
+
+
+def _obs(north_m: float = 0.0, radius: float = 20.0, label: str = "building", confidence: float = 0.8):
+    return (label, LAT + north_m / M_PER_DEG, LON, radius, confidence)
+
+
+def test_new_then_merged_across_frames():
+    tracker = ObjectTracker()
+    first = tracker.observe("flight", [_obs()], now=0.0)
+    obj, status = first[0]
+    assert status == "new"
+    second = tracker.observe("flight", [_obs(north_m=2.0)], now=1.0)
+    assert second[0][0] is obj
+    assert second[0][1] in ("updated", "unchanged")
+    assert obj.observations == 2
+    assert tracker.stats() == {"sessions": 1, "objects": 1}
+
+
+def test_improvement_reported_as_updated():
+    tracker = ObjectTracker()
+    tracker.observe("flight", [_obs(radius=40.0)], now=0.0)
+    # much more precise fix: fused radius shrinks by more than update_gain
+    assert tracker.observe("flight", [_obs(radius=5.0)], now=1.0)[0][1] == "updated"
+    # the same fix again barely changes anything
+    assert tracker.observe("flight", [_obs(radius=40.0)], now=2.0)[0][1] == "unchanged"
+
+
+def test_far_apart_and_other_labels_are_distinct():
+    tracker = ObjectTracker()
+    out = tracker.observe("flight", [_obs(), _obs(north_m=500.0), _obs(label="tower")], now=0.0)
+    assert [status for _, status in out] == ["new", "new", "new"]
+    assert len({o.object_id for o, _ in out}) == 3
+
+
+def test_detections_of_one_frame_never_share_an_object():
+    tracker = ObjectTracker()
+    out = tracker.observe("flight", [_obs(), _obs(north_m=1.0)], now=0.0)
+    assert out[0][0] is not out[1][0]
+
+
+def test_untracked_entries():
+    tracker = ObjectTracker(max_radius_m=100.0)
+    out = tracker.observe("flight", [None, _obs(radius=500.0), _obs()], now=0.0)
+    assert out[0] is None and out[1] is None
+    assert out[2][1] == "new"
+
+
+def test_sessions_are_independent():
+    tracker = ObjectTracker()
+    a = tracker.observe("a", [_obs()], now=0.0)[0][0]
+    b = tracker.observe("b", [_obs()], now=0.0)[0][0]
+    assert a is not b
+    assert tracker.stats()["sessions"] == 2
+
+
+def test_repeated_frame_key_is_idempotent():
+    tracker = ObjectTracker()
+    first = tracker.observe("flight", [_obs(), None], now=0.0, frame_key="img-1")
+    tracker.observe("flight", [_obs(north_m=1.0)], now=1.0, frame_key="img-2")
+    obj = first[0][0]
+    assert obj.observations == 2
+    # redelivered frame: same answer as the first time, nothing fused again
+    again = tracker.observe("flight", [_obs(), None], now=2.0, frame_key="img-1")
+    assert again[0] == (obj, "new")
+    assert again[1] is None
+    assert obj.observations == 2
+    # without a key the same detections count as a new sighting
+    assert tracker.observe("flight", [_obs()], now=3.0)[0][0] is obj
+    assert obj.observations == 3
+
+
+def test_expired_objects_are_evicted():
+    tracker = ObjectTracker(ttl_s=10.0)
+    old = tracker.observe("flight", [_obs()], now=0.0)[0][0]
+    tracker.observe("other", [_obs(north_m=1000.0)], now=100.0)
+    assert tracker.stats() == {"sessions": 1, "objects": 1}
+    out = tracker.observe("flight", [_obs()], now=101.0)
+    assert out[0][1] == "new"
+    assert out[0][0] is not old
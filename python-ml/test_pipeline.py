@@ -0,0 +1,66 @@
+from pipeline import OffsetTracker
+
+TP = ("images.tasks", 0)
+
+
+def test_commits_only_contiguous_offsets():
+    tracker = OffsetTracker()
+    for off in (10, 11, 12):
+        tracker.add(TP, off)
+    tracker.mark_done(TP, 11)
+    assert tracker.committable() == {}
+    tracker.mark_done(TP, 10)
+    assert tracker.committable() == {TP: 12}
+    assert tracker.committable() == {}  # unchanged since last call
+    tracker.mark_done(TP, 12)
+    assert tracker.committable() == {TP: 13}
+    assert tracker.in_flight == 0
+
+
+def test_failed_offset_holds_back_commits_until_rewind():
+    tracker = OffsetTracker()
+    for off in (0, 1, 2):
+        tracker.add(TP, off)
+    tracker.mark_failed(TP, 1)
+    tracker.mark_done(TP, 0)
+    assert tracker.committable() == {TP: 1}
+    assert tracker.failed_partitions() == {TP}
+    # offset 2 still in flight: not safe to seek yet
+    assert tracker.rewind_points() == {}
+    tracker.mark_done(TP, 2)
+    assert tracker.committable() == {}
+    assert tracker.rewind_points() == {TP: 1}
+    # state is reset for the redelivered offsets
+    assert tracker.failed_partitions() == set()
+    assert tracker.rewind_points() == {}
+    tracker.add(TP, 1)
+    tracker.add(TP, 2)
+    tracker.mark_done(TP, 1)
+    tracker.mark_done(TP, 2)
+    assert tracker.committable() == {TP: 3}
+
+
+def test_rewind_to_lowest_failed_offset():
+    tracker = OffsetTracker()
+    for off in (5, 6, 7):
+        tracker.add(TP, off)
+    tracker.mark_failed(TP, 7)
+    tracker.mark_failed(TP, 6)
+    tracker.mark_done(TP, 5)
+    assert tracker.rewind_points() == {TP: 6}
+
+
+def test_forget_releases_in_flight_and_wakes_waiters():
+    tracker = OffsetTracker()
+    other = ("images.tasks", 1)
+    tracker.add(TP, 0)
+    tracker.add(TP, 1)
+    tracker.add(other, 0)
+    tracker.mark_done(TP, 0)
+    assert not tracker.wait_idle(timeout=0.01)
+    tracker.forget([TP])
+    assert tracker.in_flight == 1
+    assert tracker.wait_idle([TP], timeout=0.01)
+    tracker.mark_done(other, 0)
+    assert tracker.wait_idle(timeout=0.01)
+    assert tracker.committable() == {other: 1}
@@ -0,0 +1,57 @@
+import json
+
+from postgis_sink import PostgisSink, _UPLOAD_COLUMNS, _DETECTION_COLUMNS
+from result_schema import build_result
+
+DETECTION = {"label": "building", "bbox": [10, 20, 100, 80], "confidence": 0.9,
+             "geolocation": {"lat": 55.75, "lon": 37.61, "confidence": 0.8, "error_radius_m": 12.0,
+                             "method": "ins_projection"},
+             "ocr_text": "12", "address": "Tverskaya 12"}
+
+
+def _rows(*results):
+    sink = PostgisSink("postgresql://unused")  # _rows needs no connection
+    return sink._rows([(r, None) for r in results])
+
+
+def test_image_result_rows():
+    tracked = dict(DETECTION, object_id="flight-7-1", track="new")
+    untracked = dict(DETECTION, geolocation=None, ocr_text=None)
+    result = build_result("42", {"detections": [tracked, untracked]}, {}, "host-1")
+    uploads, detections = _rows(result)
+    assert len(uploads) == 1
+    upload = dict(zip(_UPLOAD_COLUMNS, uploads[0]))
+    assert upload["id"] == 42
+    assert (upload["lat"], upload["lon"]) == (55.75, 37.61)
+    assert json.loads(upload["result"])["image_id"] == "42"
+    rows = [dict(zip(_DETECTION_COLUMNS, row)) for row in detections]
+    assert [r["detection_key"] for r in rows] == ["flight-7-1", "0:1"]
+    assert rows[0]["image_upload_id"] == 42
+    assert (rows[0]["x"], rows[0]["y"], rows[0]["w"], rows[0]["h"]) == (10, 20, 100, 80)
+    assert rows[0]["method"] == "ins_projection" and rows[0]["address"] == "Tverskaya 12"
+    assert rows[1]["lat"] is None and rows[1]["object_id"] is None
+    assert rows[0]["frame_t"] is None
+
+
+def test_video_frames_share_one_upload_row():
+    frames = [build_result("7", {"detections": [DETECTION]}, {}, "host-1",
+                           frame={"index": i, "t": i / 2.0, "last": i == 2}) for i in range(3)]
+    frames[2]["geolocation"] = None
+    uploads, detections = _rows({"image_id": "7", "frames": frames})
+    assert len(uploads) == 1
+    upload = dict(zip(_UPLOAD_COLUMNS, uploads[0]))
+    # position of the last frame that has one
+    assert (upload["lat"], upload["lon"]) == (55.75, 37.61)
+    rows = [dict(zip(_DETECTION_COLUMNS, row)) for row in detections]
+    assert [r["detection_key"] for r in rows] == ["0:0", "1:0", "2:0"]
+    assert [r["frame_t"] for r in rows] == [0.0, 0.5, 1.0]
+
+
+def test_non_numeric_ids_are_skipped_and_seq_increases():
+    ok = build_result("1", {"detections": [DETECTION]}, {}, "host-1")
+    later = build_result("1", {"detections": []}, {}, "host-1")
+    uploads, detections = _rows(ok, build_result("abc", {"detections": [DETECTION]}, {}, "host-1"), later)
+    assert [u[1] for u in uploads] == [1, 1]
+    # the latest result per id wins in the upsert: seq orders them
+    assert uploads[0][0] < uploads[1][0]
+    assert len(detections) == 1 and detections[0][0] == uploads[0][0]
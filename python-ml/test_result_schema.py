@@ -0,0 +1,71 @@
+import pytest
+
+import result_schema
+from result_schema import build_result, build_notification, detections_as_dicts, encode, decode
+
+ML_RESULTS = {
+    "image_geolocation": None,
+    "detections": [
+        {"label": "building", "bbox": [10.4, 20.6, 100, 80], "confidence": 0.912345,
+         "geolocation": {"lat": 55.75123456789, "lon": 37.61, "confidence": 0.8, "error_radius_m": 12.34,
+                         "method": "ins_projection"},
+         "ocr_text": "ул. Тверская", "address": None, "object_id": "flight-7-12", "track": "new"},
+        {"label": "building", "bbox": [0, 0, 5, 5], "confidence": 0.5, "geolocation": None},
+    ],
+    "suppressed": 3,
+}
+
+
+def _result():
+    return build_result("42", ML_RESULTS, {"flight_id": "7"}, "host-1", frame={"index": 3, "t": 0.1, "last": True})
+
+
+def test_build_result_rows():
+    result = _result()
+    assert result["v"] == result_schema.SCHEMA_VERSION
+    assert result["suppressed"] == 3
+    assert result["frame"]["index"] == 3
+    rows = detections_as_dicts(result)
+    assert rows[0]["x"] == 10 and rows[0]["y"] == 21
+    assert rows[0]["confidence"] == 0.9123
+    assert rows[0]["lat"] == 55.7512346
+    assert rows[0]["error_radius_m"] == 12.3
+    assert rows[1]["lat"] is None and rows[1]["object_id"] is None
+    # no image-level position: the most confident detection's
+    assert result["geolocation"]["method"] == "ins_projection"
+
+
+@pytest.mark.parametrize("encoding", ["json", "msgpack"])
+@pytest.mark.parametrize("compression", ["", "gzip"])
+def test_encode_decode_roundtrip(monkeypatch, encoding, compression):
+    if encoding == "msgpack":
+        pytest.importorskip("msgpack")
+    monkeypatch.setattr(result_schema, "RESULT_COMPRESSION_MIN_BYTES", 0)
+    result = _result()
+    body, headers = encode(result, encoding, compression)
+    meta = dict(headers)
+    assert meta["content-type"] == result_schema.CONTENT_TYPES[encoding]
+    assert meta["schema-version"] == b"2"
+    assert ("content-encoding" in meta) == (compression == "gzip")
+    assert decode(body, headers) == result
+
+
+def test_small_bodies_are_not_compressed(monkeypatch):
+    monkeypatch.setattr(result_schema, "RESULT_COMPRESSION_MIN_BYTES", 1 << 20)
+    body, headers = encode(_result(), "json", "gzip")
+    assert "content-encoding" not in dict(headers)
+    assert decode(body, headers)["image_id"] == "42"
+
+
+def test_decode_without_headers_is_json():
+    body, _ = encode({"v": 2, "image_id": "1"}, "json", "")
+    assert decode(body) == {"v": 2, "image_id": "1"}
+
+
+def test_notification_summarizes_frames():
+    first = build_result("42", {"detections": []}, {}, "host-1", frame={"index": 0, "t": 0.0, "last": False})
+    last = _result()
+    note = build_notification([first, last])
+    assert note["detection_count"] == 2
+    assert note["geolocation"] == last["geolocation"]
+    assert note["stored"] == "postgis"
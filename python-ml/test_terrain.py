@@ -0,0 +1,81 @@
+import json
+import math
+
+import numpy as np
+import pytest
+
+from terrain import TerrainModel, EARTH_R
+
+LAT, LON = 55.75, 37.61
+M_PER_DEG = EARTH_R * math.pi / 180.0
+
+
+def _write_tile(directory, name, grid, west=37.6, south=55.74, east=37.62, north=55.76, nodata=None):
+    np.save(directory / f"{name}.npy", np.asarray(grid, dtype=np.float32))
+    meta = {"west": west, "south": south, "east": east, "north": north}
+    if nodata is not None:
+        meta["nodata"] = nodata
+    (directory / f"{name}.json").write_text(json.dumps(meta))
+
+
+def _north_m(lat):
+    return (np.asarray(lat) - LAT) * M_PER_DEG
+
+
+@pytest.fixture
+def flat(tmp_path):
+    _write_tile(tmp_path, "flat", np.full((201, 201), 100.0))
+    return TerrainModel(str(tmp_path), cache_mb=16)
+
+
+def test_elevation_bilinear_and_coverage(tmp_path):
+    # elevation rises 1 m per column west -> east
+    _write_tile(tmp_path, "ramp", np.tile(np.arange(201, dtype=np.float32), (201, 1)))
+    terrain = TerrainModel(str(tmp_path))
+    z = terrain.elevation(np.array([55.75, 55.75, 55.75, 56.5]), np.array([37.6, 37.61, 37.60005, 37.61]))
+    assert z[:3] == pytest.approx([0.0, 100.0, 0.5])
+    assert math.isnan(z[3])
+
+
+def test_nodata_is_nan(tmp_path):
+    grid = np.full((11, 11), 50.0)
+    grid[5, 5] = -32768
+    _write_tile(tmp_path, "void", grid, nodata=-32768)
+    terrain = TerrainModel(str(tmp_path))
+    assert math.isnan(terrain.elevation(np.array([55.75]), np.array([37.61]))[0])
+
+
+def test_nadir_and_oblique_rays_hit_flat_ground(flat):
+    s = math.sqrt(0.5)
+    rays = np.array([[0.0, 0.0, -1.0], [0.0, s, -s]])
+    hits = flat.intersect_rays(LAT, LON, 160.0, rays, max_range_m=1000.0, step_m=5.0)
+    assert hits["hit"].tolist() == [True, True]
+    assert hits["range_m"] == pytest.approx([60.0, 60.0 * math.sqrt(2)], abs=0.1)
+    assert hits["lon"][0] == pytest.approx(LON)
+    assert _north_m(hits["lat"]) == pytest.approx([0.0, 60.0], abs=0.1)
+
+
+def test_rays_that_miss(flat):
+    rays = np.array([[0.0, 1.0, 0.0], [0.0, 0.0, 1.0], [0.0, 0.9992, -0.04]])
+    # horizontal and upward rays never hit; the shallow one leaves the tile first
+    hits = flat.intersect_rays(LAT, LON, 160.0, rays, max_range_m=5000.0, step_m=10.0)
+    assert not hits["hit"].any()
+    assert hits["range_m"].tolist() == [0.0, 0.0, 0.0]
+
+
+def test_ray_stops_at_raised_terrain(tmp_path):
+    # 30 m high plateau starting ~111 m north of the camera
+    grid = np.full((201, 201), 100.0)
+    grid[:90, :] = 130.0
+    _write_tile(tmp_path, "step", grid)
+    terrain = TerrainModel(str(tmp_path))
+    d = np.array([[0.0, math.cos(math.radians(20)), -math.sin(math.radians(20))]])
+    hits = terrain.intersect_rays(LAT, LON, 160.0, d, max_range_m=1000.0, step_m=5.0)
+    assert hits["hit"][0]
+    # the flat ground would be reached at 165 m north, the plateau edge comes first
+    assert 100.0 < _north_m(hits["lat"][0]) < 125.0
+
+
+def test_max_range(flat):
+    hits = flat.intersect_rays(LAT, LON, 160.0, np.array([[0.0, 0.0, -1.0]]), max_range_m=50.0, step_m=5.0)
+    assert not hits["hit"][0]
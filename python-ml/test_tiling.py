@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from tiling import detect_tiled, merge_boxes, tile_grid
+
+
+def _merge(boxes, scores, classes, cut=None, **kwargs):
+    return merge_boxes(np.asarray(boxes, dtype=np.float32), np.asarray(scores, dtype=np.float32),
+                       np.asarray(classes, dtype=np.int64), cut=None if cut is None else np.asarray(cut), **kwargs)
+
+
+@pytest.mark.parametrize("method", ["nms", "wbf"])
+def test_overlapping_duplicates_collapse(method):
+    boxes, scores, classes = _merge([[0, 0, 100, 100], [2, 2, 102, 102], [300, 300, 400, 400]],
+                                    [0.9, 0.8, 0.7], [0, 0, 0], method=method)
+    assert len(boxes) == 2
+    assert scores.tolist() == pytest.approx([0.9, 0.7])
+    assert boxes[1].tolist() == pytest.approx([300, 300, 400, 400])
+
+
+def test_nms_keeps_best_box_and_wbf_averages():
+    args = ([[0, 0, 100, 100], [10, 0, 110, 100]], [0.75, 0.25], [0, 0])
+    nms_boxes, _, _ = _merge(*args, method="nms")
+    assert nms_boxes.tolist() == [[0, 0, 100, 100]]
+    wbf_boxes, wbf_scores, _ = _merge(*args, method="wbf")
+    assert wbf_boxes[0].tolist() == pytest.approx([2.5, 0, 102.5, 100])
+    assert wbf_scores.tolist() == pytest.approx([0.75])
+
+
+def test_different_classes_are_not_merged():
+    boxes, _, classes = _merge([[0, 0, 100, 100], [0, 0, 100, 100]], [0.9, 0.8], [0, 1])
+    assert len(boxes) == 2
+    assert sorted(classes.tolist()) == [0, 1]
+
+
+@pytest.mark.parametrize("method", ["nms", "wbf"])
+def test_tile_cut_fragment_scoring_higher_keeps_complete_box(method):
+    # left half of a building cut by a tile border, detected with higher confidence
+    boxes, scores, _ = _merge([[0, 0, 100, 100], [0, 0, 200, 100]], [0.9, 0.6], [0, 0],
+                              cut=[True, False], method=method)
+    assert len(boxes) == 1
+    assert boxes[0].tolist() == pytest.approx([0, 0, 200, 100])
+    assert scores.tolist() == pytest.approx([0.9])
+
+
+@pytest.mark.parametrize("method", ["nms", "wbf"])
+def test_nested_distinct_buildings_survive(method):
+    # an annex inside a courtyard block and a kiosk next to a tower: none touch a tile seam
+    nested = [[0, 0, 300, 300], [100, 100, 180, 180], [400, 0, 600, 200], [410, 10, 500, 100]]
+    boxes, _, _ = _merge(nested, [0.6, 0.9, 0.8, 0.7], [0, 0, 0, 0], method=method)
+    assert len(boxes) == 4
+    # the same small box touching a seam is a fragment of the large one
+    boxes, _, _ = _merge(nested[:2], [0.6, 0.9], [0, 0], cut=[False, True], method=method)
+    assert len(boxes) == 1
+    assert boxes[0].tolist() == pytest.approx([0, 0, 300, 300])
+
+
+def test_detect_tiled_merges_seam_fragments_only():
+    # tiles start at x=0, 384 and 512; the middle one sees the whole building at x 450..650,
+    # the others only fragments cut by their edges. A small building stands inside its bbox.
+    building, small = (450, 650), (470, 500)
+
+    def detect_batch(tiles):
+        out = []
+        for tile in tiles:
+            r, g, _ = tile.getpixel((0, 0))
+            x0, x1 = r + 256 * g, r + 256 * g + tile.width
+            dets = [{"label": "building", "confidence": 0.6 if x0 <= building[0] and building[1] <= x1 else 0.9,
+                     "bbox": [max(building[0], x0) - x0, 100, min(building[1], x1) - max(building[0], x0), 200]}]
+            if x0 <= small[0] and small[1] <= x1:
+                dets.append({"label": "building", "bbox": [small[0] - x0, 150, 30, 40], "confidence": 0.8})
+            out.append(dets)
+        return out
+
+    columns = np.arange(1024)
+    pixels = np.zeros((512, 1024, 3), dtype=np.uint8)
+    pixels[..., 0], pixels[..., 1] = columns % 256, columns // 256
+    dets = detect_tiled(Image.fromarray(pixels), detect_batch, tile_size=512, overlap=128)
+    assert sorted(d["bbox"] for d in dets) == [[450, 100, 200, 200], [470, 150, 30, 40]]
+
+
+def test_empty_input():
+    boxes, scores, classes = _merge(np.zeros((0, 4)), [], [])
+    assert len(boxes) == len(scores) == len(classes) == 0
+
+
+def test_tile_grid_covers_image():
+    tiles = list(tile_grid(1000, 700, 640, 128))
+    assert tiles[0][:2] == (0, 0)
+    assert max(t[2] for t in tiles) == 1000
+    assert max(t[3] for t in tiles) == 700
@@ -0,0 +1,207 @@
+"""
+Tiled detection for large images (orthophotos, 20+ MP drone frames).
+
+Running the detector once on an 8000x6000 image letterboxes it to ~640 px, so small
+buildings vanish. Instead the full-resolution image is cut into overlapping tiles
+that are generated lazily and sent to the detector in chunks of at most
+max_in_flight tiles, so only that many crops exist at a time. Tile-local bboxes are
+shifted to global pixels and duplicates from the overlaps are merged with NMS or
+weighted box fusion; boxes touching an internal tile seam are also merged into the
+complete box that contains them.
+
+    detections = detect_tiled(full_image, detect_buildings_batch, tile_size=640, overlap=128)
+
+Output has the same shape as detect_buildings(): [{'label','bbox':[x,y,w,h],'confidence','mask'}, ...]
+"""
+
+import logging
+from itertools import islice
+from typing import Callable, Dict, Any, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger("tiling")
+
+BatchDetectFn = Callable[[List[Image.Image]], List[List[Dict[str, Any]]]]
+
+
+def _starts(length: int, tile: int, stride: int) -> List[int]:
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, stride))
+    starts.append(length - tile)  # last tile flush with the border instead of a thin sliver
+    return starts
+
+
+def tile_grid(width: int, height: int, tile_size: int, overlap: int) -> Iterator[Tuple[int, int, int, int]]:
+    """Lazily yield (x0, y0, x1, y1) tiles covering the image, neighbours overlapping by `overlap` px."""
+    stride = max(1, tile_size - overlap)
+    xs = _starts(width, tile_size, stride)
+    for y in _starts(height, tile_size, stride):
+        for x in xs:
+            yield x, y, min(x + tile_size, width), min(y + tile_size, height)
+
+
+def _overlaps(box: np.ndarray, boxes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """IoU and intersection-over-smaller-area of one xyxy box against (N, 4) boxes."""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    iou = inter / np.maximum(area + areas - inter, 1e-9)
+    ios = inter / np.maximum(np.minimum(area, areas), 1e-9)
+    return iou, ios
+
+
+def _match(head: np.ndarray, head_cut: bool, boxes: np.ndarray, cut: np.ndarray, iou_threshold: float,
+           ios_threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (IoU match, containment match) of one box against (N, 4) boxes. Containment
+    (IoS >= ios_threshold) only counts when the smaller box of the pair is cut by a tile
+    seam: a building lying inside a larger detection is otherwise a building of its own.
+    """
+    iou, ios = _overlaps(head, boxes)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    fragment = np.where(areas <= _area(head), cut, head_cut)
+    return iou >= iou_threshold, (ios >= ios_threshold) & fragment
+
+
+def merge_boxes(boxes: np.ndarray, scores: np.ndarray, classes: np.ndarray, method: str = "nms",
+                iou_threshold: float = 0.5, ios_threshold: float = 0.8,
+                cut: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Greedy merge of duplicates of the same class, highest score first; every step
+    compares the best remaining box with all others at once. A box joins the group if
+    IoU >= iou_threshold, or if it and the group box lie mostly one inside the other
+    (IoS >= ios_threshold) and the smaller one is a tile-cut fragment (cut[i]: the box
+    touches an internal tile seam) - its IoU with the complete box may be low, and the
+    fragment may even score higher. Containment matches extend the group to the union,
+    so the complete box wins; the grown box then picks up further fragments inside it.
+
+    nms: box of the highest scoring member, extended by containment matches.
+    wbf: score-weighted mean of the IoU-matched members, extended by containment
+    matches; confidence of the best box.
+    """
+    if len(boxes) == 0:
+        return boxes, scores, classes
+    cut = np.zeros(len(boxes), dtype=bool) if cut is None else np.asarray(cut, dtype=bool)
+    # shift each class into its own coordinate range: one pass never matches across classes
+    span = float(boxes.max() - boxes.min()) + 1.0
+    shift = (classes - classes.min()).astype(np.float64) * span
+    shifted = boxes.astype(np.float64) + shift[:, None]
+    remaining = np.argsort(-scores, kind="stable")
+    heads: List[int] = []
+    merged: List[np.ndarray] = []
+    while len(remaining):
+        h, rest = remaining[0], remaining[1:]
+        overlap, contain = _match(shifted[h], cut[h], shifted[rest], cut[rest], iou_threshold, ios_threshold)
+        extent = shifted[h]
+        if contain.any():
+            extent = _union(extent, _bounds(shifted[rest[contain]]))
+        fuse = rest[overlap & ~contain]  # cut-off fragments would shrink an averaged box
+        remaining = rest[~(overlap | contain)]
+        while len(remaining) and (extent != shifted[h]).any():
+            _, more = _match(extent, False, shifted[remaining], cut[remaining], iou_threshold, ios_threshold)
+            if not more.any():
+                break
+            extent = _union(extent, _bounds(shifted[remaining[more]]))
+            remaining = remaining[~more]
+        box = extent
+        if method == "wbf":
+            members = np.append(h, fuse)
+            w = scores[members].astype(np.float64)
+            box = (shifted[members] * w[:, None]).sum(axis=0) / max(w.sum(), 1e-12)
+            if (extent != shifted[h]).any():
+                box = _union(box, extent)
+        heads.append(int(h))
+        merged.append(box - shift[h])
+    head_idx = np.asarray(heads)
+    out = np.asarray(merged)
+    return (out if method == "wbf" else out.astype(boxes.dtype)), scores[head_idx], classes[head_idx]
+
+
+def _area(box: np.ndarray) -> float:
+    return float((box[2] - box[0]) * (box[3] - box[1]))
+
+
+def _bounds(boxes: np.ndarray) -> np.ndarray:
+    """Enclosing xyxy box of (N, 4) boxes."""
+    return np.concatenate([boxes[:, :2].min(axis=0), boxes[:, 2:].max(axis=0)])
+
+
+def _union(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Enclosing xyxy box(es) of a and b."""
+    return np.concatenate([np.minimum(a[..., :2], b[..., :2]), np.maximum(a[..., 2:], b[..., 2:])], axis=-1)
+
+
+def detect_tiled(
+    image: Image.Image,
+    detect_batch_fn: BatchDetectFn,
+    tile_size: int = 640,
+    overlap: int = 128,
+    max_in_flight: int = 8,
+    merge: str = "nms",
+    iou_threshold: float = 0.5,
+    extra: Optional[Sequence[Dict[str, Any]]] = None,
+    seam_margin: int = 4,
+) -> List[Dict[str, Any]]:
+    """
+    Detect on overlapping tiles of `image` and return merged detections in global pixels.
+    extra: detections already in global pixels (e.g. from a downscaled whole-image pass)
+    merged together with the tiles, so buildings larger than a tile are still found.
+    Boxes within seam_margin px of a tile edge inside the image are treated as possibly
+    cut off by it (see merge_boxes).
+    """
+    width, height = image.size
+    rows: List[List[float]] = []
+    scores: List[float] = []
+    labels: List[str] = []
+    cut: List[bool] = []
+
+    def _collect(dets: Sequence[Dict[str, Any]], x0: int, y0: int, x1: int, y1: int, tile: bool):
+        for det in dets:
+            x, y, w, h = det["bbox"]
+            rows.append([x + x0, y + y0, x + x0 + w, y + y0 + h])
+            scores.append(float(det.get("confidence", 0.0)))
+            labels.append(det.get("label", ""))
+            # only tile edges inside the image can cut an object; the image border can't be undone
+            cut.append(tile and ((x0 > 0 and x <= seam_margin) or (y0 > 0 and y <= seam_margin)
+                                 or (x1 < width and x + w >= x1 - x0 - seam_margin)
+                                 or (y1 < height and y + h >= y1 - y0 - seam_margin)))
+
+    tiles = tile_grid(width, height, tile_size, overlap)
+    n_tiles = 0
+    while True:
+        chunk = list(islice(tiles, max(1, max_in_flight)))
+        if not chunk:
+            break
+        crops = [image.crop(t) for t in chunk]
+        results = detect_batch_fn(crops)
+        del crops
+        for (x0, y0, x1, y1), dets in zip(chunk, results):
+            _collect(dets, x0, y0, x1, y1, tile=True)
+        n_tiles += len(chunk)
+    if extra:
+        _collect(extra, 0, 0, width, height, tile=False)
+
+    if not rows:
+        return []
+    names = sorted(set(labels))
+    index = {name: i for i, name in enumerate(names)}
+    classes = np.asarray([index[label] for label in labels], dtype=np.int64)
+    boxes, conf, classes = merge_boxes(np.asarray(rows, dtype=np.float64), np.asarray(scores), classes,
+                                       method=merge, iou_threshold=iou_threshold, cut=np.asarray(cut))
+    boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, width)
+    boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, height)
+    logger.debug("Tiled detection: %d tiles, %d raw -> %d merged boxes", n_tiles, len(rows), len(boxes))
+
+    out = []
+    for (x1, y1, x2, y2), score, cls in zip(boxes.tolist(), conf.tolist(), classes.tolist()):
+        x1, y1 = int(round(x1)), int(round(y1))
+        out.append({"label": names[cls], "bbox": [x1, y1, int(round(x2)) - x1, int(round(y2)) - y1],
+                    "confidence": float(score), "mask": None})
+    return out
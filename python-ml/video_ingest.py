@@ -0,0 +1,218 @@
+"""
+Video ingestion: keyframe selection from a streamed video + batched detection.
+
+The container is demuxed with PyAV from a seekable stream (S3Fetcher.open_stream:
+Range GETs of fixed-size blocks, nothing written to disk). Frames are sampled at
+VIDEO_SAMPLE_FPS; a sampled frame becomes a keyframe only if it differs enough from
+the previous keyframe (mean absolute difference of 64x36 grayscale thumbnails
+>= VIDEO_MIN_MOTION) or VIDEO_MAX_GAP_S passed since it, so hovering or slow
+segments aren't inferred again and again. Keyframes are detected in batches of
+VIDEO_BATCH_SIZE through the regular detection / INS projection path.
+
+Per-frame pose: metadata 'ins' is used for every frame; metadata 'ins_track', a list
+of {"t": seconds from video start, "lat", "lon", "alt_m", "yaw", "pitch", "roll", ...},
+is interpolated at each frame timestamp. Every frame result carries
+{"index", "t"} (frame number and seconds from the start of the video).
+
+Task message: {"type": "video", "image_id": .., "image_url": "s3://bucket/flight.mp4", "metadata": {..}}
+
+    python video_ingest.py flight.mp4 --metadata '{"ins_track": [...]}' [--fps 2 --min-motion 0.05]
+"""
+
+import os
+import sys
+import json
+import math
+import bisect
+import logging
+import argparse
+from typing import Callable, Dict, Any, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger("video_ingest")
+
+VIDEO_SAMPLE_FPS = float(os.getenv("VIDEO_SAMPLE_FPS", "2"))
+VIDEO_MIN_MOTION = float(os.getenv("VIDEO_MIN_MOTION", "0.04"))  # mean abs gray difference, 0..1
+VIDEO_MAX_GAP_S = float(os.getenv("VIDEO_MAX_GAP_S", "10"))
+VIDEO_BATCH_SIZE = int(os.getenv("VIDEO_BATCH_SIZE", "8"))
+VIDEO_KEYFRAMES_ONLY = os.getenv("VIDEO_KEYFRAMES_ONLY", "0") == "1"  # decode codec keyframes (I-frames) only
+
+_THUMB = (64, 36)
+_ANGLE_KEYS = ("yaw", "pitch", "roll")
+
+
+# -------------------------
+# Frame selection
+# -------------------------
+def motion_score(a: Optional[np.ndarray], b: np.ndarray) -> float:
+    """Mean absolute difference of two uint8 thumbnails in [0, 1]; 1.0 without a previous one."""
+    if a is None:
+        return 1.0
+    return float(np.abs(a.astype(np.int16) - b.astype(np.int16)).mean()) / 255.0
+
+
+def iter_keyframes(
+    stream,
+    sample_fps: float = VIDEO_SAMPLE_FPS,
+    min_motion: float = VIDEO_MIN_MOTION,
+    max_gap_s: float = VIDEO_MAX_GAP_S,
+    keyframes_only: bool = VIDEO_KEYFRAMES_ONLY,
+    stats: Optional[Dict[str, int]] = None,
+) -> Iterator[Tuple[int, float, Image.Image, float]]:
+    """
+    Yield (frame_index, t_seconds, RGB image, motion score) of selected frames.
+    Only selected frames are converted to RGB; the rest are compared as thumbnails.
+    """
+    import av
+
+    stats = stats if stats is not None else {}
+    for k in ("decoded", "sampled", "selected"):
+        stats.setdefault(k, 0)
+    with av.open(stream, mode="r") as container:
+        video = container.streams.video[0]
+        video.thread_type = "AUTO"
+        if keyframes_only:
+            video.codec_context.skip_frame = "NONKEY"
+        time_base = float(video.time_base) if video.time_base else 0.0
+        period = 1.0 / sample_fps if sample_fps > 0 else 0.0
+        next_sample = 0.0
+        last_thumb: Optional[np.ndarray] = None
+        last_t = -math.inf
+        for index, frame in enumerate(container.decode(video)):
+            stats["decoded"] += 1
+            t = float(frame.pts * time_base) if frame.pts is not None else index / float(video.average_rate or 25)
+            if t + 1e-6 < next_sample:
+                continue
+            next_sample = t + period
+            stats["sampled"] += 1
+            thumb = frame.reformat(width=_THUMB[0], height=_THUMB[1], format="gray").to_ndarray()
+            score = motion_score(last_thumb, thumb)
+            if score < min_motion and t - last_t < max_gap_s:
+                continue
+            last_thumb, last_t = thumb, t
+            stats["selected"] += 1
+            yield index, t, frame.to_image(), score
+
+
+# -------------------------
+# Per-frame pose
+# -------------------------
+def _lerp_angle(a: float, b: float, w: float) -> float:
+    d = (b - a + 180.0) % 360.0 - 180.0
+    return a + d * w
+
+
+def interpolate_ins(track: List[Dict[str, Any]], t: float, times: Optional[Sequence[float]] = None) -> Dict[str, Any]:
+    """INS pose at t from a time-sorted track (clamped at both ends); times: the track's "t" values."""
+    if times is None:
+        times = [float(p["t"]) for p in track]
+    i = bisect.bisect_left(times, t)
+    if i <= 0:
+        return dict(track[0])
+    if i >= len(track):
+        return dict(track[-1])
+    a, b = track[i - 1], track[i]
+    w = (t - times[i - 1]) / max(1e-9, times[i] - times[i - 1])
+    out = dict(a)
+    for key, va in a.items():
+        vb = b.get(key)
+        if key == "t" or not isinstance(va, (int, float)) or not isinstance(vb, (int, float)):
+            continue
+        out[key] = _lerp_angle(va, vb, w) if key in _ANGLE_KEYS else va + (vb - va) * w
+    out["t"] = t
+    return out
+
+
+def sorted_track(metadata: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[float]]:
+    """metadata 'ins_track' sorted by time, and its timestamps (once per video)."""
+    track = sorted(metadata.get("ins_track") or [], key=lambda p: float(p["t"]))
+    return track, [float(p["t"]) for p in track]
+
+
+def frame_metadata(metadata: Dict[str, Any], video_id: str, index: int, t: float,
+                   track: Optional[Tuple[List[Dict[str, Any]], List[float]]] = None) -> Dict[str, Any]:
+    """Per-frame task metadata; track: sorted_track(metadata), computed here if not given."""
+    md = {k: v for k, v in metadata.items() if k != "ins_track"}
+    points, times = track if track is not None else sorted_track(metadata)
+    if points:
+        md["ins"] = interpolate_ins(points, t, times)
+    # frames of one video are one flight for cross-frame dedup unless the task says otherwise
+    if not md.get("flight_id") and not md.get("session_id"):
+        md["flight_id"] = video_id
+    md["frame"] = {"index": index, "t": round(t, 3)}
+    return md
+
+
+# -------------------------
+# Processing
+# -------------------------
+def process_video(
+    stream,
+    video_id: str,
+    metadata: Optional[Dict[str, Any]] = None,
+    batch_detector: Optional[Callable[[List[Image.Image]], List[List[Dict[str, Any]]]]] = None,
+    ocr: bool = True,
+    geocode: bool = True,
+    batch_size: int = VIDEO_BATCH_SIZE,
+    **select,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield one result per keyframe: {"frame": {"index", "t"}, "detections", "image_geolocation", ...}
+    (enrich_detections() output). select: overrides for iter_keyframes().
+    """
+    from ml_geolocate import detect_frames, enrich_detections
+
+    metadata = metadata or {}
+    track = sorted_track(metadata)
+    stats: Dict[str, int] = {}
+    batch: List[Tuple[int, float, Image.Image]] = []
+
+    def _flush():
+        metas = [frame_metadata(metadata, video_id, index, t, track) for index, t, _ in batch]
+        contexts = detect_frames([img for _, _, img in batch], metas, batch_detector=batch_detector)
+        for ctx, md in zip(contexts, metas):
+            result = enrich_detections(ctx, ocr=ocr, geocode=geocode,
+                                       frame_key=f"{video_id}:{md['frame']['index']}")
+            result["frame"] = md["frame"]
+            yield result
+        batch.clear()
+
+    for index, t, image, _ in iter_keyframes(stream, stats=stats, **select):
+        batch.append((index, t, image))
+        if len(batch) >= batch_size:
+            yield from _flush()
+    if batch:
+        yield from _flush()
+    logger.info("Video %s: %d frames decoded, %d sampled, %d keyframes", video_id,
+                stats.get("decoded", 0), stats.get("sampled", 0), stats.get("selected", 0))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Detect and geolocate buildings in a video's keyframes")
+    parser.add_argument("video")
+    parser.add_argument("--metadata", help="task metadata, JSON string or file (ins / ins_track)")
+    parser.add_argument("--fps", type=float, default=VIDEO_SAMPLE_FPS, help="sampling rate before motion filter")
+    parser.add_argument("--min-motion", type=float, default=VIDEO_MIN_MOTION)
+    parser.add_argument("--max-gap", type=float, default=VIDEO_MAX_GAP_S)
+    parser.add_argument("--keyframes-only", action="store_true", help="decode codec keyframes only")
+    args = parser.parse_args(argv)
+
+    metadata = {}
+    if args.metadata:
+        if os.path.isfile(args.metadata):
+            with open(args.metadata, encoding="utf-8") as f:
+                metadata = json.load(f)
+        else:
+            metadata = json.loads(args.metadata)
+    with open(args.video, "rb") as f:
+        for result in process_video(f, os.path.basename(args.video), metadata, sample_fps=args.fps,
+                                    min_motion=args.min_motion, max_gap_s=args.max_gap,
+                                    keyframes_only=args.keyframes_only or VIDEO_KEYFRAMES_ONLY):
+            print(json.dumps(result, ensure_ascii=False, default=str))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    sys.exit(main())
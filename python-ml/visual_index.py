@@ -0,0 +1,276 @@
+"""
+Retrieval-based visual localization over a FAISS index of geotagged reference images.
+
+Every image is reduced to a compact global descriptor (gradient-orientation grid +
+coarse color layout + luminance histogram, 192 floats, L2-normalized). Reference
+descriptors live in a FAISS IVF-PQ index (inner product); their lat/lon are stored
+row-aligned in coords.npy. Both are memory-mapped on load, so a multi-million entry
+index opens instantly and its pages are shared between worker processes.
+
+A query returns the similarity-weighted mean position of the top-k neighbours with a
+confidence and an error radius derived from their spread.
+
+Index directory:
+    index.faiss   FAISS index (ids = row numbers of coords.npy)
+    coords.npy    float64 (N, 2) lat/lon
+    sources.txt   indexed image paths, one per line (used to skip them on extend)
+    meta.json     descriptor version, dim, index factory string
+
+Build / extend from a directory of geotagged JPEGs (EXIF GPS):
+    python visual_index.py build /data/reference_jpegs /app/models/visual_index [--nlist 1024 --pq-m 24]
+    python visual_index.py query /app/models/visual_index photo.jpg
+"""
+
+import os
+import sys
+import json
+import math
+import logging
+import argparse
+from typing import Dict, Any, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger("visual_index")
+
+
+def _faiss():
+    # imported on use: the worker only needs faiss when VISUAL_INDEX_DIR is configured
+    try:
+        import faiss
+    except ImportError:
+        raise RuntimeError("faiss is not installed")
+    return faiss
+
+
+DESCRIPTOR_VERSION = 1
+DESCRIPTOR_DIM = 192
+EARTH_R = 6378137.0
+
+
+# -------------------------
+# Global descriptor
+# -------------------------
+def global_descriptor(image: Image.Image) -> np.ndarray:
+    """192-d float32, L2-normalized."""
+    gray = np.asarray(image.convert("L").resize((64, 64), Image.BILINEAR), dtype=np.float32) / 255.0
+
+    # 4x4 grid x 8 unsigned gradient orientations, weighted by magnitude (GIST/HOG-like)
+    gx = np.zeros_like(gray)
+    gy = np.zeros_like(gray)
+    gx[:, 1:-1] = gray[:, 2:] - gray[:, :-2]
+    gy[1:-1, :] = gray[2:, :] - gray[:-2, :]
+    mag = np.hypot(gx, gy)
+    ang = np.mod(np.arctan2(gy, gx), np.pi)
+    bins = np.minimum((ang / np.pi * 8).astype(np.int64), 7)
+    rows, cols = np.indices(gray.shape)
+    cell = (rows // 16) * 4 + cols // 16
+    grad = np.bincount((cell * 8 + bins).ravel(), weights=mag.ravel(), minlength=128).astype(np.float32)
+    grad /= np.linalg.norm(grad) + 1e-6
+
+    # coarse color layout 4x4x3
+    color = np.asarray(image.convert("RGB").resize((4, 4), Image.BOX), dtype=np.float32).ravel() / 255.0
+    color -= color.mean()
+    color /= np.linalg.norm(color) + 1e-6
+
+    # luminance histogram
+    hist = np.histogram(gray, bins=16, range=(0.0, 1.0))[0].astype(np.float32)
+    hist = np.sqrt(hist / max(1.0, hist.sum()))
+
+    desc = np.concatenate([grad, color * 0.5, hist * 0.5])
+    desc /= np.linalg.norm(desc) + 1e-6
+    return desc.astype(np.float32)
+
+
+def descriptors(images: Sequence[Image.Image]) -> np.ndarray:
+    if not images:
+        return np.zeros((0, DESCRIPTOR_DIM), dtype=np.float32)
+    return np.stack([global_descriptor(img) for img in images])
+
+
+# -------------------------
+# Query side
+# -------------------------
+class VisualLocalizer:
+    def __init__(self, index_dir: str, k: int = 10, nprobe: int = 16, min_similarity: float = 0.6,
+                 min_error_m: float = 50.0):
+        faiss = _faiss()
+        with open(os.path.join(index_dir, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("descriptor_version") != DESCRIPTOR_VERSION:
+            raise RuntimeError(f"Index {index_dir} built with descriptor v{self.meta.get('descriptor_version')}, "
+                               f"expected v{DESCRIPTOR_VERSION}")
+        path = os.path.join(index_dir, "index.faiss")
+        try:
+            self.index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except Exception:
+            logger.warning("mmap load of %s not supported for this index type; reading into memory", path)
+            self.index = faiss.read_index(path)
+        if hasattr(self.index, "nprobe"):
+            self.index.nprobe = nprobe
+        self.coords = np.load(os.path.join(index_dir, "coords.npy"), mmap_mode="r")
+        self.k = k
+        self.min_similarity = min_similarity
+        self.min_error_m = min_error_m
+        logger.info("Visual index %s loaded (%d references)", index_dir, self.index.ntotal)
+
+    def locate_batch(self, images: Sequence[Image.Image]) -> List[Optional[Dict[str, Any]]]:
+        if not images or self.index.ntotal == 0:
+            return [None for _ in images]
+        sims, ids = self.index.search(descriptors(images), min(self.k, self.index.ntotal))
+        return [self._estimate(s, i) for s, i in zip(sims, ids)]
+
+    def locate(self, image: Image.Image) -> Optional[Dict[str, Any]]:
+        return self.locate_batch([image])[0]
+
+    def _estimate(self, sims: np.ndarray, ids: np.ndarray) -> Optional[Dict[str, Any]]:
+        valid = ids >= 0
+        if not valid.any() or sims[valid].max() < self.min_similarity:
+            return None
+        sims, ids = sims[valid], ids[valid]
+        pts = np.asarray(self.coords[np.sort(ids)])[np.argsort(np.argsort(ids))]
+        # sharp softmax: near-duplicates dominate, loose matches barely count
+        w = np.exp((sims - sims.max()) / 0.02)
+        w /= w.sum()
+        lat = float((pts[:, 0] * w).sum())
+        lon = float((pts[:, 1] * w).sum())
+        dy = (pts[:, 0] - lat) * EARTH_R * math.pi / 180.0
+        dx = (pts[:, 1] - lon) * EARTH_R * math.pi / 180.0 * math.cos(math.radians(lat))
+        spread_m = float(np.sqrt((w * (dx * dx + dy * dy)).sum()))
+        top = float(sims.max())
+        confidence = max(0.0, min(1.0, top)) * 0.6 / (1.0 + spread_m / 1000.0)
+        return {"lat": lat, "lon": lon, "confidence": round(confidence, 4),
+                "error_radius_m": max(self.min_error_m, 2.0 * spread_m),
+                "method": "visual_retrieval", "similarity": round(top, 4), "neighbors": int(len(ids))}
+
+
+# -------------------------
+# Build side
+# -------------------------
+def iter_geotagged_images(root: str) -> Iterator[Tuple[str, float, float]]:
+    from image_decode import read_image_header
+    from ml_geolocate import image_geolocation_from_exif
+    for dirpath, _, files in os.walk(root):
+        for name in sorted(files):
+            if not name.lower().endswith((".jpg", ".jpeg")):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                with open(path, "rb") as f:
+                    head = f.read(256 * 1024)
+                _, exif = read_image_header(head)
+            except Exception:
+                continue
+            geo = image_geolocation_from_exif(exif)
+            if geo:
+                yield path, geo["lat"], geo["lon"]
+
+
+def _load_reference(path: str) -> Image.Image:
+    img = Image.open(path)
+    img.draft("RGB", (256, 256))  # descriptor works at 64px, no need for a full decode
+    return img.convert("RGB")
+
+
+def build_or_extend(images_dir: str, index_dir: str, nlist: int = 1024, pq_m: int = 24,
+                    batch_size: int = 256) -> Dict[str, Any]:
+    faiss = _faiss()
+    os.makedirs(index_dir, exist_ok=True)
+    index_path = os.path.join(index_dir, "index.faiss")
+    coords_path = os.path.join(index_dir, "coords.npy")
+    sources_path = os.path.join(index_dir, "sources.txt")
+
+    known = set()
+    if os.path.exists(sources_path):
+        with open(sources_path) as f:
+            known = {line.rstrip("\n") for line in f}
+    todo = [(p, lat, lon) for p, lat, lon in iter_geotagged_images(images_dir) if p not in known]
+    logger.info("%d new geotagged images (%d already indexed)", len(todo), len(known))
+
+    vecs, coords, sources = [], [], []
+    for start in range(0, len(todo), batch_size):
+        chunk = todo[start:start + batch_size]
+        imgs, kept = [], []
+        for p, lat, lon in chunk:
+            try:
+                imgs.append(_load_reference(p))
+                kept.append((p, lat, lon))
+            except Exception:
+                logger.warning("Skipping unreadable %s", p)
+        if imgs:
+            vecs.append(descriptors(imgs))
+            coords.extend((lat, lon) for _, lat, lon in kept)
+            sources.extend(p for p, _, _ in kept)
+        logger.info("Described %d / %d", min(start + batch_size, len(todo)), len(todo))
+    new_vecs = np.concatenate(vecs) if vecs else np.zeros((0, DESCRIPTOR_DIM), dtype=np.float32)
+
+    # IVF-PQ needs ~39 training points per list and per PQ centroid (256);
+    # small reference sets get a flat index
+    min_train = 39 * max(nlist, 256)
+    if os.path.exists(index_path):
+        index = faiss.read_index(index_path)
+        with open(os.path.join(index_dir, "meta.json")) as f:
+            factory = json.load(f)["factory"]
+        old_coords = np.load(coords_path)
+        if factory == "Flat" and index.ntotal + len(new_vecs) >= min_train:
+            # grown past the flat stage: train IVF-PQ on everything and re-add the
+            # old vectors first so their ids (rows of coords.npy) stay the same
+            logger.info("Rebuilding flat index (%d + %d vectors) as IVF%d,PQ%d",
+                        index.ntotal, len(new_vecs), nlist, pq_m)
+            old_vecs = index.reconstruct_n(0, index.ntotal)
+            factory = f"IVF{nlist},PQ{pq_m}"
+            index = faiss.index_factory(DESCRIPTOR_DIM, factory, faiss.METRIC_INNER_PRODUCT)
+            index.train(np.concatenate([old_vecs, new_vecs]))
+            index.add(old_vecs)
+    else:
+        factory = f"IVF{nlist},PQ{pq_m}" if len(new_vecs) >= min_train else "Flat"
+        index = faiss.index_factory(DESCRIPTOR_DIM, factory, faiss.METRIC_INNER_PRODUCT)
+        if not index.is_trained:
+            index.train(new_vecs)
+        old_coords = np.zeros((0, 2), dtype=np.float64)
+
+    if len(new_vecs):
+        index.add(new_vecs)  # ids continue at ntotal == len(old_coords)
+    all_coords = np.concatenate([old_coords, np.asarray(coords, dtype=np.float64).reshape(-1, 2)])
+    if index.ntotal != len(all_coords):
+        raise RuntimeError(f"Index has {index.ntotal} vectors but {len(all_coords)} coordinates")
+
+    faiss.write_index(index, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
+    np.save(coords_path + ".tmp.npy", all_coords)
+    os.replace(coords_path + ".tmp.npy", coords_path)
+    with open(sources_path, "a") as f:
+        for p in sources:
+            f.write(p + "\n")
+    meta = {"descriptor_version": DESCRIPTOR_VERSION, "dim": DESCRIPTOR_DIM, "factory": factory,
+            "count": int(index.ntotal)}
+    with open(os.path.join(index_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return meta
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Visual localization index tool")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="build or incrementally extend the index from geotagged JPEGs")
+    b.add_argument("images_dir")
+    b.add_argument("index_dir")
+    b.add_argument("--nlist", type=int, default=1024)
+    b.add_argument("--pq-m", type=int, default=24, help=f"PQ sub-quantizers, must divide {DESCRIPTOR_DIM}")
+    q = sub.add_parser("query", help="localize one image")
+    q.add_argument("index_dir")
+    q.add_argument("image")
+    q.add_argument("-k", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "build":
+        print(json.dumps(build_or_extend(args.images_dir, args.index_dir, args.nlist, args.pq_m), indent=2))
+    else:
+        locator = VisualLocalizer(args.index_dir, k=args.k, min_similarity=0.0)
+        print(json.dumps(locator.locate(_load_reference(args.image)), indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())